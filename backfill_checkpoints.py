@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import datetime
+import pytz
+
+# One document per completed (symbol, timeframe, start, end) range
+CHECKPOINT_COLLECTION = "fetch_checkpoints"
+# Ranges recorded by the CSV importer (csv_importer.py, CSV-to-mongo.ipynb)
+IMPORTED_RANGES_COLLECTION = "imported_ranges"
+
+# Ranges closer than this are treated as contiguous
+RANGE_TOLERANCE = datetime.timedelta(seconds=1)
+
+
+def as_utc(dt):
+    """MongoDB returns naive UTC datetimes; make them timezone aware"""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=pytz.UTC)
+    return dt.astimezone(pytz.UTC)
+
+
+def merge_ranges(ranges, tolerance=RANGE_TOLERANCE):
+    """Merge overlapping or touching (start, end) ranges into a sorted list"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + tolerance:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_ranges(start, end, covered, tolerance=RANGE_TOLERANCE):
+    """Return the parts of [start, end] that are not in covered"""
+    missing = []
+    current = start
+    for c_start, c_end in merge_ranges(covered, tolerance):
+        if c_end <= current:
+            continue
+        if c_start >= end:
+            break
+        if c_start - current > tolerance:
+            missing.append((current, c_start))
+        current = max(current, c_end)
+    if end - current > tolerance:
+        missing.append((current, end))
+    return missing
+
+
+def ensure_indexes(db):
+    db[CHECKPOINT_COLLECTION].create_index([("symbol", 1), ("timeframe", 1), ("start", 1)])
+
+
+def load_imported(db, symbol, timeframe):
+    """Return the merged ranges recorded for symbol/timeframe by CSV imports"""
+    query = {"symbol": symbol, "timeframe": timeframe}
+    return merge_ranges(
+        (as_utc(doc["start_datetime"]), as_utc(doc["end_datetime"]))
+        for doc in db[IMPORTED_RANGES_COLLECTION].find(query, {"start_datetime": 1, "end_datetime": 1})
+    )
+
+
+def load_coverage(db, symbol, timeframe):
+    """
+    Return the merged ranges already stored for symbol/timeframe (e.g. 'M1'),
+    from fetch checkpoints and from imported CSV ranges.
+    """
+    ranges = list(load_imported(db, symbol, timeframe))
+    query = {"symbol": symbol, "timeframe": timeframe}
+    for doc in db[CHECKPOINT_COLLECTION].find(query, {"start": 1, "end": 1}):
+        ranges.append((as_utc(doc["start"]), as_utc(doc["end"])))
+    return merge_ranges(ranges)
+
+
+def load_empty(db, symbol, timeframe):
+    """Return the merged ranges of symbol/timeframe that were fetched and came back without bars"""
+    query = {"symbol": symbol, "timeframe": timeframe, "candles": 0}
+    return merge_ranges(
+        (as_utc(doc["start"]), as_utc(doc["end"]))
+        for doc in db[CHECKPOINT_COLLECTION].find(query, {"start": 1, "end": 1})
+    )
+
+
+def load_recorded(db, symbol, timeframe):
+    """
+    Return (start, end, recorded_at) of every fetched or imported range of
+    symbol/timeframe, unmerged; recorded_at changes whenever a range is
+    fetched or imported again.
+    """
+    query = {"symbol": symbol, "timeframe": timeframe}
+    recorded = []
+    for doc in db[CHECKPOINT_COLLECTION].find(query, {"start": 1, "end": 1, "completed_at": 1}):
+        recorded.append((as_utc(doc["start"]), as_utc(doc["end"]), as_utc(doc["completed_at"])))
+    fields = {"start_datetime": 1, "end_datetime": 1, "imported_at": 1}
+    for doc in db[IMPORTED_RANGES_COLLECTION].find(query, fields):
+        recorded.append((as_utc(doc["start_datetime"]), as_utc(doc["end_datetime"]), as_utc(doc["imported_at"])))
+    return recorded
+
+
+def record_range(db, symbol, timeframe, start, end, candles=None):
+    """Record that [start, end] was fetched and stored for symbol/timeframe"""
+    db[CHECKPOINT_COLLECTION].update_one(
+        {"symbol": symbol, "timeframe": timeframe, "start": start, "end": end},
+        {"$set": {
+            "candles": candles,
+            "completed_at": datetime.datetime.now(pytz.UTC)
+        }},
+        upsert=True
+    )
+
+
+def record_import(db, symbol, timeframe, start, end, filename, rows=None):
+    """Record that the CSV file covering [start, end] was imported for symbol/timeframe"""
+    db[IMPORTED_RANGES_COLLECTION].update_one(
+        {"symbol": symbol, "timeframe": timeframe, "filename": filename},
+        {"$set": {
+            "symbol": symbol,
+            "timeframe": timeframe,
+            "start_datetime": start,
+            "end_datetime": end,
+            "filename": filename,
+            "rows": rows,
+            "imported_at": datetime.datetime.now(pytz.UTC)
+        }},
+        upsert=True
+    )
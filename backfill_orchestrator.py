@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+import logging
+import argparse
+import multiprocessing
+import queue
+import sys
+import time
+import pytz
+from pymongo import MongoClient
+
+import backfill_checkpoints
+from rate_limiter import TokenBucket
+
+TIMEFRAMES = ['M1', 'M5', 'M15', 'M30', 'H1', 'H4', 'D1']
+
+UTC_TZ = pytz.timezone('UTC')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Backfill historical candles for many symbols and timeframes in parallel, '
+                    'one worker process per MT5 terminal')
+    parser.add_argument('--symbols', required=True, help='Comma-separated symbols (e.g. EURUSD,XAUUSD)')
+    parser.add_argument('--timeframes', required=True,
+                        help=f'Comma-separated timeframes from {",".join(TIMEFRAMES)}')
+    parser.add_argument('--start_date', required=True, help='Start date in format YYYY-MM-DD')
+    parser.add_argument('--end_date', required=True, help='End date in format YYYY-MM-DD')
+    parser.add_argument('--terminals', default=None,
+                        help='JSON file with a list of MT5 terminals '
+                             '({"path", "account", "password", "server"}); one worker per terminal. '
+                             'Without it a single worker uses the default terminal')
+    parser.add_argument('--mongo_uri', default="mongodb://localhost:27017/",
+                        help='MongoDB URI (default: mongodb://localhost:27017/)')
+    parser.add_argument('--chunk_days', type=int, default=None,
+                        help='Maximum number of days per chunk (default: chunks sized by --page_bars)')
+    parser.add_argument('--page_bars', type=int, default=50000,
+                        help='Bars per chunk, each fetched with one copy_rates_range call (default: 50000)')
+    parser.add_argument('--server_utc_offset', type=float, default=0,
+                        help='Hours the broker\'s server time is ahead of UTC, used to place the '
+                             'weekend closure in bar times (default: 0)')
+    parser.add_argument('--min_data_points', type=int, default=10,
+                        help='Minimum number of bars for a chunk to be stored, capped at the bars the chunk\'s '
+                             'trading sessions can hold (default: 10)')
+    parser.add_argument('--requests_per_second', type=float, default=10.0,
+                        help='Maximum MT5 data requests per second across all workers (default: 10)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip ranges already recorded as stored')
+    return parser.parse_args()
+
+
+def load_terminals(path):
+    """Return the list of terminal login parameters for mt5.initialize()"""
+    if path is None:
+        return [{}]
+    with open(path) as f:
+        terminals = json.load(f)
+    params = []
+    for t in terminals:
+        p = {}
+        if t.get('path'):
+            p['path'] = t['path']
+        if t.get('account'):
+            p['login'] = int(t['account'])
+        if t.get('password'):
+            p['password'] = t['password']
+        if t.get('server'):
+            p['server'] = t['server']
+        params.append(p)
+    return params
+
+
+def worker(worker_id, terminal, mongo_uri, min_data_points, tasks, results, rate_limiter, utc_offset=0):
+    """Process chunk tasks on one MT5 terminal until the None sentinel arrives"""
+    import MetaTrader5 as mt5
+    import fetch_planner
+    from historical_data_fetcher import TIMEFRAME_MAP, store_candles_mongodb
+
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s %(levelname)s [worker {worker_id}] %(message)s")
+    if not mt5.initialize(**terminal):
+        logging.critical(f"MT5 initialize() failed: {mt5.last_error()}")
+        results.put(('worker_failed', worker_id, str(mt5.last_error())))
+        return
+    client = MongoClient(mongo_uri)
+    db = client["mt5_historical_data"]
+    max_bars = fetch_planner.terminal_max_bars()
+    collections = {}
+    # per job, so a result cut off at this terminal's bar limit is split and fetched again
+    planners = {}
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            symbol, timeframe_str, chunk_start, chunk_end = task
+            started = time.monotonic()
+            try:
+                key = (symbol, timeframe_str)
+                if key not in collections:
+                    col = db[f"candles_{symbol}_{timeframe_str}"]
+                    col.create_index([("symbol", 1), ("time", 1)], unique=True)
+                    collections[key] = col
+                    planners[key] = fetch_planner.FetchPlanner(timeframe_str, max_bars=max_bars,
+                                                               utc_offset=utc_offset)
+                timeframe = TIMEFRAME_MAP[timeframe_str]
+                candles = fetch_planner.fetch_window(symbol, timeframe, planners[key], chunk_start, chunk_end,
+                                                     rate_limiter)
+                if candles is None:
+                    raise RuntimeError(f"mt5.copy_rates_range failed: {mt5.last_error()}")
+                inserted = 0
+                # a short window at the end of a range may hold fewer than min_data_points bars
+                if len(candles) >= min(min_data_points, planners[key].expected_bars(chunk_start, chunk_end)):
+                    inserted = store_candles_mongodb(collections[key], symbol, candles, timeframe)
+                    backfill_checkpoints.record_range(db, symbol, timeframe_str, chunk_start, chunk_end,
+                                                      len(candles))
+                results.put(('done', task, len(candles), inserted, time.monotonic() - started, None))
+            except Exception as e:
+                logging.error(f"{symbol} {timeframe_str} {chunk_start.isoformat()}: {e}")
+                results.put(('done', task, 0, 0, time.monotonic() - started, str(e)))
+    finally:
+        mt5.shutdown()
+        client.close()
+
+
+def build_tasks(db, symbols, timeframes, start_date, end_date, page_bars, chunk_days, resume, utc_offset=0):
+    """
+    Return {(symbol, timeframe): [chunk tasks]} for the job matrix, with
+    the copy_rates_range windows of fetch_planner.FetchPlanner as chunks
+    """
+    import fetch_planner
+    max_window = datetime.timedelta(days=chunk_days) if chunk_days else None
+    jobs = {}
+    for symbol in symbols:
+        for timeframe_str in timeframes:
+            missing = [(start_date, end_date)]
+            if resume:
+                covered = backfill_checkpoints.load_coverage(db, symbol, timeframe_str)
+                missing = backfill_checkpoints.subtract_ranges(start_date, end_date, covered)
+            planner = fetch_planner.FetchPlanner(timeframe_str, page_bars, max_window=max_window,
+                                                 utc_offset=utc_offset)
+            jobs[(symbol, timeframe_str)] = [
+                (symbol, timeframe_str, chunk_start, chunk_end)
+                for chunk_start, chunk_end, _ in planner.plan(missing)
+            ]
+    return jobs
+
+
+def interleave(jobs):
+    """Round-robin the chunks of all jobs so every job makes progress"""
+    lists = list(jobs.values())
+    for i in range(max((len(chunks) for chunks in lists), default=0)):
+        for chunks in lists:
+            if i < len(chunks):
+                yield chunks[i]
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    args = parse_args()
+    symbols = [s.strip() for s in args.symbols.split(',') if s.strip()]
+    timeframes = [t.strip() for t in args.timeframes.split(',') if t.strip()]
+    unknown = [t for t in timeframes if t not in TIMEFRAMES]
+    if unknown:
+        logging.critical(f"Unknown timeframes: {', '.join(unknown)}")
+        sys.exit(1)
+
+    try:
+        start_date = datetime.datetime.strptime(args.start_date, "%Y-%m-%d").replace(tzinfo=UTC_TZ)
+        end_date = datetime.datetime.strptime(args.end_date, "%Y-%m-%d")
+        end_date = end_date.replace(hour=23, minute=59, second=59, tzinfo=UTC_TZ)
+        if start_date >= end_date:
+            logging.critical("Start date must be before end date")
+            sys.exit(1)
+    except ValueError as e:
+        logging.critical(f"Invalid date format. Use YYYY-MM-DD: {e}")
+        sys.exit(1)
+
+    terminals = load_terminals(args.terminals)
+
+    client = MongoClient(args.mongo_uri)
+    db = client["mt5_historical_data"]
+    backfill_checkpoints.ensure_indexes(db)
+    jobs = build_tasks(db, symbols, timeframes, start_date, end_date, args.page_bars, args.chunk_days, args.resume,
+                       args.server_utc_offset)
+    client.close()
+
+    total_chunks = sum(len(chunks) for chunks in jobs.values())
+    logging.info(f"{len(jobs)} jobs, {total_chunks} chunks, {len(terminals)} workers")
+    if total_chunks == 0:
+        logging.info("Nothing to fetch")
+        return
+
+    rate_limiter = TokenBucket(args.requests_per_second)
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for task in interleave(jobs):
+        tasks.put(task)
+    for _ in terminals:
+        tasks.put(None)
+
+    workers = [
+        multiprocessing.Process(target=worker, name=f"backfill-{i}",
+                                args=(i, terminal, args.mongo_uri, args.min_data_points,
+                                      tasks, results, rate_limiter, args.server_utc_offset))
+        for i, terminal in enumerate(terminals)
+    ]
+    started = time.monotonic()
+    for w in workers:
+        w.start()
+
+    progress = {key: {'chunks': 0, 'bars': 0, 'inserted': 0, 'errors': 0, 'seconds': 0.0} for key in jobs}
+    finished = 0
+    try:
+        while finished < total_chunks:
+            try:
+                result = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(w.is_alive() for w in workers):
+                    logging.error(f"All workers stopped with {total_chunks - finished} chunks left")
+                    break
+                continue
+            if result[0] == 'worker_failed':
+                logging.error(f"Worker {result[1]} failed to start: {result[2]}")
+                continue
+            _, task, bars, inserted, seconds, error = result
+            symbol, timeframe_str, chunk_start, chunk_end = task
+            job = progress[(symbol, timeframe_str)]
+            job['chunks'] += 1
+            job['bars'] += bars
+            job['inserted'] += inserted
+            job['seconds'] += seconds
+            job['errors'] += 1 if error else 0
+            finished += 1
+            logging.info(f"{symbol} {timeframe_str}: chunk {job['chunks']}/{len(jobs[(symbol, timeframe_str)])} "
+                         f"{chunk_start.isoformat()} to {chunk_end.isoformat()}: {bars} bars, {inserted} inserted "
+                         f"in {seconds:.2f}s; overall {finished}/{total_chunks}")
+    except KeyboardInterrupt:
+        logging.info("Interrupted by user, stopping workers")
+        for w in workers:
+            w.terminate()
+    finally:
+        for w in workers:
+            w.join()
+
+    elapsed = time.monotonic() - started
+    total_bars = sum(job['bars'] for job in progress.values())
+    for (symbol, timeframe_str), job in progress.items():
+        rate = job['bars'] / job['seconds'] if job['seconds'] else 0.0
+        logging.info(f"{symbol} {timeframe_str}: {job['chunks']}/{len(jobs[(symbol, timeframe_str)])} chunks, "
+                     f"{job['bars']} bars, {job['inserted']} inserted, {job['errors']} errors, "
+                     f"{rate:.0f} bars/sec")
+    logging.info(f"Completed {finished}/{total_chunks} chunks: {total_bars} bars in {elapsed:.1f}s "
+                 f"({total_bars / elapsed if elapsed else 0.0:.0f} bars/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+In-memory stand-in for the parts of pymongo the fetchers use.
+
+It enforces unique indexes and reports duplicates with the same error
+types and details as a server, so the duplicate handling in mongo_bulk
+runs unchanged. Only equality and $gt/$gte/$lt/$lte filters and the
+update operators and update pipeline expressions the repo sends are
+supported.
+"""
+
+import copy
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, errors
+from pymongo.results import BulkWriteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+DUPLICATE_KEY = 11000
+
+_COMPARE = {
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b,
+    '$ne': lambda a, b: a != b
+}
+
+
+def _matches(doc, query):
+    for field, cond in (query or {}).items():
+        value = doc.get(field)
+        if isinstance(cond, dict) and any(k.startswith('$') for k in cond):
+            if value is None:
+                return False
+            if not all(_COMPARE[op](value, arg) for op, arg in cond.items()):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _path(doc, path):
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, list):
+            value = [item.get(part) for item in value if isinstance(item, dict)]
+        else:
+            value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _minmax(pick, values):
+    values = [v for v in values if v is not None]
+    return pick(values) if values else None
+
+
+def _slice(array, n):
+    return array[:n] if n >= 0 else array[n:]
+
+
+def _sort_array(array, sort_by):
+    for field, order in reversed(list(sort_by.items())):
+        array = sorted(array, key=lambda item: _path(item, field), reverse=order < 0)
+    return array
+
+
+_EXPRESSIONS = {
+    '$ifNull': lambda ev, args: next((v for v in map(ev, args) if v is not None), None),
+    '$cond': lambda ev, args: ev(args[1]) if ev(args[0]) else ev(args[2]),
+    '$eq': lambda ev, args: ev(args[0]) == ev(args[1]),
+    '$gt': lambda ev, args: ev(args[0]) > ev(args[1]),
+    '$lt': lambda ev, args: ev(args[0]) < ev(args[1]),
+    '$in': lambda ev, args: ev(args[0]) in ev(args[1]),
+    '$not': lambda ev, args: not ev(args[0]),
+    '$or': lambda ev, args: any(ev(a) for a in args),
+    '$add': lambda ev, args: sum(ev(a) for a in args),
+    '$subtract': lambda ev, args: ev(args[0]) - ev(args[1]),
+    '$min': lambda ev, args: _minmax(min, [ev(a) for a in args]),
+    '$max': lambda ev, args: _minmax(max, [ev(a) for a in args]),
+    '$size': lambda ev, arg: len(ev(arg)),
+    '$slice': lambda ev, args: _slice(ev(args[0]), ev(args[1])),
+    '$arrayElemAt': lambda ev, args: ev(args[0])[ev(args[1])],
+    '$range': lambda ev, args: list(range(ev(args[0]), ev(args[1]))),
+    '$first': lambda ev, arg: (ev(arg) or [None])[0],
+    '$last': lambda ev, arg: (ev(arg) or [None])[-1],
+    '$sortArray': lambda ev, args: _sort_array(ev(args['input']), args['sortBy']),
+    '$concatArrays': lambda ev, args: [v for a in args for v in ev(a)]
+}
+
+
+def _evaluate(expr, doc, variables=None):
+    """Value of an aggregation expression for doc"""
+    variables = variables or {}
+    if isinstance(expr, str) and expr.startswith('$$'):
+        name, _, rest = expr[2:].partition('.')
+        return _path(variables[name], rest) if rest else variables[name]
+    if isinstance(expr, str) and expr.startswith('$'):
+        return _path(doc, expr[1:])
+    if isinstance(expr, list):
+        return [_evaluate(e, doc, variables) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) == 1 and next(iter(expr)).startswith('$'):
+        op, args = next(iter(expr.items()))
+        if op == '$literal':
+            return copy.deepcopy(args)
+        if op == '$filter':
+            return [item for item in _evaluate(args['input'], doc, variables)
+                    if _evaluate(args['cond'], doc, dict(variables, this=item))]
+        if op == '$map':
+            name = args.get('as', 'this')
+            return [_evaluate(args['in'], doc, dict(variables, **{name: item}))
+                    for item in _evaluate(args['input'], doc, variables)]
+        return _EXPRESSIONS[op](lambda e: _evaluate(e, doc, variables), args)
+    return {field: _evaluate(e, doc, variables) for field, e in expr.items()}
+
+
+def _run_pipeline(doc, pipeline):
+    for stage in pipeline:
+        op, spec = next(iter(stage.items()))
+        if op in ('$set', '$addFields'):
+            values = {field: _evaluate(e, doc) for field, e in spec.items()}
+            doc.update(values)
+        elif op == '$unset':
+            for field in [spec] if isinstance(spec, str) else spec:
+                doc.pop(field, None)
+        else:
+            raise ValueError(f"Unsupported pipeline stage {op}")
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    included = [f for f, v in projection.items() if v and f != '_id']
+    if included:
+        out = {f: doc[f] for f in included if f in doc}
+        if projection.get('_id', 1):
+            out['_id'] = doc['_id']
+        return out
+    return {f: v for f, v in doc.items() if f not in projection}
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: d.get(field), reverse=order < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __iter__(self):
+        return iter(self._docs)
+
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._docs = {}
+        self._unique = {}
+
+    def create_index(self, keys, unique=False, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        fields = tuple(field for field, _ in keys)
+        if unique and fields not in self._unique:
+            self._unique[fields] = {self._key(fields, d): _id for _id, d in self._docs.items()}
+        return "_".join(f"{field}_1" for field in fields)
+
+    def index_information(self):
+        info = {"_id_": {"key": [("_id", 1)]}}
+        for fields in self._unique:
+            info["_".join(f"{field}_1" for field in fields)] = {"key": [(f, 1) for f in fields], "unique": True}
+        return info
+
+    @staticmethod
+    def _key(fields, doc):
+        return tuple(doc.get(field) for field in fields)
+
+    def _check_unique(self, doc, ignore_id=None):
+        if doc['_id'] in self._docs and doc['_id'] != ignore_id:
+            raise errors.DuplicateKeyError(f"E11000 duplicate key _id: {doc['_id']}", DUPLICATE_KEY)
+        for fields, index in self._unique.items():
+            owner = index.get(self._key(fields, doc))
+            if owner is not None and owner != ignore_id:
+                raise errors.DuplicateKeyError(f"E11000 duplicate key {fields}", DUPLICATE_KEY)
+
+    def _store(self, doc, previous=None):
+        if previous is not None:
+            for fields, index in self._unique.items():
+                index.pop(self._key(fields, previous), None)
+        self._docs[doc['_id']] = doc
+        for fields, index in self._unique.items():
+            index[self._key(fields, doc)] = doc['_id']
+
+    def insert_one(self, document):
+        document.setdefault('_id', ObjectId())
+        doc = dict(document)
+        self._check_unique(doc)
+        self._store(doc)
+        return InsertOneResult(doc['_id'], True)
+
+    def insert_many(self, documents, ordered=True):
+        result = self.bulk_write([InsertOne(d) for d in documents], ordered=ordered)
+        ids = [d['_id'] for d in documents][:result.inserted_count]
+        return InsertManyResult(ids, True)
+
+    def _apply(self, doc, update, inserting):
+        if isinstance(update, list):
+            _run_pipeline(doc, update)
+            return
+        for op, fields in update.items():
+            for field, value in fields.items():
+                if op == '$set' or (op == '$setOnInsert' and inserting):
+                    doc[field] = value
+                elif op == '$inc':
+                    doc[field] = doc.get(field, 0) + value
+                elif op == '$push':
+                    items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                    doc[field] = doc.get(field, []) + list(items)
+                elif op == '$min':
+                    doc[field] = value if field not in doc else min(doc[field], value)
+                elif op == '$max':
+                    doc[field] = value if field not in doc else max(doc[field], value)
+
+    def _locate(self, query):
+        """Document matching query; looked up by key when query names _id or a unique index"""
+        if set(query) == {'_id'} and not isinstance(query['_id'], dict):
+            return self._docs.get(query['_id'])
+        for fields, index in self._unique.items():
+            if set(fields) == set(query):
+                _id = index.get(self._key(fields, query))
+                return self._docs.get(_id) if _id is not None else None
+        return next((d for d in self._docs.values() if _matches(d, query)), None)
+
+    def update_one(self, query, update, upsert=False):
+        existing = self._locate(query)
+        if existing is not None:
+            doc = copy.copy(existing)
+            self._apply(doc, update, inserting=False)
+            self._check_unique(doc, ignore_id=existing['_id'])
+            self._store(doc, previous=existing)
+            return UpdateResult({'n': 1, 'nModified': int(doc != existing), 'updatedExisting': True}, True)
+        if not upsert:
+            return UpdateResult({'n': 0, 'nModified': 0, 'updatedExisting': False}, True)
+        doc = {f: v for f, v in query.items() if not isinstance(v, dict)}
+        self._apply(doc, update, inserting=True)
+        doc.setdefault('_id', ObjectId())
+        self._check_unique(doc)
+        self._store(doc)
+        return UpdateResult({'n': 1, 'nModified': 0, 'upserted': doc['_id'], 'updatedExisting': False}, True)
+
+    def bulk_write(self, requests, ordered=True):
+        details = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0,
+                   'nRemoved': 0, 'upserted': [], 'writeErrors': [], 'writeConcernErrors': []}
+        for i, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self.insert_one(request._doc)
+                    details['nInserted'] += 1
+                elif isinstance(request, UpdateOne):
+                    result = self.update_one(request._filter, request._doc, upsert=request._upsert)
+                    raw = result.raw_result
+                    if 'upserted' in raw:
+                        details['nUpserted'] += 1
+                        details['upserted'].append({'index': i, '_id': raw['upserted']})
+                    else:
+                        details['nMatched'] += raw['n']
+                        details['nModified'] += raw['nModified']
+                else:
+                    raise TypeError(f"Unsupported request {request!r}")
+            except errors.DuplicateKeyError as e:
+                details['writeErrors'].append({'index': i, 'code': DUPLICATE_KEY, 'errmsg': str(e)})
+                if ordered:
+                    break
+        if details['writeErrors']:
+            raise errors.BulkWriteError(details)
+        return BulkWriteResult(details, True)
+
+    def find(self, filter=None, projection=None):
+        return FakeCursor([_project(d, projection) for d in self._docs.values() if _matches(d, filter)])
+
+    def find_one(self, filter=None, projection=None, sort=None):
+        cursor = self.find(filter, projection)
+        if sort:
+            cursor.sort(sort)
+        return next(iter(cursor), None)
+
+    def count_documents(self, filter):
+        return sum(1 for d in self._docs.values() if _matches(d, filter))
+
+    def estimated_document_count(self):
+        return len(self._docs)
+
+
+class FakeDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def list_collection_names(self, filter=None):
+        names = list(self._collections)
+        if filter and 'name' in filter:
+            names = [n for n in names if n == filter['name']]
+        return names
+
+    def create_collection(self, name, **kwargs):
+        return self[name]
+
+    def drop_collection(self, name):
+        self._collections.pop(name, None)
+
+
+class FakeClient:
+    """MongoClient look-alike keeping every database in memory"""
+
+    def __init__(self, *args, **kwargs):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(self, name)
+        return self._databases[name]
+
+    def drop_database(self, name):
+        self._databases.pop(name, None)
+
+    def close(self):
+        pass
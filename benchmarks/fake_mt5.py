@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Drop-in stand-in for the MetaTrader5 package, for measuring the ingest
+path without a terminal.
+
+Data is synthetic but deterministic: the same time range always returns
+the same ticks and bars, with the dtypes of the real copy_ticks_* and
+copy_rates_* results. Server time is simulated and only moves when
+set_time() or advance() is called, so a benchmark controls exactly how
+many ticks every poll sees.
+
+    import fake_mt5
+    fake_mt5.install(tick_rate=50)   # registers itself as MetaTrader5
+    import tick_fetcher
+"""
+
+import collections
+import datetime
+import sys
+import numpy as np
+
+__version__ = "fake-5.0"
+
+TIMEFRAME_M1 = 1
+TIMEFRAME_M5 = 5
+TIMEFRAME_M15 = 15
+TIMEFRAME_M30 = 30
+TIMEFRAME_H1 = 16385
+TIMEFRAME_H4 = 16388
+TIMEFRAME_D1 = 16408
+
+TIMEFRAME_SECONDS = {
+    TIMEFRAME_M1: 60,
+    TIMEFRAME_M5: 300,
+    TIMEFRAME_M15: 900,
+    TIMEFRAME_M30: 1800,
+    TIMEFRAME_H1: 3600,
+    TIMEFRAME_H4: 14400,
+    TIMEFRAME_D1: 86400
+}
+
+COPY_TICKS_ALL = -1
+COPY_TICKS_INFO = 1
+COPY_TICKS_TRADE = 2
+
+TICK_FLAG_BID = 2
+TICK_FLAG_ASK = 4
+
+TICK_DTYPE = np.dtype([
+    ('time', '<i8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('volume', '<u8'),
+    ('time_msc', '<i8'), ('flags', '<u4'), ('volume_real', '<f8')
+])
+RATES_DTYPE = np.dtype([
+    ('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+    ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8')
+])
+
+Tick = collections.namedtuple('Tick', 'time bid ask last volume time_msc flags volume_real')
+SymbolInfo = collections.namedtuple('SymbolInfo', 'name point digits')
+
+# Wednesday 2024-01-03 10:00:00 server time
+DEFAULT_START = 1704276000
+
+_state = {
+    'now': DEFAULT_START,
+    'tick_rate': 10,
+    'base_price': 1.1,
+    'point': 0.00001,
+    'calls': collections.Counter()
+}
+
+
+def install(tick_rate=10, start=DEFAULT_START, base_price=1.1, point=0.00001):
+    """Register this module as MetaTrader5 and configure the generator"""
+    configure(tick_rate=tick_rate, start=start, base_price=base_price, point=point)
+    sys.modules['MetaTrader5'] = sys.modules[__name__]
+    return sys.modules[__name__]
+
+
+def configure(tick_rate=None, start=None, base_price=None, point=None):
+    if tick_rate is not None:
+        _state['tick_rate'] = int(tick_rate)
+    if start is not None:
+        _state['now'] = int(start)
+    if base_price is not None:
+        _state['base_price'] = base_price
+    if point is not None:
+        _state['point'] = point
+
+
+def set_time(ts):
+    """Set the simulated server time (seconds since epoch)"""
+    _state['now'] = int(ts)
+
+
+def advance(seconds):
+    """Move the simulated server time forward"""
+    _state['now'] += int(seconds)
+
+
+def now():
+    return _state['now']
+
+
+def calls():
+    """Counter of API calls made so far"""
+    return _state['calls']
+
+
+def _to_seconds(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return int(value.timestamp())
+    return int(value)
+
+
+def _hash(values):
+    """Cheap deterministic integer hash, vectorized"""
+    x = values.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    x ^= x >> np.uint64(29)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(32)
+    return x
+
+
+def _price(seconds):
+    """Deterministic mid price for times in seconds (float array)"""
+    noise = (_hash(np.floor(seconds).astype(np.int64)) % np.uint64(1000)).astype(np.float64) / 1000.0
+    return _state['base_price'] * (1 + 0.002 * np.sin(seconds / 3600.0) + 0.0002 * (noise - 0.5))
+
+
+def _ticks_between(start_sec, end_sec):
+    """All ticks with start_sec <= time < end_sec"""
+    if end_sec <= start_sec:
+        return np.zeros(0, dtype=TICK_DTYPE)
+    rate = _state['tick_rate']
+    seconds = np.repeat(np.arange(start_sec, end_sec, dtype=np.int64), rate)
+    slot = np.tile(np.arange(rate, dtype=np.int64), end_sec - start_sec)
+    # spread the ticks of one second over distinct milliseconds, in order
+    width = max(1, 1000 // rate) if rate else 1000
+    jitter = (_hash(seconds * 1000 + slot) % np.uint64(width)).astype(np.int64)
+    msc = seconds * 1000 + np.minimum(slot * width + jitter, 999)
+    ticks = np.zeros(len(msc), dtype=TICK_DTYPE)
+    ticks['time_msc'] = msc
+    ticks['time'] = seconds
+    point = _state['point']
+    mid = _price(msc / 1000.0)
+    spread = (1 + _hash(msc) % np.uint64(20)).astype(np.float64) * point
+    ticks['bid'] = np.round(mid - spread / 2, 5)
+    ticks['ask'] = np.round(ticks['bid'] + spread, 5)
+    ticks['flags'] = TICK_FLAG_BID | TICK_FLAG_ASK
+    return ticks
+
+
+def _rates_between(timeframe, first_bar, count):
+    """count consecutive bars starting at bar time first_bar"""
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    times = first_bar + np.arange(count, dtype=np.int64) * seconds
+    rates = np.zeros(count, dtype=RATES_DTYPE)
+    rates['time'] = times
+    opens = _price(times.astype(np.float64))
+    closes = _price((times + seconds - 1).astype(np.float64))
+    wiggle = (_hash(times) % np.uint64(50)).astype(np.float64) * _state['point']
+    rates['open'] = np.round(opens, 5)
+    rates['close'] = np.round(closes, 5)
+    rates['high'] = np.round(np.maximum(opens, closes) + wiggle, 5)
+    rates['low'] = np.round(np.minimum(opens, closes) - wiggle, 5)
+    rates['tick_volume'] = _state['tick_rate'] * seconds
+    rates['spread'] = 1 + (_hash(times) % np.uint64(20)).astype(np.int32)
+    return rates
+
+
+def initialize(*args, **kwargs):
+    _state['calls']['initialize'] += 1
+    return True
+
+
+def shutdown():
+    _state['calls']['shutdown'] += 1
+
+
+def last_error():
+    return (1, 'Success')
+
+
+def terminal_info():
+    return None
+
+
+def version():
+    return (500, 0, '01 Jan 2024')
+
+
+def symbol_select(symbol, enable=True):
+    return True
+
+
+def symbol_info(symbol):
+    return SymbolInfo(symbol, _state['point'], 5)
+
+
+def symbol_info_tick(symbol):
+    _state['calls']['symbol_info_tick'] += 1
+    now_sec = _state['now']
+    ticks = _ticks_between(now_sec - 1, now_sec + 1)
+    if len(ticks) == 0:
+        return None
+    return Tick(*ticks[-1].tolist())
+
+
+def copy_ticks_from(symbol, date_from, count, flags):
+    """count ticks at or before date_from (enough for the history bootstrap)"""
+    _state['calls']['copy_ticks_from'] += 1
+    end = _to_seconds(date_from) + 1
+    rate = max(1, _state['tick_rate'])
+    start = end - (count // rate + 1)
+    return _ticks_between(start, min(end, _state['now'] + 1))[-count:]
+
+
+def copy_ticks_range(symbol, date_from, date_to, flags):
+    _state['calls']['copy_ticks_range'] += 1
+    start = _to_seconds(date_from)
+    end = min(_to_seconds(date_to), _state['now']) + 1
+    return _ticks_between(start, end)
+
+
+def copy_rates_from(symbol, timeframe, date_from, count):
+    """count bars ending at date_from, newest last, like the real terminal"""
+    _state['calls']['copy_rates_from'] += 1
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    newest = min(_to_seconds(date_from), _state['now']) // seconds * seconds
+    return _rates_between(timeframe, newest - (count - 1) * seconds, count)
+
+
+def copy_rates_from_pos(symbol, timeframe, start_pos, count):
+    _state['calls']['copy_rates_from_pos'] += 1
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    newest = _state['now'] // seconds * seconds - start_pos * seconds
+    return _rates_between(timeframe, newest - (count - 1) * seconds, count)
+
+
+def copy_rates_range(symbol, timeframe, date_from, date_to):
+    _state['calls']['copy_rates_range'] += 1
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    first = -(-_to_seconds(date_from) // seconds) * seconds
+    last = min(_to_seconds(date_to), _state['now']) // seconds * seconds
+    count = max(0, (last - first) // seconds + 1)
+    return _rates_between(timeframe, first, count)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks of the ingest path.
+
+MetaTrader5 is replaced by benchmarks/fake_mt5.py, so this runs on any OS.
+Writes go to an in-memory MongoDB stand-in unless --mongo_uri points at a
+real mongod (the --db_name database is dropped before and after the run).
+
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json --threshold 10
+
+With --baseline, each benchmark's throughput is compared to the stored run
+and the exit code is 1 when any of them dropped by more than --threshold
+percent.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import fake_mt5
+fake_mt5.install()
+
+import numpy as np
+from pymongo import MongoClient
+
+import candle_fetcher
+import fetch_planner
+import historical_data_fetcher
+import metrics
+import tick_fetcher
+from candle_aggregator import candle_collection
+from fake_mongo import FakeClient
+from tick_buckets import STORAGE_MODES
+
+BENCHMARKS = ['tick_fetch_and_store', 'candle_fetch_and_store', 'fetch_planned_candles', 'store_candles_mongodb',
+              'write_candles_csv']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the MT5 ingest path against a fake terminal")
+    parser.add_argument("--mongo_uri", default=None,
+                        help="MongoDB URI of a local mongod; default is an in-memory stand-in")
+    parser.add_argument("--db_name", default="mt5_benchmark", help="Database used (and dropped) for the run")
+    parser.add_argument("--symbol", default="EURUSD", help="Symbol name passed to the fake terminal")
+    parser.add_argument("--tick_rate", type=int, default=20, help="Ticks per second generated by the fake terminal")
+    parser.add_argument("--poll_seconds", type=int, default=1,
+                        help="Simulated seconds between two tick polls")
+    parser.add_argument("--cycles", type=int, default=200, help="Polls per live fetcher benchmark")
+    parser.add_argument("--storage", default="documents", choices=STORAGE_MODES,
+                        help="Tick storage mode used by tick_fetch_and_store")
+    parser.add_argument("--history_days", type=int, default=30,
+                        help="Days of M1 candles used by the historical benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions of the historical benchmarks")
+    parser.add_argument("--only", default=None,
+                        help=f"Comma-separated subset of benchmarks to run: {','.join(BENCHMARKS)}")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Enable the metrics instrumentation (served on an ephemeral port) to measure its cost")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Throughput drop in percent reported as a regression")
+    args = parser.parse_args()
+    if args.only:
+        args.only = [name.strip() for name in args.only.split(',') if name.strip()]
+        unknown = sorted(set(args.only) - set(BENCHMARKS))
+        if unknown:
+            parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    else:
+        args.only = BENCHMARKS
+    return args
+
+
+def summarize(durations, items):
+    """Throughput and latency figures for a list of per-call durations in seconds"""
+    durations = np.asarray(durations, dtype=float)
+    total = float(durations.sum())
+    return {
+        "calls": len(durations),
+        "items": int(items),
+        "seconds": round(total, 6),
+        "items_per_sec": round(items / total, 1) if total > 0 else None,
+        "latency_ms": {
+            "mean": round(float(durations.mean()) * 1000, 3),
+            "p50": round(float(np.percentile(durations, 50)) * 1000, 3),
+            "p95": round(float(np.percentile(durations, 95)) * 1000, 3),
+            "max": round(float(durations.max()) * 1000, 3)
+        }
+    }
+
+
+def bench_tick_fetch_and_store(db, args):
+    """One poll per simulated interval; the first call only sets the cursor"""
+    fake_mt5.set_time(fake_mt5.DEFAULT_START)
+    collection = tick_fetcher.tick_collection(db.client, db.name, args.symbol, args.storage)
+    cursors = {}
+    tick_fetcher.fetch_and_store(collection, args.symbol, 1000, cursors, storage=args.storage)
+    durations = []
+    items = 0
+    for _ in range(args.cycles):
+        fake_mt5.advance(args.poll_seconds)
+        start = time.perf_counter()
+        items += tick_fetcher.fetch_and_store(collection, args.symbol, 1000, cursors, storage=args.storage)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, items)
+
+
+def bench_candle_fetch_and_store(db, args):
+    """One M1 poll per simulated minute, storing the bar that just closed"""
+    fake_mt5.set_time(fake_mt5.DEFAULT_START)
+    collection = candle_collection(db, args.symbol, 'M1')
+    live = db[f"candles_{args.symbol}_M1_live"]
+    cursors = {}
+    candle_fetcher.fetch_and_store(collection, args.symbol, fake_mt5.TIMEFRAME_M1, 100, cursors,
+                                   live_collection=live)
+    durations = []
+    items = 0
+    for _ in range(args.cycles):
+        fake_mt5.advance(60)
+        start = time.perf_counter()
+        items += candle_fetcher.fetch_and_store(collection, args.symbol, fake_mt5.TIMEFRAME_M1, 100, cursors,
+                                                live_collection=live)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, items)
+
+
+def history_window(args):
+    """(from_date, to_date) of the historical benchmarks, ending at the fake terminal's clock"""
+    fake_mt5.set_time(fake_mt5.DEFAULT_START)
+    to_date = datetime.datetime.fromtimestamp(fake_mt5.DEFAULT_START, tz=datetime.timezone.utc)
+    return to_date - datetime.timedelta(days=args.history_days), to_date
+
+
+def planned_candles(args):
+    """The history window's M1 bars, fetched with the planner's copy_rates_range windows"""
+    from_date, to_date = history_window(args)
+    planner = fetch_planner.FetchPlanner('M1')
+    return np.concatenate([fetch_planner.fetch_window(args.symbol, fake_mt5.TIMEFRAME_M1, planner, start, end)
+                           for start, end, _ in planner.windows(from_date, to_date)])
+
+
+def bench_fetch_planned_candles(db, args):
+    """The history window fetched with the planner's copy_rates_range windows"""
+    from_date, to_date = history_window(args)
+    durations = []
+    items = 0
+    for _ in range(args.repeat):
+        planner = fetch_planner.FetchPlanner('M1')
+        start = time.perf_counter()
+        for window_start, window_end, _ in planner.windows(from_date, to_date):
+            items += len(fetch_planner.fetch_window(args.symbol, fake_mt5.TIMEFRAME_M1, planner,
+                                                    window_start, window_end))
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, items)
+
+
+def bench_store_candles_mongodb(db, args):
+    """Each repetition writes the same candles into an emptied collection"""
+    candles = planned_candles(args)
+    name = f"{args.symbol}_M1"
+    durations = []
+    items = 0
+    for _ in range(args.repeat):
+        db.drop_collection(name)
+        collection = db[name]
+        collection.create_index([("symbol", 1), ("time", 1)], unique=True)
+        start = time.perf_counter()
+        items += historical_data_fetcher.store_candles_mongodb(collection, args.symbol, candles,
+                                                               fake_mt5.TIMEFRAME_M1)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations, items)
+
+
+def bench_write_candles_csv(db, args):
+    candles = planned_candles(args)
+    durations = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"{args.symbol}_M1.csv")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            historical_data_fetcher.write_candles_csv(path, args.symbol, candles, first_write=True)
+            durations.append(time.perf_counter() - start)
+    return summarize(durations, len(candles) * args.repeat)
+
+
+def compare(results, baseline, threshold):
+    """Print throughput changes against baseline and return the names of regressed benchmarks"""
+    regressions = []
+    print(f"\n{'benchmark':<26}{'baseline/s':>14}{'current/s':>14}{'change':>10}")
+    for name, result in results["benchmarks"].items():
+        old = baseline.get("benchmarks", {}).get(name, {}).get("items_per_sec")
+        new = result["items_per_sec"]
+        if not old or not new:
+            print(f"{name:<26}{'-':>14}{new or '-':>14}{'-':>10}")
+            continue
+        change = (new - old) / old * 100
+        flag = "  REGRESSION" if change < -threshold else ""
+        print(f"{name:<26}{old:>14.1f}{new:>14.1f}{change:>+9.1f}%{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+    args = parse_args()
+    fake_mt5.configure(tick_rate=args.tick_rate)
+    if args.metrics:
+        metrics.start(0)
+
+    if args.mongo_uri:
+        client = MongoClient(args.mongo_uri)
+        backend = "mongod"
+    else:
+        client = FakeClient()
+        backend = "memory"
+    client.drop_database(args.db_name)
+    db = client[args.db_name]
+
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "backend": backend,
+            "tick_rate": args.tick_rate,
+            "poll_seconds": args.poll_seconds,
+            "cycles": args.cycles,
+            "storage": args.storage,
+            "metrics": args.metrics,
+            "history_days": args.history_days,
+            "repeat": args.repeat
+        },
+        "benchmarks": {}
+    }
+    try:
+        print(f"{'benchmark':<26}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for name in args.only:
+            result = globals()[f"bench_{name}"](db, args)
+            results["benchmarks"][name] = result
+            latency = result["latency_ms"]
+            print(f"{name:<26}{result['items_per_sec'] or 0:>12.1f}{latency['p50']:>10.3f}"
+                  f"{latency['p95']:>10.3f}{latency['max']:>10.3f}")
+    finally:
+        client.drop_database(args.db_name)
+        client.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nThroughput dropped more than {args.threshold}% in: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Replay a tick stream through both tick deduplication modes and compare.
+
+Ticks from benchmarks/fake_mt5.py are delivered in overlapping batches,
+the way repeated copy_ticks_range calls return them, with some batches
+replayed again after they left the dedupe window. Every batch is stored
+once with --dedupe index (unique (symbol, time, bid, ask) index) and once
+with --dedupe window (in-memory window and deterministic _id).
+
+    python benchmarks/verify_dedupe.py --seconds 3600 --tick_rate 50
+
+The exit code is 1 when the window mode stores a tick twice, misses a
+tick of the stream, or misses a tick the index mode stored.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import fake_mt5
+fake_mt5.install()
+
+import numpy as np
+import MetaTrader5 as mt5
+from pymongo import MongoClient
+
+import tick_fetcher
+from fake_mongo import FakeClient
+from mongo_bulk import insert_unordered
+from mt5_convert import tick_documents
+from tick_dedupe import HASH_FIELDS, TickDedupe
+
+KEY_FIELDS = ['time_msc'] + HASH_FIELDS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare index and window tick deduplication on replayed ticks")
+    parser.add_argument("--mongo_uri", default=None,
+                        help="MongoDB URI of a local mongod; default is an in-memory stand-in")
+    parser.add_argument("--db_name", default="mt5_dedupe_check", help="Database used (and dropped) for the run")
+    parser.add_argument("--symbol", default="EURUSD", help="Symbol name passed to the fake terminal")
+    parser.add_argument("--tick_rate", type=int, default=20, help="Ticks per second generated by the fake terminal")
+    parser.add_argument("--seconds", type=int, default=1800, help="Seconds of ticks replayed")
+    parser.add_argument("--poll_seconds", type=int, default=1, help="Seconds of new ticks per batch")
+    parser.add_argument("--max_overlap", type=int, default=3,
+                        help="Seconds a batch reaches back into ticks already delivered")
+    parser.add_argument("--window", type=float, default=60, help="Dedupe window in seconds")
+    parser.add_argument("--replay_every", type=int, default=100,
+                        help="Replay a batch older than the window every N batches")
+    parser.add_argument("--inject", type=int, default=100,
+                        help="Extra ticks that repeat the second, bid and ask of a stream tick "
+                             "but differ in time_msc and flags")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for overlaps and injected ticks")
+    return parser.parse_args()
+
+
+def keys(records):
+    return set(zip(*(records[field].tolist() for field in KEY_FIELDS)))
+
+
+def stored_keys(collection):
+    docs = list(collection.find({}, dict.fromkeys(KEY_FIELDS, 1)))
+    return [tuple(doc[field] for field in KEY_FIELDS) for doc in docs]
+
+
+def build_stream(args, rng):
+    start = fake_mt5.DEFAULT_START
+    fake_mt5.set_time(start + args.seconds + 1)
+    ticks = mt5.copy_ticks_range(args.symbol, start, start + args.seconds, mt5.COPY_TICKS_ALL)
+    ticks = ticks[ticks['time'] < start + args.seconds]
+    extra = ticks[rng.choice(len(ticks), size=min(args.inject, len(ticks)), replace=False)].copy()
+    # same second, bid and ask, but a later millisecond and other flags
+    extra['time_msc'] = np.minimum(extra['time_msc'] + 1, extra['time'] * 1000 + 999)
+    extra['flags'] ^= fake_mt5.TICK_FLAG_BID
+    stream = np.concatenate([ticks, extra])
+    return stream[np.argsort(stream['time_msc'], kind='stable')], start
+
+
+def batches(stream, start, args, rng):
+    """Overlapping batches of the stream, plus late replays of old ones"""
+    times = stream['time']
+    delivered = []
+    for n, t in enumerate(range(start, start + args.seconds, args.poll_seconds)):
+        lo = t - int(rng.integers(0, args.max_overlap + 1))
+        batch = (np.searchsorted(times, lo), np.searchsorted(times, t + args.poll_seconds))
+        delivered.append(batch)
+        yield stream[batch[0]:batch[1]]
+        old = [b for b, when in zip(delivered, range(n + 1)) if (n - when) * args.poll_seconds > 2 * args.window]
+        if args.replay_every and n % args.replay_every == args.replay_every - 1 and old:
+            b = old[int(rng.integers(0, len(old)))]
+            yield stream[b[0]:b[1]]
+
+
+def main():
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    client = MongoClient(args.mongo_uri) if args.mongo_uri else FakeClient()
+    client.drop_database(args.db_name)
+    try:
+        by_index = tick_fetcher.tick_collection(client, args.db_name, f"{args.symbol}_index", dedupe='index')
+        by_window = tick_fetcher.tick_collection(client, args.db_name, f"{args.symbol}_window", dedupe='window')
+        dedupe = TickDedupe(int(args.window * 1000))
+
+        stream, start = build_stream(args, rng)
+        delivered = index_rejected = window_dropped = window_rejected = 0
+        for batch in batches(stream, start, args, rng):
+            delivered += len(batch)
+            _, duplicates = insert_unordered(by_index, tick_documents(batch, args.symbol, tick_fetcher.LOCAL_TZ))
+            index_rejected += duplicates
+            new_ticks, ids = dedupe.filter(args.symbol, batch)
+            window_dropped += len(batch) - len(new_ticks)
+            if len(new_ticks):
+                _, duplicates = insert_unordered(
+                    by_window, tick_documents(new_ticks, args.symbol, tick_fetcher.LOCAL_TZ, ids))
+                window_rejected += duplicates
+
+        expected = keys(stream)
+        index_keys = stored_keys(by_index)
+        window_keys = stored_keys(by_window)
+        window_set = set(window_keys)
+        stored_twice = len(window_keys) - len(window_set)
+        missing = len(expected - window_set)
+        missing_from_index = len(set(index_keys) - window_set)
+
+        print(f"{'ticks in stream':<40}{len(expected):>10}")
+        print(f"{'ticks delivered in batches':<40}{delivered:>10}")
+        print(f"{'index: stored':<40}{len(index_keys):>10}")
+        print(f"{'index: rejected by MongoDB':<40}{index_rejected:>10}")
+        print(f"{'index: distinct ticks lost':<40}{len(expected - set(index_keys)):>10}")
+        print(f"{'window: stored':<40}{len(window_keys):>10}")
+        print(f"{'window: dropped in memory':<40}{window_dropped:>10}")
+        print(f"{'window: rejected by MongoDB (_id)':<40}{window_rejected:>10}")
+        print(f"{'window: stored twice':<40}{stored_twice:>10}")
+        print(f"{'window: missing':<40}{missing:>10}")
+        print(f"{'window: missing ticks index stored':<40}{missing_from_index:>10}")
+        if args.mongo_uri:
+            for col in (by_index, by_window):
+                stats = client[args.db_name].command("collStats", col.name)
+                print(f"{col.name + ' index bytes':<40}{stats['totalIndexSize']:>10}")
+    finally:
+        client.drop_database(args.db_name)
+        client.close()
+
+    if stored_twice or missing or missing_from_index:
+        print("Window deduplication does not match the stream")
+        sys.exit(1)
+    print("Window deduplication stores every tick exactly once")
+
+
+if __name__ == "__main__":
+    main()
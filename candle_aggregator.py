@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+import numpy as np
+import pytz
+from pymongo import errors
+
+# Same layout as the arrays returned by mt5.copy_rates_*
+RATES_DTYPE = np.dtype([
+    ('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+    ('tick_volume', '<u8'), ('spread', '<i4'), ('real_volume', '<u8')
+])
+
+TIMEFRAME_SECONDS = {
+    'M1': 60,
+    'M5': 300,
+    'M15': 900,
+    'M30': 1800,
+    'H1': 3600,
+    'H4': 14400,
+    'D1': 86400
+}
+
+# Key of a stored candle
+CANDLE_KEY = ("symbol", "timeframe", "time")
+
+# Fields compared by reconcile_with_mt5
+PRICE_FIELDS = ('open', 'high', 'low', 'close')
+COUNT_FIELDS = ('tick_volume', 'spread')
+
+
+def candle_collection(db, symbol, timeframe_str):
+    """candles_{symbol}_{timeframe} with a unique (symbol, timeframe, time) index"""
+    col = db[f"candles_{symbol}_{timeframe_str}"]
+    try:
+        col.create_index([(field, 1) for field in CANDLE_KEY], unique=True)
+    except errors.OperationFailure as e:
+        # collections filled by older versions may hold duplicate partial candles
+        logging.warning(f"Could not create unique candle index on {col.name}: {e}")
+    return col
+
+
+def ticks_to_bars(ticks, point):
+    """One single-tick bar per tick priced on bid, spread in points"""
+    ticks = ticks[ticks['bid'] > 0]
+    bars = np.zeros(len(ticks), dtype=RATES_DTYPE)
+    bars['time'] = ticks['time']
+    for field in PRICE_FIELDS:
+        bars[field] = ticks['bid']
+    bars['tick_volume'] = 1
+    if point:
+        bars['spread'] = np.rint((ticks['ask'] - ticks['bid']) / point)
+    bars['real_volume'] = ticks['volume']
+    return bars
+
+
+def rollup(bars, seconds):
+    """Aggregate time-sorted bars into bars of the given period"""
+    if len(bars) == 0:
+        return bars
+    keys = bars['time'] // seconds * seconds
+    _, starts = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(bars)) - 1
+    out = np.zeros(len(starts), dtype=RATES_DTYPE)
+    out['time'] = keys[starts]
+    out['open'] = bars['open'][starts]
+    out['close'] = bars['close'][ends]
+    out['high'] = np.maximum.reduceat(bars['high'], starts)
+    out['low'] = np.minimum.reduceat(bars['low'], starts)
+    out['tick_volume'] = np.add.reduceat(bars['tick_volume'], starts)
+    # MT5 keeps the lowest spread seen during a bar
+    out['spread'] = np.minimum.reduceat(bars['spread'], starts)
+    out['real_volume'] = np.add.reduceat(bars['real_volume'], starts)
+    return out
+
+
+class CandleAggregator:
+    """
+    Incremental OHLC builder for one symbol.
+
+    Ticks are rolled into M1 bars, and every other requested timeframe is
+    rolled up from the next lower one in the chain, so each level only
+    touches the bars closed below it. A bar is emitted once a later tick
+    shows its period is over. Bars that started before the first tick
+    seen are incomplete and never emitted.
+    """
+
+    def __init__(self, timeframes, point):
+        self.timeframes = sorted(set(timeframes), key=TIMEFRAME_SECONDS.get)
+        self.chain = ['M1'] + [tf for tf in self.timeframes if tf != 'M1']
+        self.point = point
+        self.forming = {tf: None for tf in self.chain}
+        self.start_time = None
+
+    def add_ticks(self, ticks):
+        """Feed new ticks (sorted by time) and return {timeframe: closed bars}"""
+        bars = ticks_to_bars(ticks, self.point)
+        if len(bars) == 0:
+            return {}
+        latest = int(bars['time'][-1])
+        if self.start_time is None:
+            self.start_time = int(bars['time'][0])
+        closed = {}
+        for tf in self.chain:
+            seconds = TIMEFRAME_SECONDS[tf]
+            if self.forming[tf] is not None:
+                bars = np.concatenate([self.forming[tf], bars])
+            grouped = rollup(bars, seconds)
+            if len(grouped) == 0:
+                self.forming[tf] = None
+                done = grouped
+            elif grouped['time'][-1] + seconds <= latest:
+                self.forming[tf] = None
+                done = grouped
+            else:
+                self.forming[tf] = grouped[-1:]
+                done = grouped[:-1]
+            complete = done[done['time'] >= self.start_time]
+            if tf in self.timeframes and len(complete):
+                closed[tf] = complete
+            # the next level only sees bars whose period is over
+            bars = done
+        return closed
+
+
+def reconcile_with_mt5(symbol, timeframe, bars, point):
+    """
+    Compare aggregated bars with the terminal's own bars for the same span.
+
+    Returns a list of (time, field, ours, mt5) differences; prices differing
+    by less than half a point count as equal, and a bar missing on either
+    side is reported with field 'missing'.
+    """
+    # imported here so the readers, the gap scanner and the matrix export run without the MT5 package
+    import MetaTrader5 as mt5
+
+    if len(bars) == 0:
+        return []
+    date_from = datetime.datetime.fromtimestamp(int(bars['time'][0]), tz=pytz.UTC)
+    date_to = datetime.datetime.fromtimestamp(int(bars['time'][-1]), tz=pytz.UTC)
+    rates = mt5.copy_rates_range(symbol, timeframe, date_from, date_to)
+    if rates is None:
+        logging.error(f"{symbol}: mt5.copy_rates_range failed: {mt5.last_error()}")
+        return []
+    differences = []
+    ours_only = np.setdiff1d(bars['time'], rates['time'])
+    theirs_only = np.setdiff1d(rates['time'], bars['time'])
+    differences += [(int(t), 'missing', 'aggregated', None) for t in ours_only]
+    differences += [(int(t), 'missing', None, 'mt5') for t in theirs_only]
+    common, ours_idx, theirs_idx = np.intersect1d(bars['time'], rates['time'], return_indices=True)
+    ours = bars[ours_idx]
+    theirs = rates[theirs_idx]
+    tolerance = point / 2 if point else 0.0
+    for field in PRICE_FIELDS + COUNT_FIELDS:
+        if field in PRICE_FIELDS:
+            bad = np.abs(ours[field] - theirs[field]) > tolerance
+        else:
+            bad = ours[field].astype('int64') != theirs[field].astype('int64')
+        for i in np.flatnonzero(bad):
+            differences.append((int(common[i]), field, ours[field][i].item(), theirs[field][i].item()))
+    return differences
@@ -2,16 +2,26 @@
 #!/usr/bin/env python3
 
 import time
+# taken before the imports below so the startup time can be reported
+STARTED = time.monotonic()
 import datetime
 import pytz
 import MetaTrader5 as mt5
-import pandas_market_calendars as mcal
 from pymongo import MongoClient
 import logging
 import argparse
 import os
 import sys
 
+from candle_aggregator import CANDLE_KEY, TIMEFRAME_SECONDS, candle_collection
+from mongo_bulk import upsert_requests, write_unordered
+from mt5_convert import candle_documents
+import features
+import market_hours
+import metrics
+import query_server
+import write_behind
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Fetch and store candles from MT5')
     parser.add_argument('--timeframe', required=True, choices=['M1', 'M5', 'M15', 'M30', 'H1', 'H4', 'D1'], 
@@ -26,7 +36,14 @@ def parse_args():
     parser.add_argument('--fetch_interval', type=int, default=60,
                         help='Seconds between fetches (default: 60)')
     parser.add_argument('--candles_per_fetch', type=int, default=1,
-                        help='Number of candles per fetch (default: 1)')
+                        help='Number of closed candles per fetch (default: 1); more are fetched to close gaps')
+    parser.add_argument('--live_bar', action='store_true',
+                        help='Keep the still-forming bar in candles_SYMBOL_TF_live, updated in place')
+    features.add_arguments(parser)
+    write_behind.add_arguments(parser)
+    market_hours.add_arguments(parser)
+    metrics.add_arguments(parser)
+    query_server.add_arguments(parser)
     return parser.parse_args()
 
 # Timeframe mapping
@@ -40,66 +57,122 @@ TIMEFRAME_MAP = {
     'D1': mt5.TIMEFRAME_D1
 }
 
+TIMEFRAME_NAMES = {value: name for name, value in TIMEFRAME_MAP.items()}
+
 # Timezones
 LOCAL_TZ = pytz.timezone('Asia/Nicosia')  # local timezone
 MARKET_TZ = pytz.timezone('US/Eastern')    # market timezone
 
-# Market calendar
-MARKET_CAL = mcal.get_calendar('NYSE')
+# Upper bound on bars fetched in one call when catching up after a gap
+MAX_CATCHUP_BARS = 10000
 
-def connect_mongo(mongo_uri, db_name, collection_name):
+def connect_mongo(mongo_uri, db_name, symbol, timeframe_str):
     client = MongoClient(mongo_uri)
-    return client[db_name][collection_name], client
+    return candle_collection(client[db_name], symbol, timeframe_str), client
+
+
+def last_stored_bar(collection, symbol, timeframe):
+    """Open time of the newest stored bar, or None for an empty collection"""
+    doc = collection.find_one({"symbol": symbol, "timeframe": int(timeframe)}, {"time": 1},
+                              sort=[("time", -1)])
+    return doc["time"] if doc else None
+
+
+def fetch_and_store(collection, symbol, timeframe, candles_per_fetch, cursors, buffer=None,
+                    live_collection=None, rings=None, feature_store=None):
+    """
+    Store the bars of symbol that closed since the last stored one.
+
+    cursors maps symbol -> open time of the last stored closed bar and is
+    updated in place. Closed bars are upserted on (symbol, timeframe, time),
+    so re-fetching a bar never duplicates it. Position 0 is the still-forming
+    bar; it is only written to live_collection, when given. Closed bars are
+    also appended to rings (a query_server.RingStore) and fed to
+    feature_store (a features.FeatureStore), when given.
+    Returns the number of closed bars stored.
+    """
+    bars = fetch_new_bars(symbol, timeframe, candles_per_fetch, cursors)
+    if bars is None:
+        return 0
+    closed, forming = bars
+    return store_bars(collection, symbol, timeframe, closed, forming, cursors, buffer, live_collection, rings,
+                      feature_store)
 
 
-def is_market_open(now_local=None):
+def fetch_new_bars(symbol, timeframe, candles_per_fetch, cursors):
     """
-    Check Forex market hours: opens Sunday 22:00 UTC, closes Friday 22:00 UTC.
+    The MT5 half of fetch_and_store: (closed, forming), the bars that closed
+    since the cursor of symbol and the still-forming one, or None on an MT5
+    error or when MT5 has no bars. Makes no MongoDB calls and leaves
+    cursors as they are.
     """
-    if now_local is None:
-        now_local = datetime.datetime.now(LOCAL_TZ)
-    # convert to UTC
-    dt_utc = now_local.astimezone(pytz.UTC)
-    wd = dt_utc.weekday()  # Mon=0 ... Sun=6
-    hhmm = dt_utc.hour + dt_utc.minute/60.0
-
-    # Saturday (5): closed all day
-    if wd == 5:
-        return False
-    # Sunday (6): open only at or after 22:00 UTC
-    if wd == 6:
-        return hhmm >= 22.0
-    # Friday (4): open until 22:00 UTC
-    if wd == 4:
-        return hhmm < 22.0
-    # Mon–Thu (0–3): open 24h
-    return True
-
-
-def fetch_and_store(collection, symbol, timeframe, candles_per_fetch):
-    # fetch the most recent candles
-    rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, candles_per_fetch)
+    last_time = cursors.get(symbol)
+    # position 0 is the forming bar, the closed ones follow
+    tf_name = TIMEFRAME_NAMES[timeframe]
+    with metrics.stage('mt5_copy', symbol=symbol, timeframe=tf_name):
+        rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, candles_per_fetch + 1)
     if rates is None:
         logging.error(f"mt5.copy_rates_from_pos failed: {mt5.last_error()}")
-        return
+        return None
+    if len(rates) == 0:
+        return None
+
+    # fetch more bars when the closed ones since the last stored bar did not fit
+    seconds = TIMEFRAME_SECONDS[tf_name]
+    if last_time is not None and rates['time'][0] > last_time + seconds:
+        count = min(MAX_CATCHUP_BARS, int(rates['time'][-1] - last_time) // seconds + 1)
+        logging.info(f"Catching up {count} bars since last stored bar @ {last_time}")
+        with metrics.stage('mt5_copy', symbol=symbol, timeframe=tf_name):
+            rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, count)
+        if rates is None:
+            logging.error(f"mt5.copy_rates_from_pos failed: {mt5.last_error()}")
+            return None
+
+    # a bar only counts as closed once MT5 has started a newer one
+    forming = rates[-1:]
+    closed = rates[:-1]
+    if last_time is not None:
+        closed = closed[closed['time'] > last_time]
+    else:
+        closed = closed[-candles_per_fetch:] if candles_per_fetch > 0 else closed[:0]
+    return closed, forming
 
-    for r in rates:
-        # convert record to native Python types
-        doc = {name: r[name].item() for name in rates.dtype.names}
-        # original MT5 timestamp and converted datetimes
-        ts = doc.get('time')  # seconds since epoch
-        dt_utc = datetime.datetime.fromtimestamp(ts, tz=pytz.UTC)
-        dt_local = dt_utc.astimezone(LOCAL_TZ)
-        doc.update({
-            "symbol": symbol,
-            "timeframe": int(timeframe),
-            "timestamp": ts,
-            "datetime_utc": dt_utc.isoformat(),
-            "datetime_local": dt_local.isoformat()
-        })
-
-        collection.insert_one(doc)
-        logging.info(f"Inserted candle @ {doc['datetime_local']} → {doc}")
+
+def store_bars(collection, symbol, timeframe, closed, forming, cursors, buffer=None, live_collection=None,
+               rings=None, feature_store=None):
+    """
+    The MongoDB half of fetch_and_store: store the bars from fetch_new_bars
+    and move the cursor of symbol past them. Makes no MT5 calls. Returns
+    the number of closed bars stored.
+    """
+    tf_name = TIMEFRAME_NAMES[timeframe]
+    if live_collection is not None:
+        live_doc = candle_documents(forming, symbol, int(timeframe), LOCAL_TZ)[0]
+        live_collection.update_one({"_id": symbol}, {"$set": live_doc}, upsert=True)
+
+    if len(closed) == 0:
+        return 0
+
+    # native Python values plus original MT5 timestamp and converted datetimes
+    with metrics.stage('convert', symbol=symbol, timeframe=tf_name):
+        docs = candle_documents(closed, symbol, int(timeframe), LOCAL_TZ)
+        requests = upsert_requests(docs, CANDLE_KEY)
+    cursors[symbol] = int(closed['time'][-1])
+    if rings is not None:
+        rings.add_candles(symbol, tf_name, closed)
+    if feature_store is not None:
+        feature_store.add_candles(symbol, tf_name, closed)
+    metrics.inc('mt5_candles_total', len(docs), symbol=symbol, timeframe=tf_name)
+    with metrics.stage('mongo_write', symbol=symbol, timeframe=tf_name):
+        if buffer is not None:
+            buffer.put(collection, requests)
+            logging.info(f"Queued {len(docs)} closed candles, last @ {docs[-1]['datetime_local']} "
+                         f"({len(buffer)} pending)")
+        else:
+            stored, _ = write_unordered(collection, requests)
+            metrics.inc('mt5_writes_total', stored, collection=collection.name)
+            logging.info(f"Stored {stored}/{len(docs)} closed candles, last @ {docs[-1]['datetime_local']}")
+    return len(docs)
 
 
 def main():
@@ -115,7 +188,6 @@ def main():
     
     # Database settings
     db_name = "mt5_data"
-    collection_name = f"candles_{args.symbol}_{args.timeframe}"
     
     # Check MT5 executable path exists
     if args.mt5_path:
@@ -143,22 +215,58 @@ def main():
     logging.info(f"Fetching {args.timeframe} candles for {args.symbol}")
 
     # connect to MongoDB
-    col, client = connect_mongo(args.mongo_uri, db_name, collection_name)
-    logging.info(f"Connected to MongoDB: {args.mongo_uri}, collection={collection_name}")
-    logging.info("Started candle fetcher")
+    col, client = connect_mongo(args.mongo_uri, db_name, args.symbol, args.timeframe)
+    logging.info(f"Connected to MongoDB: {args.mongo_uri}, collection={col.name}")
+    live_col = None
+    if args.live_bar:
+        live_col = client[db_name][f"{col.name}_live"]
+        logging.info(f"Keeping the forming bar in {live_col.name}")
+
+    # resume after the newest bar already stored
+    cursors = {}
+    last_time = last_stored_bar(col, args.symbol, timeframe)
+    if last_time is not None:
+        cursors[args.symbol] = last_time
+        logging.info(f"Last stored bar @ {datetime.datetime.fromtimestamp(last_time, tz=pytz.UTC).isoformat()}")
+    buffer = write_behind.from_args(args, client=client)
+    metrics.from_args(args)
+    if buffer is not None:
+        metrics.gauge_callback('mt5_queue_depth', buffer.__len__)
+    rings = query_server.from_args(args)
+    if rings is not None:
+        # seed the ring with the closed bars MT5 already has, oldest first
+        history = mt5.copy_rates_from_pos(args.symbol, timeframe, 1, args.ring_size)
+        if history is not None:
+            rings.add_candles(args.symbol, args.timeframe, history)
+    feature_store = features.from_args(args, client[db_name], [args.symbol], [args.timeframe], TIMEFRAME_MAP, buffer)
+    if feature_store is not None:
+        logging.info(f"Maintaining features in features_{args.symbol}_{args.timeframe}")
+    schedule = market_hours.from_args(args)
+    closed_wakeups = 0
+    startup = time.monotonic() - STARTED
+    metrics.set_gauge('mt5_startup_seconds', startup)
+    logging.info(f"Started candle fetcher in {startup:.2f}s")
 
     try:
         while True:
             now_local = datetime.datetime.now(LOCAL_TZ)
-            if is_market_open(now_local):
-                fetch_and_store(col, args.symbol, timeframe, args.candles_per_fetch)
-            else:
-                logging.info(f"Market closed at {now_local.isoformat()}, skipping fetch")
+            if not schedule.is_open(now_local):
+                schedule.sleep_until_open(now_local, LOCAL_TZ)
+                closed_wakeups += 1
+                metrics.inc('mt5_closed_wakeups_total')
+                continue
+            if closed_wakeups:
+                logging.info(f"Market open, resuming after {closed_wakeups} closed-market wakeups")
+                closed_wakeups = 0
+            fetch_and_store(col, args.symbol, timeframe, args.candles_per_fetch, cursors, buffer, live_col, rings,
+                            feature_store)
             time.sleep(args.fetch_interval)
     except KeyboardInterrupt:
         logging.info("Shutting down (KeyboardInterrupt)")
     finally:
         mt5.shutdown()
+        if buffer is not None:
+            buffer.close(args.flush_timeout)
         client.close()
 
 
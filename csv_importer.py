@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import pandas as pd
+import pytz
+from pymongo import MongoClient
+
+import backfill_checkpoints
+from mongo_bulk import DEFAULT_BATCH_SIZE, insert_unordered
+
+DEFAULT_CHUNK_ROWS = 100000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Import candle CSV files into MongoDB')
+    parser.add_argument('paths', nargs='+',
+                        help='CSV files or directories of CSV files named like '
+                             'XAUUSD_M1_202502071057_202505221032.csv')
+    parser.add_argument('--mongo_uri', default="mongodb://localhost:27017/",
+                        help='MongoDB URI (default: mongodb://localhost:27017/)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Files imported in parallel (default: number of CPUs)')
+    parser.add_argument('--chunk_rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f'CSV rows read into memory at a time (default: {DEFAULT_CHUNK_ROWS})')
+    parser.add_argument('--write_batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Documents per unordered bulk insert (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--sep', default=',', help="CSV field separator (default: ',')")
+    parser.add_argument('--force', action='store_true',
+                        help='Import files even if their range is already recorded in imported_ranges')
+    return parser.parse_args()
+
+
+def parse_filename(filename):
+    """
+    Parse filename like XAUUSD_M1_202502071057_202505221032.csv
+    Returns: symbol, timeframe, start_str, end_str
+    """
+    pattern = r"([A-Z]+)_([A-Z0-9]+)_(\d{12})_(\d{12})\.csv"
+    match = re.match(pattern, filename)
+    if not match:
+        raise ValueError("Filename does not match expected pattern")
+    symbol, timeframe, start_str, end_str = match.groups()
+    return symbol, timeframe, start_str, end_str
+
+
+def str_to_datetime(dt_str):
+    """Convert string like 202502071057 to datetime"""
+    return datetime.datetime.strptime(dt_str, "%Y%m%d%H%M")
+
+
+def find_csv_files(paths):
+    """Expand directories to the CSV files they contain, keeping the given order"""
+    files = []
+    for p in paths:
+        path = Path(p)
+        if path.is_dir():
+            files.extend(sorted(path.glob("*.csv")))
+        else:
+            files.append(path)
+    return files
+
+
+def import_file(path, mongo_uri, db_name, chunk_rows, write_batch_size, sep=','):
+    """
+    Stream one CSV file into candles_SYMBOL_TF, chunk by chunk.
+
+    Runs in a worker process, so it opens its own MongoDB client. The range
+    is recorded in imported_ranges only after every chunk is stored.
+    Returns (rows, inserted, duplicates).
+    """
+    path = Path(path)
+    symbol, timeframe, start_str, end_str = parse_filename(path.name)
+    client = MongoClient(mongo_uri)
+    try:
+        db = client[db_name]
+        col = db[f"candles_{symbol}_{timeframe}"]
+        col.create_index([("symbol", 1), ("time", 1)], unique=True)
+        rows = inserted = duplicates = 0
+        for chunk in pd.read_csv(path, sep=sep, chunksize=chunk_rows):
+            # If symbol is not in the CSV, add it
+            if 'symbol' not in chunk.columns:
+                chunk['symbol'] = symbol
+            n, dup = insert_unordered(col, chunk.to_dict(orient='records'), write_batch_size)
+            rows += len(chunk)
+            inserted += n
+            duplicates += dup
+        start_dt = pytz.UTC.localize(str_to_datetime(start_str))
+        end_dt = pytz.UTC.localize(str_to_datetime(end_str))
+        backfill_checkpoints.record_import(db, symbol, timeframe, start_dt, end_dt, path.name, rows)
+        return rows, inserted, duplicates
+    finally:
+        client.close()
+
+
+def pending_files(db, files, force=False):
+    """Return the files whose range is not yet fully recorded in imported_ranges"""
+    coverage = {}
+    pending = []
+    for path in files:
+        try:
+            symbol, timeframe, start_str, end_str = parse_filename(path.name)
+        except ValueError:
+            logging.warning(f"Skipping {path}: name does not match SYMBOL_TF_YYYYmmddHHMM_YYYYmmddHHMM.csv")
+            continue
+        if force:
+            pending.append(path)
+            continue
+        if (symbol, timeframe) not in coverage:
+            coverage[(symbol, timeframe)] = backfill_checkpoints.load_imported(db, symbol, timeframe)
+        start_dt = pytz.UTC.localize(str_to_datetime(start_str))
+        end_dt = pytz.UTC.localize(str_to_datetime(end_str))
+        if backfill_checkpoints.subtract_ranges(start_dt, end_dt, coverage[(symbol, timeframe)]):
+            pending.append(path)
+        else:
+            logging.info(f"Skipping {path.name}: range already imported")
+    return pending
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    args = parse_args()
+
+    # Database settings
+    db_name = "mt5_historical_data"
+
+    files = find_csv_files(args.paths)
+    missing = [str(p) for p in files if not p.is_file()]
+    if missing:
+        logging.critical(f"CSV files not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    client = MongoClient(args.mongo_uri)
+    files = pending_files(client[db_name], files, args.force)
+    client.close()
+    if not files:
+        logging.info("Nothing to import")
+        return
+    logging.info(f"Importing {len(files)} files with {min(args.workers, len(files))} workers")
+
+    started = time.monotonic()
+    total_rows = total_inserted = failed = 0
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(files))) as executor:
+        futures = {
+            executor.submit(import_file, path, args.mongo_uri, db_name, args.chunk_rows,
+                            args.write_batch_size, args.sep): path
+            for path in files
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                rows, inserted, duplicates = future.result()
+            except Exception as e:
+                logging.error(f"{path.name}: import failed: {e}")
+                failed += 1
+                continue
+            total_rows += rows
+            total_inserted += inserted
+            logging.info(f"{path.name}: {rows} rows, {inserted} inserted, {duplicates} duplicates")
+
+    elapsed = time.monotonic() - started
+    logging.info(f"Imported {len(files) - failed}/{len(files)} files: {total_rows} rows, "
+                 f"{total_inserted} inserted in {elapsed:.1f}s "
+                 f"({total_rows / elapsed if elapsed else 0.0:.0f} rows/sec)")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
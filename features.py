@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+import math
+import numpy as np
+import MetaTrader5 as mt5
+
+from candle_aggregator import CANDLE_KEY, TIMEFRAME_SECONDS
+from mongo_bulk import DEFAULT_BATCH_SIZE, upsert_requests, write_unordered
+from mt5_convert import to_documents, utc_isoformat
+import metrics
+
+# Bars covered by the rolling volatility and VWAP
+DEFAULT_WINDOW = 20
+
+# Per-bar running statistics; rows of the same bar combine into one
+PARTIAL_DTYPE = np.dtype([
+    ('time', '<i8'), ('mid', '<f8'), ('mid_sum', '<f8'), ('spread_sum', '<f8'), ('spread_min', '<f8'),
+    ('spread_max', '<f8'), ('ticks', '<i8'), ('pv', '<f8'), ('volume', '<f8')
+])
+
+# Features of one closed bar, as stored in features_{symbol}_{timeframe}
+FEATURE_DTYPE = np.dtype([
+    ('time', '<i8'), ('mid', '<f8'), ('mid_mean', '<f8'), ('spread_mean', '<f8'), ('spread_min', '<f8'),
+    ('spread_max', '<f8'), ('ticks', '<i8'), ('tick_rate', '<f8'), ('vwap', '<f8'), ('volatility', '<f8')
+])
+
+
+def feature_collection(db, symbol, timeframe_str):
+    """features_{symbol}_{timeframe} with a unique (symbol, timeframe, time) index like the candles"""
+    col = db[f"features_{symbol}_{timeframe_str}"]
+    col.create_index([(field, 1) for field in CANDLE_KEY], unique=True)
+    return col
+
+
+def ticks_to_partials(ticks):
+    """One partial row per tick with a two-sided quote; ticks without real volume weigh 1 in the VWAP"""
+    ticks = ticks[(ticks['bid'] > 0) & (ticks['ask'] > 0)]
+    out = np.zeros(len(ticks), dtype=PARTIAL_DTYPE)
+    mid = (ticks['bid'] + ticks['ask']) / 2
+    spread = ticks['ask'] - ticks['bid']
+    weight = np.where(ticks['volume_real'] > 0, ticks['volume_real'], 1.0)
+    out['time'] = ticks['time']
+    out['mid'] = mid
+    out['mid_sum'] = mid
+    out['spread_sum'] = spread
+    out['spread_min'] = spread
+    out['spread_max'] = spread
+    out['ticks'] = 1
+    out['pv'] = mid * weight
+    out['volume'] = weight
+    return out
+
+
+def bars_to_partials(bars, point):
+    """
+    One partial row per MT5 bar. Bars are priced on bid with the spread in
+    points, so mids add half the spread; the bar's tick volume weighs its
+    typical price in the VWAP.
+    """
+    out = np.zeros(len(bars), dtype=PARTIAL_DTYPE)
+    spread = bars['spread'] * point
+    ticks = bars['tick_volume'].astype(np.int64)
+    # sums are per tick; a bar without ticks still counts once for its prices
+    counted = np.maximum(ticks, 1)
+    typical = (bars['high'] + bars['low'] + bars['close']) / 3 + spread / 2
+    out['time'] = bars['time']
+    out['mid'] = bars['close'] + spread / 2
+    out['mid_sum'] = ((bars['open'] + bars['high'] + bars['low'] + bars['close']) / 4 + spread / 2) * counted
+    out['spread_sum'] = spread * counted
+    out['spread_min'] = spread
+    out['spread_max'] = spread
+    out['ticks'] = ticks
+    out['pv'] = typical * ticks
+    out['volume'] = ticks
+    return out
+
+
+def combine(partials, seconds):
+    """Combine time-sorted partial rows into one row per bar of the given period"""
+    if len(partials) == 0:
+        return partials
+    keys = partials['time'] // seconds * seconds
+    _, starts = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(partials)) - 1
+    out = np.zeros(len(starts), dtype=PARTIAL_DTYPE)
+    out['time'] = keys[starts]
+    out['mid'] = partials['mid'][ends]
+    for field in ('mid_sum', 'spread_sum', 'ticks', 'pv', 'volume'):
+        out[field] = np.add.reduceat(partials[field], starts)
+    out['spread_min'] = np.minimum.reduceat(partials['spread_min'], starts)
+    out['spread_max'] = np.maximum.reduceat(partials['spread_max'], starts)
+    return out
+
+
+class RollingSums:
+    """Column sums over the last n rows pushed, updated in O(1) per row"""
+
+    def __init__(self, n, width):
+        self.n = n
+        self.rows = collections.deque()
+        self.sums = [0.0] * width
+        self._pushes = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def push(self, row):
+        self.rows.append(row)
+        self.sums = [s + v for s, v in zip(self.sums, row)]
+        if len(self.rows) > self.n:
+            old = self.rows.popleft()
+            self.sums = [s - v for s, v in zip(self.sums, old)]
+        self._pushes += 1
+        if self._pushes % self.n == 0:
+            # re-add from scratch now and then so rounding errors do not pile up
+            self.sums = [math.fsum(column) for column in zip(*self.rows)]
+        return self.sums
+
+
+class FeatureBuilder:
+    """
+    Incremental per-bar features for one symbol.
+
+    Ticks are combined into per-bar running statistics the way
+    CandleAggregator builds bars: M1 first, and every other timeframe from
+    the next lower one, emitting a bar once a later tick shows its period
+    is over. Closed bars from MT5 can be fed with add_bars() instead. Each
+    closed bar moves the rolling volatility (sample standard deviation of
+    log mid returns) and VWAP windows by one O(1) step; bars at or before
+    the last one a timeframe's windows have seen are skipped, so bars
+    seeded from MT5 history are not counted twice.
+    """
+
+    def __init__(self, timeframes, window=DEFAULT_WINDOW):
+        self.timeframes = sorted(set(timeframes), key=TIMEFRAME_SECONDS.get)
+        self.chain = ['M1'] + [tf for tf in self.timeframes if tf != 'M1']
+        self.window = window
+        self.forming = {tf: None for tf in self.chain}
+        self.start_time = None
+        self.returns = collections.defaultdict(lambda: RollingSums(window, 2))
+        self.flows = collections.defaultdict(lambda: RollingSums(window, 2))
+        self.last_mid = {}
+        self.last_time = {}
+
+    def add_ticks(self, ticks):
+        """Feed new ticks (sorted by time) and return {timeframe: features of the closed bars}"""
+        partials = ticks_to_partials(ticks)
+        if len(partials) == 0:
+            return {}
+        latest = int(partials['time'][-1])
+        if self.start_time is None:
+            self.start_time = int(partials['time'][0])
+        closed = {}
+        for tf in self.chain:
+            seconds = TIMEFRAME_SECONDS[tf]
+            if self.forming[tf] is not None:
+                partials = np.concatenate([self.forming[tf], partials])
+            grouped = combine(partials, seconds)
+            if len(grouped) and grouped['time'][-1] + seconds > latest:
+                self.forming[tf] = grouped[-1:]
+                done = grouped[:-1]
+            else:
+                self.forming[tf] = None
+                done = grouped
+            complete = done[done['time'] >= self.start_time]
+            if tf in self.timeframes and len(complete):
+                closed[tf] = self._features(tf, complete)
+            # the next level only sees bars whose period is over
+            partials = done
+        return closed
+
+    def add_bars(self, timeframe, bars, point):
+        """Features of closed MT5 bars of timeframe, oldest first"""
+        if len(bars) == 0:
+            return np.zeros(0, dtype=FEATURE_DTYPE)
+        return self._features(timeframe, bars_to_partials(bars, point))
+
+    def _features(self, tf, partials):
+        if tf in self.last_time:
+            partials = partials[partials['time'] > self.last_time[tf]]
+        out = np.zeros(len(partials), dtype=FEATURE_DTYPE)
+        if len(partials) == 0:
+            return out
+        ticks = np.maximum(partials['ticks'], 1)
+        out['time'] = partials['time']
+        out['mid'] = partials['mid']
+        out['mid_mean'] = partials['mid_sum'] / ticks
+        out['spread_mean'] = partials['spread_sum'] / ticks
+        out['spread_min'] = partials['spread_min']
+        out['spread_max'] = partials['spread_max']
+        out['ticks'] = partials['ticks']
+        out['tick_rate'] = partials['ticks'] * 60.0 / TIMEFRAME_SECONDS[tf]
+        previous = np.concatenate([[self.last_mid.get(tf, np.nan)], partials['mid'][:-1]])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_returns = np.log(partials['mid'] / previous)
+        returns = self.returns[tf]
+        flows = self.flows[tf]
+        volatility = out['volatility']
+        vwap = out['vwap']
+        for i, (r, pv, volume) in enumerate(zip(log_returns.tolist(), partials['pv'].tolist(),
+                                                partials['volume'].tolist())):
+            if math.isfinite(r):
+                returns.push((r, r * r))
+            n = len(returns)
+            if n >= 2:
+                total, squares = returns.sums
+                volatility[i] = math.sqrt(max(0.0, (squares - total * total / n) / (n - 1)))
+            else:
+                volatility[i] = np.nan
+            weighted, weights = flows.push((pv, volume))
+            vwap[i] = weighted / weights if weights > 0 else np.nan
+        self.last_mid[tf] = float(partials['mid'][-1])
+        self.last_time[tf] = int(partials['time'][-1])
+        return out
+
+
+def feature_documents(features, symbol, timeframe):
+    """Documents for features_{symbol}_{timeframe} collections; undefined values are stored as null"""
+    docs = to_documents(features, {
+        "symbol": symbol,
+        "timeframe": timeframe,
+        "datetime_utc": utc_isoformat(features['time'])
+    })
+    for field in ('volatility', 'vwap'):
+        for doc, missing in zip(docs, np.isnan(features[field]).tolist()):
+            if missing:
+                doc[field] = None
+    return docs
+
+
+class FeatureStore:
+    """
+    Feature builders of the live fetchers and the collections they fill.
+
+    add_ticks(symbol, ticks) has the tick fetcher's on_ticks signature and
+    add_candles(symbol, timeframe, bars) takes closed MT5 bars like
+    query_server.RingStore. Features of each closed bar are upserted into
+    features_SYMBOL_TF, or queued on the write-behind buffer when given.
+    """
+
+    def __init__(self, db, symbols, timeframes, timeframe_values, window=DEFAULT_WINDOW, buffer=None,
+                 write_batch_size=DEFAULT_BATCH_SIZE):
+        self.timeframe_values = timeframe_values
+        self.buffer = buffer
+        self.write_batch_size = write_batch_size
+        self.builders = {symbol: FeatureBuilder(timeframes, window) for symbol in symbols}
+        self.points = {}
+        self.collections = {}
+        for symbol in symbols:
+            info = mt5.symbol_info(symbol)
+            self.points[symbol] = info.point if info is not None else 0.0
+            for tf in timeframes:
+                self.collections[(symbol, tf)] = feature_collection(db, symbol, tf)
+
+    def seed(self, symbol, timeframe, count):
+        """Fill the rolling windows from the last count closed MT5 bars without storing them"""
+        bars = mt5.copy_rates_from_pos(symbol, self.timeframe_values[timeframe], 1, count)
+        if bars is None:
+            logging.warning(f"{symbol}: could not seed {timeframe} features: {mt5.last_error()}")
+            return
+        self.builders[symbol].add_bars(timeframe, bars, self.points[symbol])
+
+    def add_ticks(self, symbol, ticks):
+        for tf, features in self.builders[symbol].add_ticks(ticks).items():
+            self._store(symbol, tf, features)
+
+    def add_candles(self, symbol, timeframe, bars):
+        self._store(symbol, timeframe, self.builders[symbol].add_bars(timeframe, bars, self.points[symbol]))
+
+    def _store(self, symbol, timeframe, features):
+        if len(features) == 0:
+            return
+        col = self.collections[(symbol, timeframe)]
+        docs = feature_documents(features, symbol, int(self.timeframe_values[timeframe]))
+        requests = upsert_requests(docs, CANDLE_KEY)
+        metrics.inc('mt5_features_total', len(docs), symbol=symbol, timeframe=timeframe)
+        if self.buffer is not None:
+            self.buffer.put(col, requests)
+        else:
+            stored, _ = write_unordered(col, requests, self.write_batch_size)
+            metrics.inc('mt5_writes_total', stored, collection=col.name)
+        logging.info(f"{symbol}: Stored features of {len(docs)} {timeframe} bars in {col.name}")
+
+
+def add_arguments(parser):
+    """Add the derived feature options shared by the live fetchers"""
+    parser.add_argument('--features', action='store_true',
+                        help='Maintain per-bar features (mid, spread stats, rolling volatility and VWAP, '
+                             'tick rate) of each closed bar in features_SYMBOL_TF')
+    parser.add_argument('--feature_window', type=int, default=DEFAULT_WINDOW,
+                        help=f'Bars in the rolling volatility and VWAP windows (default: {DEFAULT_WINDOW})')
+
+
+def from_args(args, db, symbols, timeframes, timeframe_values, buffer=None, write_batch_size=DEFAULT_BATCH_SIZE):
+    """Return a FeatureStore seeded from MT5 history, or None when --features is not set"""
+    if not args.features:
+        return None
+    store = FeatureStore(db, symbols, timeframes, timeframe_values, args.feature_window, buffer, write_batch_size)
+    for symbol in symbols:
+        for tf in timeframes:
+            store.seed(symbol, tf, args.feature_window + 1)
+    return store
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+import math
+import numpy as np
+import pytz
+import MetaTrader5 as mt5
+
+from candle_aggregator import TIMEFRAME_SECONDS
+import market_hours
+
+# Bars requested per copy_rates_range call before adapting to the terminal
+DEFAULT_PAGE_BARS = 50000
+
+# Used when the terminal does not report its "Max bars in chart" setting
+DEFAULT_MAX_BARS = 100000
+
+# Bounds of the observed bars-per-expected-bar ratio used to size windows
+MIN_DENSITY = 0.05
+MAX_DENSITY = 2.0
+
+
+class FetchPlanner:
+    """
+    Splits a date range into copy_rates_range windows sized in bars.
+
+    Window length follows from the timeframe, so a D1 range is a single call
+    while M1 ranges are split every page_bars bars. For intraday timeframes
+    only time inside trading sessions counts towards a window's bars and
+    stretches with no session at all are never requested. Windows are
+    contiguous otherwise, so no bar is lost to a session boundary.
+
+    record() feeds back what the terminal returned: sparse data widens the
+    following windows and a result cut off at max_bars halves the page size.
+    """
+
+    def __init__(self, timeframe_str, page_bars=DEFAULT_PAGE_BARS, max_bars=DEFAULT_MAX_BARS,
+                 max_window=None, utc_offset=0):
+        self.timeframe_str = timeframe_str
+        self.seconds = TIMEFRAME_SECONDS[timeframe_str]
+        self.intraday = self.seconds < TIMEFRAME_SECONDS['D1']
+        self.max_bars = max_bars
+        self.page_bars = max(1, min(page_bars, max_bars - 1))
+        self.max_window = max_window
+        self.utc_offset = utc_offset
+        self.density = 1.0
+
+    def open_spans(self, start, end):
+        """Parts of [start, end) in which bars are expected"""
+        if not self.intraday:
+            return [(start, end)] if start < end else []
+        return list(market_hours.sessions(start, end, self.utc_offset))
+
+    def expected_bars(self, start, end):
+        open_seconds = sum((e - s).total_seconds() for s, e in self.open_spans(start, end))
+        return int(math.ceil(open_seconds / self.seconds))
+
+    def _window_bars(self):
+        return max(1, int(self.page_bars / self.density))
+
+    def windows(self, start, end):
+        """
+        Yield (window_start, window_end, expected_bars) for [start, end).
+
+        Windows are produced lazily, so feedback given through record()
+        while iterating sizes the windows that follow.
+        """
+        spans = self.open_spans(start, end)
+        if not spans:
+            return
+        window_start = spans[0][0]
+        budget = self._window_bars()
+        bars = 0
+        for span_start, span_end in spans:
+            cursor = span_start
+            while cursor < span_end:
+                span_bars = (span_end - cursor).total_seconds() / self.seconds
+                room = budget - bars
+                limit = None
+                if self.max_window is not None:
+                    limit = window_start + self.max_window
+                if span_bars <= room and (limit is None or span_end <= limit):
+                    bars += span_bars
+                    cursor = span_end
+                    continue
+                # close the window inside this span
+                cut = cursor + datetime.timedelta(seconds=room * self.seconds)
+                if limit is not None:
+                    cut = min(cut, max(limit, cursor))
+                # keep window edges on bar boundaries
+                cut = _floor_to(cut, self.seconds)
+                if cut <= window_start:
+                    cut = _floor_to(cursor, self.seconds) + datetime.timedelta(seconds=self.seconds)
+                bars += max(0.0, (cut - cursor).total_seconds() / self.seconds)
+                yield window_start, cut, int(math.ceil(bars))
+                window_start = cursor = cut
+                budget = self._window_bars()
+                bars = 0
+        if bars > 0:
+            yield window_start, spans[-1][1], int(math.ceil(bars))
+
+    def record(self, expected, returned):
+        """Adapt window sizes to how many bars a window actually returned"""
+        if returned >= self.max_bars:
+            self.page_bars = max(1, self.page_bars // 2)
+            logging.info(f"Result hit the terminal limit of {self.max_bars} bars, "
+                         f"page size now {self.page_bars} bars")
+        if expected > 0 and 0 < returned < self.max_bars:
+            observed = min(MAX_DENSITY, max(MIN_DENSITY, returned / expected))
+            self.density = 0.5 * self.density + 0.5 * observed
+
+    def plan(self, ranges):
+        """All windows for the given ranges at the current page size"""
+        return [window for start, end in ranges for window in self.windows(start, end)]
+
+
+def _floor_to(dt, seconds):
+    ts = int(dt.timestamp())
+    return datetime.datetime.fromtimestamp(ts - ts % seconds, tz=pytz.UTC)
+
+
+def terminal_max_bars(default=DEFAULT_MAX_BARS):
+    """The terminal's "Max bars in chart" limit, which also caps copy_rates_* results"""
+    info = mt5.terminal_info()
+    maxbars = getattr(info, 'maxbars', None) if info is not None else None
+    return int(maxbars) if maxbars else default
+
+
+def fetch_window(symbol, timeframe, planner, window_start, window_end, rate_limiter=None):
+    """
+    Fetch the bars of [window_start, window_end) with copy_rates_range.
+
+    A result cut off at the terminal's bar limit is fetched again in two
+    halves. Returns the structured array of bars, or None on an MT5 error.
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    # copy_rates_range includes date_to, the next window starts there
+    rates = mt5.copy_rates_range(symbol, timeframe, window_start, window_end - datetime.timedelta(seconds=1))
+    if rates is None:
+        logging.error(f"mt5.copy_rates_range failed for {window_start.isoformat()}: {mt5.last_error()}")
+        return None
+    expected = planner.expected_bars(window_start, window_end)
+    planner.record(expected, len(rates))
+    if len(rates) >= planner.max_bars and window_end - window_start > datetime.timedelta(seconds=2 * planner.seconds):
+        middle = _floor_to(window_start + (window_end - window_start) / 2, planner.seconds)
+        first = fetch_window(symbol, timeframe, planner, window_start, middle, rate_limiter)
+        second = fetch_window(symbol, timeframe, planner, middle, window_end, rate_limiter)
+        if first is None or second is None:
+            return None
+        return np.concatenate([first, second])
+    return rates
+
+
+def legacy_call_estimate(planner, ranges, chunk_days, bars_per_request=1000):
+    """MT5 calls the old 1000-bar copy_rates_from paging in chunk_days chunks made for the same ranges"""
+    calls = 0
+    for start, end in ranges:
+        current = start
+        while current < end:
+            chunk_end = min(current + datetime.timedelta(days=chunk_days), end)
+            bars = (chunk_end - current).total_seconds() / planner.seconds
+            calls += max(1, int(math.ceil(bars / bars_per_request)))
+            current = chunk_end
+    return calls
+
+
+def describe_plan(planner, windows, ranges=None, chunk_days=None):
+    """Log a dry-run summary of planned windows and MT5 calls"""
+    total = sum(expected for _, _, expected in windows)
+    logging.info(f"Plan for {planner.timeframe_str}: {len(windows)} copy_rates_range calls, "
+                 f"~{total} bars, {planner.page_bars} bars per page, terminal limit {planner.max_bars}")
+    for window_start, window_end, expected in windows:
+        logging.info(f"  {window_start.isoformat()} to {window_end.isoformat()}: ~{expected} bars")
+    if ranges is not None and chunk_days:
+        logging.info(f"Paging with copy_rates_from in {chunk_days}-day chunks would take "
+                     f"~{legacy_call_estimate(planner, ranges, chunk_days)} calls")
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+import time
+import numpy as np
+import pytz
+from pymongo import MongoClient
+
+import backfill_checkpoints
+from candle_aggregator import TIMEFRAME_SECONDS
+import market_hours
+from mongo_bulk import DEFAULT_BATCH_SIZE, insert_unordered
+from mt5_convert import candle_documents
+
+# Bar times read per round trip
+READ_BATCH_SIZE = 50000
+
+# Closed stretches longer than this are taken as a weekend when inferring the server offset
+WEEKEND_GAP_SECONDS = 86400
+
+# Coarsest timeframe whose bars show where the week reopens to the hour
+INFER_MAX_SECONDS = TIMEFRAME_SECONDS['H1']
+
+COLLECTION_PATTERN = re.compile(r"^candles_(.+)_(" + "|".join(TIMEFRAME_SECONDS) + r")$")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Find missing bars in stored candle collections and optionally '
+                                                 'fetch only those from MT5')
+    parser.add_argument('--mongo_uri', default="mongodb://localhost:27017/",
+                        help='MongoDB URI (default: mongodb://localhost:27017/)')
+    parser.add_argument('--db_name', default="mt5_historical_data",
+                        help='Database to scan (default: mt5_historical_data)')
+    parser.add_argument('--symbols', default=None,
+                        help='Comma-separated symbols to scan (default: every candles_SYMBOL_TF collection)')
+    parser.add_argument('--timeframes', default=None,
+                        help='Comma-separated timeframes to scan (default: all found)')
+    parser.add_argument('--start_date', default=None,
+                        help='Start date in YYYY-MM-DD format (default: first stored bar)')
+    parser.add_argument('--end_date', default=None,
+                        help='End date in YYYY-MM-DD format, exclusive (default: after the last stored bar)')
+    parser.add_argument('--server_utc_offset', type=float, default=None,
+                        help='Hours the broker\'s server time is ahead of UTC, used to place the '
+                             'weekend closure in bar times (default: read off where the stored bars '
+                             'reopen after each weekend, else 0)')
+    parser.add_argument('--min_gap_bars', type=int, default=1,
+                        help='Only report gaps of at least this many bars (default: 1)')
+    parser.add_argument('--report', default=None, help='Write every gap to this JSON file')
+    parser.add_argument('--repair', action='store_true', help='Fetch the missing bars from MT5 and store them')
+    parser.add_argument('--merge_bars', type=int, default=60,
+                        help='With --repair, fetch gaps closer than this many bars in one MT5 call (default: 60)')
+    parser.add_argument('--page_bars', type=int, default=50000,
+                        help='With --repair, bars requested per MT5 call (default: 50000)')
+    parser.add_argument('--requests_per_second', type=float, default=10.0,
+                        help='With --repair, maximum MT5 data requests per second (default: 10)')
+    parser.add_argument('--mt5_path', required=False, help='Path to MT5 executable (with --repair)')
+    parser.add_argument('--account', required=False, type=int, help='MT5 account number (with --repair)')
+    parser.add_argument('--password', required=False, help='MT5 password (with --repair)')
+    parser.add_argument('--server', required=False, help='MT5 server (with --repair)')
+    market_hours.add_arguments(parser)
+    args = parser.parse_args()
+    args.symbols = [s.strip() for s in args.symbols.split(',') if s.strip()] if args.symbols else None
+    args.timeframes = [t.strip() for t in args.timeframes.split(',') if t.strip()] if args.timeframes else None
+    return args
+
+
+def _utc(seconds):
+    return datetime.datetime.fromtimestamp(int(seconds), tz=pytz.UTC)
+
+
+def _date(value):
+    return int(pytz.UTC.localize(datetime.datetime.strptime(value, "%Y-%m-%d")).timestamp())
+
+
+def candle_collections(db, symbols=None, timeframes=None):
+    """(collection name, symbol, timeframe) of every candles_SYMBOL_TF collection, sorted"""
+    found = []
+    for name in sorted(db.list_collection_names()):
+        match = COLLECTION_PATTERN.match(name)
+        if not match:
+            continue
+        symbol, timeframe = match.groups()
+        if (symbols is None or symbol in symbols) and (timeframes is None or timeframe in timeframes):
+            found.append((name, symbol, timeframe))
+    return found
+
+
+def stored_times(collection, symbol, start=None, end=None, batch_size=READ_BATCH_SIZE):
+    """Sorted, unique open times of the stored bars, read with a time-only projection"""
+    query = {"symbol": symbol}
+    if start is not None or end is not None:
+        query["time"] = {}
+        if start is not None:
+            query["time"]["$gte"] = start
+        if end is not None:
+            query["time"]["$lt"] = end
+    cursor = collection.find(query, {"time": 1, "_id": 0}).batch_size(batch_size)
+    return np.unique(np.fromiter((doc["time"] for doc in cursor), dtype=np.int64))
+
+
+def expected_times(timeframe, start, end, utc_offset=0, closures=()):
+    """
+    Open times of the bars expected in [start, end): every bar opening in
+    it that overlaps a trading session, minus bars that fall entirely
+    inside a holiday closure. Times are in server time like MT5 bars.
+    """
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    grids = []
+    for session_start, session_end in market_hours.sessions(_utc(start), _utc(end), utc_offset):
+        s = int(session_start.timestamp())
+        grids.append(np.arange(s - s % seconds, int(session_end.timestamp()), seconds, dtype=np.int64))
+    if not grids:
+        return np.zeros(0, dtype=np.int64)
+    grid = np.unique(np.concatenate(grids))
+    grid = grid[grid >= start]
+    offset = int(utc_offset * 3600)
+    for closure_start, closure_end in closures:
+        inside = ((grid >= int(closure_start.timestamp()) + offset)
+                  & (grid + seconds <= int(closure_end.timestamp()) + offset))
+        grid = grid[~inside]
+    return grid
+
+
+def infer_utc_offset(stored):
+    """
+    Server UTC offset (whole hours) that puts the weekend closure where the
+    stored bars have it: the most common distance from the Sunday 22:00 UTC
+    week open to the first bar after a closed stretch of a day or more.
+    Brokers following New York close keep the same offset across DST.
+    Returns None when no weekend is in range.
+    """
+    breaks = np.flatnonzero(np.diff(stored) > WEEKEND_GAP_SECONDS) + 1
+    offsets = []
+    for reopened in stored[breaks].tolist():
+        # the week open nearest to the reopening; holiday reopenings mid-week are too far from it
+        opened = market_hours.week_open(_utc(reopened) + market_hours.WEEK / 2)
+        hours = round((reopened - opened.timestamp()) / 3600)
+        if abs(hours) <= 12:
+            offsets.append(hours)
+    if not offsets:
+        return None
+    values, counts = np.unique(offsets, return_counts=True)
+    return float(values[np.argmax(counts)])
+
+
+def find_gaps(expected, stored, seconds):
+    """
+    Compare the expected grid with the stored times.
+
+    Returns (gaps, extra): gaps is an (n, 3) array of [start, end, bars]
+    for each run of consecutive missing bars, and extra the number of
+    stored bars outside the grid.
+    """
+    missing = np.setdiff1d(expected, stored, assume_unique=True)
+    extra = len(np.setdiff1d(stored, expected, assume_unique=True))
+    if len(missing) == 0:
+        return np.zeros((0, 3), dtype=np.int64), extra
+    breaks = np.flatnonzero(np.diff(missing) != seconds) + 1
+    firsts = np.concatenate([[0], breaks])
+    lasts = np.concatenate([breaks - 1, [len(missing) - 1]])
+    gaps = np.column_stack([missing[firsts], missing[lasts] + seconds, lasts - firsts + 1])
+    return gaps, extra
+
+
+def in_ranges(times, ranges):
+    """Mask of the times inside any of the sorted, non-overlapping (start, end) ranges"""
+    if not ranges:
+        return np.zeros(len(times), dtype=bool)
+    starts, ends = np.array(ranges, dtype=np.int64).T
+    index = np.searchsorted(starts, times, side='right') - 1
+    return (index >= 0) & (times < ends[np.maximum(index, 0)])
+
+
+def scan_collection(collection, symbol, timeframe, start=None, end=None, utc_offset=None, closures=(),
+                    min_gap_bars=1, empty_ranges=()):
+    """
+    Scan one collection; returns a report dict, or None when it holds no
+    bars in range. Without utc_offset it is inferred from the stored bars
+    of timeframes up to H1, and taken as 0 for coarser ones. Missing bars
+    inside empty_ranges, (start, end) seconds that MT5 was already asked
+    for and returned nothing, are not reported as gaps.
+    """
+    seconds = TIMEFRAME_SECONDS[timeframe]
+    stored = stored_times(collection, symbol, start, end)
+    if len(stored) == 0:
+        return None
+    if utc_offset is None and seconds <= INFER_MAX_SECONDS:
+        utc_offset = infer_utc_offset(stored)
+        if utc_offset is not None:
+            logging.info(f"{collection.name}: server time inferred as UTC{utc_offset:+g} from the weekend closures")
+    if utc_offset is None:
+        utc_offset = 0.0
+    start = int(stored[0]) if start is None else start
+    end = int(stored[-1]) + seconds if end is None else end
+    expected = expected_times(timeframe, start, end, utc_offset, closures)
+    known_empty = in_ranges(expected, empty_ranges) & ~np.isin(expected, stored, assume_unique=True)
+    expected = expected[~known_empty]
+    gaps, extra = find_gaps(expected, stored, seconds)
+    gaps = gaps[gaps[:, 2] >= min_gap_bars]
+    return {
+        "collection": collection.name,
+        "symbol": symbol,
+        "timeframe": timeframe,
+        "start": start,
+        "end": end,
+        "server_utc_offset": utc_offset,
+        "stored": len(stored),
+        "expected": len(expected),
+        "missing": int(gaps[:, 2].sum()),
+        "known_empty": int(np.count_nonzero(known_empty)),
+        "outside_sessions": extra,
+        "gaps": gaps
+    }
+
+
+def merge_gaps(gaps, seconds, merge_bars):
+    """Coalesce gaps separated by fewer than merge_bars bars into (start, end) fetch windows"""
+    windows = []
+    for gap_start, gap_end, _ in gaps.tolist():
+        if windows and gap_start - windows[-1][1] < merge_bars * seconds:
+            windows[-1][1] = gap_end
+        else:
+            windows.append([gap_start, gap_end])
+    return [tuple(w) for w in windows]
+
+
+def repair(db, report, rate_limiter, merge_bars=60, page_bars=50000, utc_offset=0):
+    """Fetch the gaps of a scan report from MT5 and store them; returns (fetched, inserted)"""
+    # MT5 is only needed for repairs, scans run anywhere
+    import MetaTrader5 as mt5
+    import fetch_planner
+
+    symbol, timeframe_str = report["symbol"], report["timeframe"]
+    timeframe = getattr(mt5, f"TIMEFRAME_{timeframe_str}")
+    seconds = TIMEFRAME_SECONDS[timeframe_str]
+    planner = fetch_planner.FetchPlanner(timeframe_str, page_bars, fetch_planner.terminal_max_bars(),
+                                         utc_offset=utc_offset)
+    col = db[report["collection"]]
+    fetched = inserted = 0
+    for window_start, window_end in merge_gaps(report["gaps"], seconds, merge_bars):
+        start, end = _utc(window_start), _utc(window_end)
+        rates = fetch_planner.fetch_window(symbol, timeframe, planner, start, end, rate_limiter)
+        if rates is None:
+            continue
+        if len(rates):
+            n, _ = insert_unordered(col, candle_documents(rates, symbol, int(timeframe)), DEFAULT_BATCH_SIZE)
+            inserted += n
+        fetched += len(rates)
+        backfill_checkpoints.record_range(db, symbol, timeframe_str, start, end, len(rates))
+        # gaps MT5 has no bars for are checkpointed as empty, so later scans stop reporting them
+        for gap_start, gap_end, _ in report["gaps"].tolist():
+            if gap_start >= window_start and gap_end <= window_end:
+                inside = np.searchsorted(rates['time'], [gap_start, gap_end])
+                if inside[0] == inside[1]:
+                    backfill_checkpoints.record_range(db, symbol, timeframe_str, _utc(gap_start), _utc(gap_end), 0)
+    return fetched, inserted
+
+
+def log_report(report, limit=10):
+    logging.info(f"{report['collection']}: {report['stored']} stored, {report['expected']} expected, "
+                 f"{report['missing']} missing in {len(report['gaps'])} gaps, "
+                 f"{report['known_empty']} known to be empty in MT5, "
+                 f"{report['outside_sessions']} outside trading sessions")
+    if report['outside_sessions']:
+        logging.warning(f"{report['collection']}: bars outside trading sessions, check --server_utc_offset")
+    largest = report['gaps'][np.argsort(-report['gaps'][:, 2], kind='stable')[:limit]]
+    for gap_start, gap_end, bars in largest.tolist():
+        logging.info(f"  {_utc(gap_start).isoformat()} to {_utc(gap_end).isoformat()}: {bars} bars")
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    args = parse_args()
+    start = _date(args.start_date) if args.start_date else None
+    end = _date(args.end_date) if args.end_date else None
+    closures = market_hours.load_closures(args.holidays)
+
+    client = MongoClient(args.mongo_uri)
+    db = client[args.db_name]
+    collections = candle_collections(db, args.symbols, args.timeframes)
+    if not collections:
+        logging.warning(f"No candles_SYMBOL_TF collections to scan in {args.db_name}")
+        client.close()
+        return
+
+    if args.repair:
+        import MetaTrader5 as mt5
+        from rate_limiter import TokenBucket
+        if args.mt5_path and not os.path.exists(os.path.normpath(args.mt5_path)):
+            logging.critical(f"MT5 executable not found at: {args.mt5_path}")
+            sys.exit(1)
+        init_params = {key: value for key, value in (('path', args.mt5_path), ('login', args.account),
+                                                     ('password', args.password), ('server', args.server))
+                       if value}
+        if not mt5.initialize(**init_params):
+            logging.critical(f"MT5 initialize() failed: {mt5.last_error()}")
+            sys.exit(1)
+        rate_limiter = TokenBucket(args.requests_per_second)
+        backfill_checkpoints.ensure_indexes(db)
+
+    reports = []
+    # offsets inferred from a symbol's finest timeframe are reused for its coarser ones
+    offsets = {}
+    collections.sort(key=lambda c: (c[1], TIMEFRAME_SECONDS[c[2]]))
+    try:
+        for name, symbol, timeframe in collections:
+            started = time.monotonic()
+            utc_offset = args.server_utc_offset
+            if utc_offset is None:
+                utc_offset = offsets.get(symbol)
+            empty_ranges = [(int(s.timestamp()), int(e.timestamp()))
+                            for s, e in backfill_checkpoints.load_empty(db, symbol, timeframe)]
+            report = scan_collection(db[name], symbol, timeframe, start, end, utc_offset, closures,
+                                     args.min_gap_bars, empty_ranges)
+            if report is None:
+                logging.info(f"{name}: no bars in range")
+                continue
+            if TIMEFRAME_SECONDS[timeframe] <= INFER_MAX_SECONDS:
+                offsets.setdefault(symbol, report["server_utc_offset"])
+            log_report(report)
+            logging.info(f"{name}: scanned in {time.monotonic() - started:.2f}s")
+            if args.repair and len(report["gaps"]):
+                fetched, inserted = repair(db, report, rate_limiter, args.merge_bars, args.page_bars,
+                                           report["server_utc_offset"])
+                logging.info(f"{name}: fetched {fetched} bars for {report['missing']} missing, inserted {inserted}")
+                report["repaired"] = inserted
+            reports.append(report)
+    finally:
+        if args.repair:
+            mt5.shutdown()
+        client.close()
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump([dict(r, start=_utc(r["start"]).isoformat(), end=_utc(r["end"]).isoformat(),
+                            gaps=[{"start": _utc(s).isoformat(), "end": _utc(e).isoformat(), "bars": b}
+                                  for s, e, b in r["gaps"].tolist()])
+                       for r in reports], f, indent=2)
+        logging.info(f"Wrote {args.report}")
+
+
+if __name__ == "__main__":
+    main()
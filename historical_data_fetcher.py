@@ -1,11 +1,9 @@
 #!/usr/bin/env python3
 
-import time
 import datetime
 import pytz
 import MetaTrader5 as mt5
-import pandas as pd
-from pymongo import MongoClient, errors
+from pymongo import MongoClient
 import logging
 import argparse
 import os
@@ -13,10 +11,21 @@ import sys
 import csv
 from pathlib import Path
 
+import backfill_checkpoints
+import fetch_planner
+from mongo_bulk import DEFAULT_BATCH_SIZE, insert_unordered, iter_batches, write_unordered
+from mt5_convert import candle_csv_rows, candle_documents, to_documents, utc_isoformat
+import parquet_sink
+from rate_limiter import TokenBucket
+import tick_buckets
+import tick_fetcher
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Fetch historical data for a long timeframe by breaking it into smaller chunks')
-    parser.add_argument('--timeframe', required=True, choices=['M1', 'M5', 'M15', 'M30', 'H1', 'H4', 'D1'], 
-                        help='Timeframe for candles')
+    parser.add_argument('--data_type', choices=['candles', 'ticks'], default='candles',
+                        help='Fetch candles of --timeframe or every tick (default: candles)')
+    parser.add_argument('--timeframe', required=False, choices=['M1', 'M5', 'M15', 'M30', 'H1', 'H4', 'D1'],
+                        help='Timeframe for candles (required with --data_type candles)')
     parser.add_argument('--mt5_path', required=False, help='Path to MT5 executable')
     parser.add_argument('--account', required=False, type=int, help='MT5 account number')
     parser.add_argument('--password', required=False, help='MT5 password')
@@ -27,11 +36,38 @@ def parse_args():
     parser.add_argument('--mongo_uri', default="mongodb://localhost:27017/", 
                         help='MongoDB URI (default: mongodb://localhost:27017/)')
     parser.add_argument('--csv_output', default=None, help='Path to CSV output file (optional)')
-    parser.add_argument('--chunk_days', type=int, default=2, 
-                        help='Number of days per chunk (default: 2)')
+    parser.add_argument('--parquet_output', default=None,
+                        help='Directory for Parquet output partitioned by symbol/timeframe/month (optional)')
+    parser.add_argument('--parquet_compression', default='zstd', choices=parquet_sink.COMPRESSIONS,
+                        help='Parquet compression codec (default: zstd)')
+    parser.add_argument('--chunk_days', type=int, default=None,
+                        help='Maximum number of days per chunk (default: chunks sized by --page_bars)')
+    parser.add_argument('--page_bars', type=int, default=fetch_planner.DEFAULT_PAGE_BARS,
+                        help=f'Bars requested per MT5 call, capped by the terminal\'s max bars '
+                             f'(default: {fetch_planner.DEFAULT_PAGE_BARS})')
+    parser.add_argument('--server_utc_offset', type=float, default=0,
+                        help='Hours the broker\'s server time is ahead of UTC, used to place the '
+                             'weekend closure in bar times (default: 0)')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='Print the planned MT5 calls and exit without fetching')
     parser.add_argument('--min_data_points', type=int, default=10, 
-                        help='Minimum number of data points to consider a chunk valid (default: 10)')
-    return parser.parse_args()
+                        help='Minimum number of bars for a chunk to be stored, capped at the bars the chunk\'s '
+                             'trading sessions can hold (default: 10)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Only fetch the parts of the date range not already recorded as stored')
+    parser.add_argument('--requests_per_second', type=float, default=10.0,
+                        help='Maximum MT5 data requests per second (default: 10)')
+    parser.add_argument('--tick_batch', type=int, default=DEFAULT_TICK_BATCH,
+                        help=f'With --data_type ticks, ticks to aim for per copy_ticks_range call; windows '
+                             f'are resized to it as the tick rate changes (default: {DEFAULT_TICK_BATCH})')
+    parser.add_argument('--storage', choices=tick_buckets.STORAGE_MODES, default='documents',
+                        help='With --data_type ticks, tick storage layout as in the tick fetcher (default: documents)')
+    parser.add_argument('--write_batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Maximum documents per MongoDB bulk write (default: {DEFAULT_BATCH_SIZE})')
+    args = parser.parse_args()
+    if args.data_type == 'candles' and args.timeframe is None:
+        parser.error("--timeframe is required with --data_type candles")
+    return args
 
 # Timeframe mapping
 TIMEFRAME_MAP = {
@@ -47,6 +83,19 @@ TIMEFRAME_MAP = {
 # Timezones
 UTC_TZ = pytz.timezone('UTC')
 
+# Chunk size of the old copy_rates_from paging, for the dry-run comparison
+LEGACY_CHUNK_DAYS = 2
+
+# Ticks aimed for per copy_ticks_range window, and the window length bounds
+DEFAULT_TICK_BATCH = 100000
+INITIAL_TICK_WINDOW = datetime.timedelta(hours=1)
+MIN_TICK_WINDOW = datetime.timedelta(minutes=1)
+MAX_TICK_WINDOW = datetime.timedelta(days=1)
+
+# Fields of historical tick CSV exports
+TICK_CSV_FIELDS = ['symbol', 'time', 'time_msc', 'bid', 'ask', 'last', 'volume', 'flags', 'volume_real',
+                   'datetime_utc']
+
 def connect_mongo(mongo_uri, db_name, collection_name):
     """Connect to MongoDB and return collection and client"""
     client = MongoClient(mongo_uri)
@@ -55,124 +104,76 @@ def connect_mongo(mongo_uri, db_name, collection_name):
     col.create_index([("symbol", 1), ("time", 1)], unique=True)
     return col, client
 
-def generate_date_chunks(start_date, end_date, chunk_days):
-    """Generate date chunks of specified days between start and end dates"""
-    current_date = start_date
-    while current_date < end_date:
-        chunk_end = current_date + datetime.timedelta(days=chunk_days)
-        # Ensure we don't go beyond the end date
-        if chunk_end > end_date:
-            chunk_end = end_date
-        
-        yield (current_date, chunk_end)
-        current_date = chunk_end
+def candle_batches(symbol, timeframe, planner, ranges, rate_limiter=None):
+    """
+    Yield (window_start, window_end, candles) for the planner's windows over
+    ranges, one copy_rates_range result at a time; candles is None when the
+    MT5 call failed.
+    """
+    for range_start, range_end in ranges:
+        for window_start, window_end, expected in planner.windows(range_start, range_end):
+            logging.info(f"Processing chunk: {window_start.isoformat()} to {window_end.isoformat()} "
+                         f"(~{expected} bars)")
+            yield window_start, window_end, fetch_planner.fetch_window(symbol, timeframe, planner, window_start,
+                                                                       window_end, rate_limiter)
 
-def get_timeframe_minutes(timeframe):
-    """Get the number of minutes for a given timeframe"""
-    if timeframe == mt5.TIMEFRAME_M1:
-        return 1
-    elif timeframe == mt5.TIMEFRAME_M5:
-        return 5
-    elif timeframe == mt5.TIMEFRAME_M15:
-        return 15
-    elif timeframe == mt5.TIMEFRAME_M30:
-        return 30
-    elif timeframe == mt5.TIMEFRAME_H1:
-        return 60
-    elif timeframe == mt5.TIMEFRAME_H4:
-        return 240
-    elif timeframe == mt5.TIMEFRAME_D1:
-        return 1440
-    return 1  # Default to 1 minute
+def tick_batches(symbol, ranges, target_ticks=DEFAULT_TICK_BATCH, rate_limiter=None):
+    """
+    Yield (window_start, window_end, ticks) covering ranges with
+    copy_ticks_range, one window at a time; ticks is None when the MT5 call
+    failed.
 
-def fetch_candles(symbol, timeframe, from_date, to_date):
-    """Fetch candles for a specific time period using copy_rates_from with chunks"""
-    all_candles = []
-    current_date = from_date
-    max_bars_per_request = 1000
-    timeframe_minutes = get_timeframe_minutes(timeframe)
-    
-    while current_date < to_date:
-        # Log the current fetch attempt
-        logging.info(f"Fetching {max_bars_per_request} {symbol} bars from {current_date.isoformat()}")
-        
-        # Fetch candles using copy_rates_from with limited count
-        candles = mt5.copy_rates_from(symbol, timeframe, current_date, max_bars_per_request)
-        
-        if candles is None:
-            error_code = mt5.last_error()
-            logging.error(f"Failed to fetch candles: Error code {error_code}")
-            break
-            
-        if len(candles) == 0:
-            logging.warning(f"No data returned for {current_date.isoformat()}")
-            break
-            
-        logging.info(f"Successfully fetched {len(candles)} candles")
-        
-        # Filter out candles beyond the end date
-        valid_candles = [c for c in candles if datetime.datetime.fromtimestamp(c['time'], tz=UTC_TZ) <= to_date]
-        
-        if valid_candles:
-            all_candles.extend(valid_candles)
-            
-            # Get the last timestamp and add one timeframe unit to avoid duplicates
-            last_candle_time = valid_candles[-1]['time']
-            last_datetime = datetime.datetime.fromtimestamp(last_candle_time, tz=UTC_TZ)
-            
-            # Update current_date to the next timeframe unit after the last candle
-            current_date = last_datetime + datetime.timedelta(minutes=timeframe_minutes)
-            
-            logging.info(f"Added {len(valid_candles)} candles, last time: {last_datetime.isoformat()}")
-            logging.info(f"Next fetch will start from: {current_date.isoformat()}")
-            
-            # Debug info for the first few and last few candles
-            if len(valid_candles) > 0:
-                first_time = datetime.datetime.fromtimestamp(valid_candles[0]['time'], tz=UTC_TZ)
-                last_time = datetime.datetime.fromtimestamp(valid_candles[-1]['time'], tz=UTC_TZ)
-                logging.debug(f"First candle time: {first_time.isoformat()}, Last candle time: {last_time.isoformat()}")
-        else:
-            # If we filtered out all candles (all are beyond to_date), we're done
-            logging.info("All fetched candles are beyond the end date, stopping")
-            break
-            
-        # If we got fewer than max_bars_per_request, there's no more data to fetch
-        if len(candles) < max_bars_per_request:
-            logging.info(f"Received fewer candles ({len(candles)}) than requested ({max_bars_per_request}), stopping")
-            break
-            
-        # Add a small delay to avoid overwhelming the MT5 API
-        time.sleep(0.1)
-    
-    logging.info(f"Total candles fetched: {len(all_candles)}")
-    return all_candles
+    Each window is sized from the tick rate of the previous one to hold
+    about target_ticks ticks, so memory stays bounded however long the
+    range is and however busy the symbol gets. Windows are not clipped to
+    trading sessions: tick times are server time, and a wrong session
+    offset would silently skip ticks. Closed stretches only cost a few
+    empty calls, as the window doubles while it comes back empty.
+    """
+    window = INITIAL_TICK_WINDOW
+    for range_start, range_end in ranges:
+        cursor = range_start
+        while cursor < range_end:
+            window_end = min(cursor + window, range_end)
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            ticks = mt5.copy_ticks_range(symbol, cursor, window_end, mt5.COPY_TICKS_ALL)
+            if ticks is None:
+                logging.error(f"mt5.copy_ticks_range failed for {cursor.isoformat()}: {mt5.last_error()}")
+            else:
+                # copy_ticks_range includes date_to, the next window starts there
+                ticks = ticks[ticks['time_msc'] < int(window_end.timestamp() * 1000)]
+                seconds = (window_end - cursor).total_seconds()
+                if len(ticks):
+                    window = datetime.timedelta(seconds=int(seconds * target_ticks / len(ticks)))
+                elif seconds >= window.total_seconds():
+                    window *= 2
+                window = min(MAX_TICK_WINDOW, max(MIN_TICK_WINDOW, window))
+            logging.info(f"Fetched {len(ticks) if ticks is not None else 0} ticks from "
+                         f"{cursor.isoformat()} to {window_end.isoformat()}")
+            yield cursor, window_end, ticks
+            cursor = window_end
 
-def store_candles_mongodb(collection, symbol, candles, timeframe_value):
-    """Store candles in MongoDB"""
+def store_candles_mongodb(collection, symbol, candles, timeframe_value, batch_size=DEFAULT_BATCH_SIZE):
+    """Store candles in MongoDB, converting and inserting batch_size at a time; duplicates are skipped"""
     inserted_count = 0
-    for candle in candles:
-        # Convert record to native Python types
-        doc = {name: candle[name].item() for name in candles.dtype.names}
-        # Add additional fields
-        ts = doc.get('time')
-        dt_utc = datetime.datetime.fromtimestamp(ts, tz=UTC_TZ)
-        
-        doc.update({
-            "symbol": symbol,
-            "timeframe": timeframe_value,
-            "timestamp": ts,
-            "datetime_utc": dt_utc.isoformat()
-        })
-        
-        try:
-            collection.insert_one(doc)
-            inserted_count += 1
-        except errors.DuplicateKeyError:
-            # Skip duplicates
-            pass
-    
+    for batch in iter_batches(candles, batch_size):
+        inserted, _ = insert_unordered(collection, candle_documents(batch, symbol, timeframe_value), batch_size)
+        inserted_count += inserted
     return inserted_count
 
+def store_ticks_mongodb(collection, symbol, ticks, storage='documents', batch_size=DEFAULT_BATCH_SIZE):
+    """Store ticks in MongoDB in the given storage layout, batch_size at a time; returns the writes applied"""
+    applied_count = 0
+    for batch in iter_batches(ticks, batch_size):
+        writes = tick_fetcher.tick_writes(batch, symbol, storage)
+        if storage == 'buckets':
+            applied, _ = write_unordered(collection, writes, batch_size)
+        else:
+            applied, _ = insert_unordered(collection, writes, batch_size)
+        applied_count += applied
+    return applied_count
+
 def write_candles_csv(csv_path, symbol, candles, first_write=False):
     """Write candles to CSV file"""
     mode = 'w' if first_write else 'a'
@@ -185,17 +186,17 @@ def write_candles_csv(csv_path, symbol, candles, first_write=False):
         if write_header:
             writer.writeheader()
         
-        for candle in candles:
-            # Convert numpy types to Python types
-            row = {name: candle[name].item() for name in candles.dtype.names}
-            # Add datetime field
-            ts = row.get('time')
-            dt_utc = datetime.datetime.fromtimestamp(ts, tz=UTC_TZ)
-            row.update({
-                "symbol": symbol,
-                "datetime_utc": dt_utc.isoformat()
-            })
-            writer.writerow(row)
+        writer.writerows(candle_csv_rows(candles, symbol))
+
+def write_ticks_csv(csv_path, symbol, ticks, first_write=False, batch_size=DEFAULT_BATCH_SIZE):
+    """Write ticks to CSV file, converting batch_size rows at a time"""
+    mode = 'w' if first_write else 'a'
+    with open(csv_path, mode, newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TICK_CSV_FIELDS, extrasaction='ignore')
+        if first_write:
+            writer.writeheader()
+        for batch in iter_batches(ticks, batch_size):
+            writer.writerows(to_documents(batch, {"symbol": symbol, "datetime_utc": utc_isoformat(batch['time'])}))
 
 def main():
     logging.basicConfig(
@@ -204,10 +205,11 @@ def main():
     )
     
     args = parse_args()
+    ticks = args.data_type == 'ticks'
     
-    # Convert timeframe string to MT5 constant
-    timeframe_str = args.timeframe
-    timeframe = TIMEFRAME_MAP[timeframe_str]
+    # Convert timeframe string to MT5 constant; tick ranges are checkpointed as timeframe "ticks"
+    timeframe_str = 'ticks' if ticks else args.timeframe
+    timeframe = None if ticks else TIMEFRAME_MAP[timeframe_str]
     
     # Parse dates and ensure they are in UTC timezone
     try:
@@ -218,6 +220,9 @@ def main():
         end_date = datetime.datetime.strptime(args.end_date, "%Y-%m-%d")
         # Ensure end_date is set to end of day
         end_date = end_date.replace(hour=23, minute=59, second=59, tzinfo=UTC_TZ)
+        if ticks:
+            # tick windows exclude their end, include the last second of the day
+            end_date += datetime.timedelta(seconds=1)
         
         if start_date >= end_date:
             logging.critical("Start date must be before end date")
@@ -235,7 +240,6 @@ def main():
     
     # Database settings
     db_name = "mt5_historical_data"
-    collection_name = f"candles_{args.symbol}_{timeframe_str}"
     
     # Initialize MT5 connection with login credentials if provided
     init_params = {}
@@ -265,11 +269,51 @@ def main():
     else:
         logging.info("Connected to MT5 using default settings")
     
-    logging.info(f"Fetching {timeframe_str} candles for {args.symbol} from {args.start_date} to {args.end_date}")
+    if ticks:
+        logging.info(f"Fetching ticks for {args.symbol} from {args.start_date} to {args.end_date}")
+        client = MongoClient(args.mongo_uri)
+        col = tick_fetcher.tick_collection(client, db_name, args.symbol, args.storage)
+    else:
+        logging.info(f"Fetching {timeframe_str} candles for {args.symbol} from {args.start_date} to {args.end_date}")
+        col, client = connect_mongo(args.mongo_uri, db_name, f"candles_{args.symbol}_{timeframe_str}")
+    logging.info(f"Connected to MongoDB: {args.mongo_uri}, collection={col.name}")
+    db = client[db_name]
+    backfill_checkpoints.ensure_indexes(db)
+    
+    # Work out which parts of the range still need fetching
+    missing_ranges = [(start_date, end_date)]
+    if args.resume:
+        covered = backfill_checkpoints.load_coverage(db, args.symbol, timeframe_str)
+        missing_ranges = backfill_checkpoints.subtract_ranges(start_date, end_date, covered)
+        logging.info(f"Resuming: {len(covered)} stored ranges, {len(missing_ranges)} missing ranges")
+        for range_start, range_end in missing_ranges:
+            logging.info(f"Missing: {range_start.isoformat()} to {range_end.isoformat()}")
 
-    # Connect to MongoDB
-    col, client = connect_mongo(args.mongo_uri, db_name, collection_name)
-    logging.info(f"Connected to MongoDB: {args.mongo_uri}, collection={collection_name}")
+    # Pace MT5 requests instead of sleeping between them
+    rate_limiter = TokenBucket(args.requests_per_second)
+    
+    # One window at a time flows from MT5 through the sinks, so memory does not grow with the range
+    if ticks:
+        if args.dry_run:
+            hours = sum((r_end - r_start).total_seconds() for r_start, r_end in missing_ranges) / 3600
+            logging.info(f"Plan for ticks: {hours:.0f} hours, windows start at {INITIAL_TICK_WINDOW} and "
+                         f"are resized for ~{args.tick_batch} ticks each")
+            mt5.shutdown()
+            client.close()
+            return
+        batches = tick_batches(args.symbol, missing_ranges, args.tick_batch, rate_limiter)
+    else:
+        # Size the MT5 calls by timeframe and skip closed-market stretches
+        max_window = datetime.timedelta(days=args.chunk_days) if args.chunk_days else None
+        planner = fetch_planner.FetchPlanner(timeframe_str, args.page_bars, fetch_planner.terminal_max_bars(),
+                                             max_window, args.server_utc_offset)
+        if args.dry_run:
+            fetch_planner.describe_plan(planner, planner.plan(missing_ranges), missing_ranges,
+                                        args.chunk_days or LEGACY_CHUNK_DAYS)
+            mt5.shutdown()
+            client.close()
+            return
+        batches = candle_batches(args.symbol, timeframe, planner, missing_ranges, rate_limiter)
     
     # Setup CSV output if requested
     csv_path = None
@@ -279,36 +323,50 @@ def main():
         if not csv_dir.exists():
             csv_dir.mkdir(parents=True, exist_ok=True)
         logging.info(f"CSV output will be written to: {csv_path}")
+    if args.parquet_output:
+        logging.info(f"Parquet output will be written to: {args.parquet_output}")
     
     # Process date chunks
     total_inserted = 0
-    first_csv_write = True
+    # when resuming, append to an existing CSV instead of overwriting it
+    first_csv_write = not (args.resume and csv_path is not None and csv_path.exists())
     
     try:
-        for chunk_start, chunk_end in generate_date_chunks(start_date, end_date, args.chunk_days):
-            logging.info(f"Processing chunk: {chunk_start.date()} to {chunk_end.date()}")
-            
-            # Fetch candles for this chunk
-            candles = fetch_candles(args.symbol, timeframe, chunk_start, chunk_end)
+        for chunk_start, chunk_end, records in batches:
+            if records is None:
+                continue
             
-            # Check if we have enough data
-            if len(candles) < args.min_data_points:
-                logging.warning(f"Insufficient data points ({len(candles)}) for this chunk, skipping")
+            # Check if we have enough data; tick windows may legitimately be empty, and a short
+            # window at the end of a range may hold fewer than min_data_points bars
+            if not ticks and len(records) < min(args.min_data_points, planner.expected_bars(chunk_start, chunk_end)):
+                logging.warning(f"Insufficient data points ({len(records)}) for this chunk, skipping")
                 continue
             
             # Store in MongoDB
-            inserted = store_candles_mongodb(col, args.symbol, candles, timeframe)
-            logging.info(f"Inserted {inserted}/{len(candles)} candles into MongoDB")
+            if ticks:
+                inserted = store_ticks_mongodb(col, args.symbol, records, args.storage, args.write_batch_size)
+            else:
+                inserted = store_candles_mongodb(col, args.symbol, records, timeframe, args.write_batch_size)
+            logging.info(f"Inserted {inserted}/{len(records)} {args.data_type} into MongoDB")
             total_inserted += inserted
             
             # Write to CSV if requested
-            if csv_path:
-                write_candles_csv(csv_path, args.symbol, candles, first_csv_write)
+            if csv_path and len(records):
+                if ticks:
+                    write_ticks_csv(csv_path, args.symbol, records, first_csv_write, args.write_batch_size)
+                else:
+                    write_candles_csv(csv_path, args.symbol, records, first_csv_write)
                 first_csv_write = False
-                logging.info(f"Appended {len(candles)} candles to CSV file")
+                logging.info(f"Appended {len(records)} {args.data_type} to CSV file")
+            
+            # Write to Parquet if requested
+            if args.parquet_output:
+                paths = parquet_sink.write_candles_parquet(args.parquet_output, args.symbol, timeframe_str,
+                                                           records, args.parquet_compression)
+                logging.info(f"Wrote {len(records)} {args.data_type} to {len(paths)} Parquet files")
             
-            # Add a short delay to avoid overwhelming the MT5 API
-            time.sleep(0.5)
+            # Checkpoint the chunk so a resumed run can skip it
+            backfill_checkpoints.record_range(db, args.symbol, timeframe_str, chunk_start, chunk_end, len(records))
     
     except KeyboardInterrupt:
         logging.info("Process interrupted by user")
@@ -317,8 +375,8 @@ def main():
     finally:
         mt5.shutdown()
         client.close()
-        logging.info(f"Process completed. Total candles inserted: {total_inserted}")
+        logging.info(f"Process completed. Total {args.data_type} inserted: {total_inserted}")
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import logging
+import os
+import time
+from pathlib import Path
+import numpy as np
+import pytz
+from pymongo import MongoClient
+
+from candle_aggregator import RATES_DTYPE, TIMEFRAME_SECONDS
+import backfill_checkpoints
+import tick_buckets
+from tick_buckets import TICK_DTYPE, TICK_FIELDS
+
+# Documents fetched per round trip
+DEFAULT_BATCH_SIZE = 10000
+
+DEFAULT_CACHE_BYTES = 2 * 1024 ** 3
+
+# Blocks ending longer ago than this are treated as closed and cached
+DEFAULT_SETTLE_SECONDS = 86400
+
+# Ticks are cached per UTC day, candles in blocks of about CANDLE_BLOCK_BARS bars
+TICK_BLOCK_SECONDS = 86400
+CANDLE_BLOCK_BARS = 10000
+
+
+def _pandas():
+    """Import pandas on first use; it is only needed for as_frame=True"""
+    import pandas
+    return pandas
+
+
+def _seconds(value):
+    """Seconds since epoch from an aware datetime or a number"""
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+def _utc(seconds):
+    return datetime.datetime.fromtimestamp(seconds, tz=pytz.UTC)
+
+
+def block_seconds(timeframe):
+    """Length of the cached blocks for a timeframe, a whole number of days"""
+    if timeframe == 'ticks':
+        return TICK_BLOCK_SECONDS
+    days = max(1, TIMEFRAME_SECONDS[timeframe] * CANDLE_BLOCK_BARS // 86400)
+    return days * 86400
+
+
+class DiskCache:
+    """
+    Size-bounded LRU cache of .npy files. A file's mtime is its last use;
+    the least recently used files are deleted once max_bytes is exceeded.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_CACHE_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._sizes = {p: p.stat().st_size for p in self.path.rglob('*.npy')}
+
+    def _file(self, key):
+        return self.path.joinpath(*key[:-1], f"{key[-1]}.npy")
+
+    def get(self, key):
+        path = self._file(key)
+        try:
+            records = np.load(path, allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return records
+
+    def put(self, key, records):
+        path = self._file(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, records, allow_pickle=False)
+        os.replace(tmp, path)
+        self._sizes[path] = path.stat().st_size
+        self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        for path in sorted(self._sizes, key=_mtime):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= self._sizes.pop(path)
+            if total <= self.max_bytes:
+                break
+
+    def clear(self, *prefix):
+        """Delete the cached files under prefix (everything without one)"""
+        root = self.path.joinpath(*prefix)
+        for path in [p for p in self._sizes if root in p.parents]:
+            path.unlink(missing_ok=True)
+            del self._sizes[path]
+
+
+def _mtime(path):
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+class MarketDataReader:
+    """
+    Range reads of stored candles and ticks as numpy structured arrays
+    (the dtypes of mt5.copy_rates_range / copy_ticks_range).
+
+    Queries project only the array fields and fetch batch_size documents
+    per round trip. With cache_dir, data is cached on disk in fixed time
+    blocks; a block that ended more than settle_seconds ago is considered
+    closed and is cached unless it is empty. Cached blocks are keyed by the
+    newest fetch checkpoint or CSV import overlapping them, so a backfill,
+    import or gap repair of the block makes the next read query it again.
+    """
+
+    def __init__(self, mongo_uri="mongodb://localhost:27017/", db_name="mt5_historical_data", cache_dir=None,
+                 cache_bytes=DEFAULT_CACHE_BYTES, batch_size=DEFAULT_BATCH_SIZE, storage='documents',
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, client=None):
+        self._own_client = client is None
+        self.client = MongoClient(mongo_uri) if client is None else client
+        self.db_name = db_name
+        self.db = self.client[db_name]
+        self.cache = DiskCache(cache_dir, cache_bytes) if cache_dir else None
+        self.batch_size = batch_size
+        self.storage = storage
+        self.settle_seconds = settle_seconds
+
+    def close(self):
+        if self._own_client:
+            self.client.close()
+
+    def read(self, symbol, timeframe, start, end, as_frame=False):
+        """
+        Candles of timeframe ('M1' ... 'D1'), or ticks for timeframe='ticks',
+        with start <= time < end. start and end are aware datetimes or
+        seconds since epoch. Returns a structured array sorted by time, or a
+        DataFrame indexed by UTC datetime with as_frame=True.
+        """
+        start, end = _seconds(start), _seconds(end)
+        if timeframe == 'ticks':
+            name = tick_buckets.collection_name(symbol, self.storage)
+        else:
+            name = f"candles_{symbol}_{timeframe}"
+        dtype = TICK_DTYPE if timeframe == 'ticks' else RATES_DTYPE
+        if self.cache is None or start >= end:
+            records = self._query(name, dtype, symbol, start, end)
+        else:
+            records = self._read_blocks(name, dtype, symbol, timeframe, start, end)
+        if as_frame:
+            return _frame(records)
+        return records
+
+    def _block_versions(self, symbol, timeframe):
+        """(start, end, version) of the recorded ranges, as seconds and milliseconds since epoch"""
+        return [(int(s.timestamp()), int(e.timestamp()), int(recorded_at.timestamp() * 1000))
+                for s, e, recorded_at in backfill_checkpoints.load_recorded(self.db, symbol, timeframe)]
+
+    def _read_blocks(self, name, dtype, symbol, timeframe, start, end):
+        size = block_seconds(timeframe)
+        closed_before = time.time() - self.settle_seconds
+        recorded = self._block_versions(symbol, timeframe)
+        parts = []
+        run = []
+        for block_start in range(start - start % size, end, size):
+            block_end = block_start + size
+            # the newest range recorded over the block, 0 when there is none
+            version = max((v for s, e, v in recorded if s < block_end and e >= block_start), default=0)
+            block = (block_start, block_end, version)
+            cached = None
+            if block_end <= closed_before:
+                cached = self.cache.get(self._block_key(name, block))
+            if cached is None:
+                run.append(block)
+                continue
+            if run:
+                parts.append(self._fetch_run(name, dtype, symbol, run, start, end, closed_before))
+                run = []
+            parts.append(cached)
+        if run:
+            parts.append(self._fetch_run(name, dtype, symbol, run, start, end, closed_before))
+        records = np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+        times = records['time']
+        return records[np.searchsorted(times, start):np.searchsorted(times, end)]
+
+    def _fetch_run(self, name, dtype, symbol, run, start, end, closed_before):
+        """Query consecutive uncached blocks in one go and cache the closed, non-empty ones"""
+        # whole blocks when they can be cached, only the requested part otherwise
+        query_start = run[0][0] if run[0][1] <= closed_before else max(start, run[0][0])
+        query_end = run[-1][1] if run[-1][1] <= closed_before else min(end, run[-1][1])
+        records = self._query(name, dtype, symbol, query_start, query_end)
+        times = records['time']
+        for block in run:
+            block_start, block_end, _ = block
+            if block_end <= closed_before:
+                block_records = records[np.searchsorted(times, block_start):np.searchsorted(times, block_end)]
+                if len(block_records) == 0:
+                    continue
+                key = self._block_key(name, block)
+                # drop the versions cached before the block was backfilled again
+                self.cache.clear(*key[:-1])
+                self.cache.put(key, block_records)
+        return records
+
+    def _block_key(self, name, block):
+        block_start, block_end, version = block
+        return self.db_name, name, f"{block_start}_{block_end}", str(version)
+
+    def _query(self, name, dtype, symbol, start, end):
+        col = self.db[name]
+        if dtype is TICK_DTYPE and self.storage == 'buckets':
+            return tick_buckets.read_bucketed_ticks(col, _utc(start), _utc(end))
+        if dtype is TICK_DTYPE and self.storage == 'timeseries':
+            query = {"datetime": {"$gte": _utc(start), "$lt": _utc(end)}}
+            fields = TICK_FIELDS
+        else:
+            query = {"symbol": symbol, "time": {"$gte": start, "$lt": end}}
+            fields = list(dtype.names)
+        projection = dict.fromkeys(fields, 1)
+        projection["_id"] = 0
+        docs = list(col.find(query, projection).batch_size(self.batch_size))
+        records = np.zeros(len(docs), dtype=dtype)
+        for field in fields:
+            records[field] = [doc.get(field, 0) for doc in docs]
+        if 'time_msc' in dtype.names:
+            if 'time' not in fields:
+                records['time'] = records['time_msc'] // 1000
+            order = np.argsort(records['time_msc'], kind='stable')
+        else:
+            order = np.argsort(records['time'], kind='stable')
+        return records[order]
+
+
+def _frame(records):
+    pd = _pandas()
+    df = pd.DataFrame(records)
+    if 'time_msc' in records.dtype.names:
+        df.index = pd.to_datetime(records['time_msc'], unit='ms', utc=True)
+    else:
+        df.index = pd.to_datetime(records['time'], unit='s', utc=True)
+    return df
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Read stored candles or ticks for a date range')
+    parser.add_argument('--symbol', required=True, help='Symbol to read (e.g. EURUSD)')
+    parser.add_argument('--timeframe', required=True, choices=list(TIMEFRAME_SECONDS) + ['ticks'],
+                        help='Candle timeframe, or ticks')
+    parser.add_argument('--start_date', required=True, help='Start date in YYYY-MM-DD format (UTC)')
+    parser.add_argument('--end_date', required=True, help='End date in YYYY-MM-DD format (UTC, exclusive)')
+    parser.add_argument('--mongo_uri', default="mongodb://localhost:27017/",
+                        help='MongoDB URI (default: mongodb://localhost:27017/)')
+    parser.add_argument('--db_name', default="mt5_historical_data",
+                        help='Database to read (default: mt5_historical_data; the live fetchers use mt5_data)')
+    parser.add_argument('--storage', choices=tick_buckets.STORAGE_MODES, default='documents',
+                        help='Tick storage layout to read (default: documents)')
+    parser.add_argument('--cache_dir', default=None, help='Directory of the on-disk range cache (default: no cache)')
+    parser.add_argument('--cache_size_mb', type=int, default=DEFAULT_CACHE_BYTES // 1024 ** 2,
+                        help=f'Cache size limit in MB (default: {DEFAULT_CACHE_BYTES // 1024 ** 2})')
+    parser.add_argument('--output', default=None, help='Write the records to this .npy or .csv file')
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    args = parse_args()
+    start = pytz.UTC.localize(datetime.datetime.strptime(args.start_date, "%Y-%m-%d"))
+    end = pytz.UTC.localize(datetime.datetime.strptime(args.end_date, "%Y-%m-%d"))
+
+    reader = MarketDataReader(args.mongo_uri, args.db_name, args.cache_dir, args.cache_size_mb * 1024 ** 2,
+                              storage=args.storage)
+    try:
+        started = time.monotonic()
+        records = reader.read(args.symbol, args.timeframe, start, end)
+        elapsed = time.monotonic() - started
+    finally:
+        reader.close()
+    logging.info(f"Read {len(records)} {args.timeframe} records for {args.symbol} in {elapsed:.2f}s")
+    if args.output:
+        if args.output.endswith('.npy'):
+            np.save(args.output, records)
+        else:
+            _frame(records).to_csv(args.output, index=False)
+        logging.info(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+import logging
+import time
+import pytz
+
+# Forex week: opens Sunday 22:00 UTC, closes Friday 22:00 UTC
+OPEN_WEEKDAY = 6   # Sunday
+CLOSE_WEEKDAY = 4  # Friday
+SESSION_HOUR = 22
+WEEK = datetime.timedelta(days=7)
+SESSION_LENGTH = datetime.timedelta(days=CLOSE_WEEKDAY - OPEN_WEEKDAY + 7)
+
+
+def week_open(dt):
+    """The Sunday 22:00 UTC at or before dt (an aware datetime)"""
+    dt = dt.astimezone(pytz.UTC)
+    days_back = (dt.weekday() - OPEN_WEEKDAY) % 7
+    opened = (dt - datetime.timedelta(days=days_back)).replace(
+        hour=SESSION_HOUR, minute=0, second=0, microsecond=0)
+    if opened > dt:
+        opened -= WEEK
+    return opened
+
+
+def is_market_open(now=None):
+    """
+    Check Forex market hours: opens Sunday 22:00 UTC, closes Friday 22:00 UTC.
+    """
+    if now is None:
+        now = datetime.datetime.now(pytz.UTC)
+    return now - week_open(now) < SESSION_LENGTH
+
+
+def sessions(start, end, utc_offset=0):
+    """
+    Yield the (open, close) trading sessions overlapping [start, end),
+    clipped to it.
+
+    utc_offset shifts the sessions by that many hours, for timestamps in a
+    broker's server time instead of UTC (MT5 bar times are server time).
+    """
+    offset = datetime.timedelta(hours=utc_offset)
+    opened = week_open(start - offset) + offset
+    while opened < end:
+        closed = opened + SESSION_LENGTH
+        if closed > start:
+            yield max(opened, start), min(closed, end)
+        opened += WEEK
+
+
+def load_closures(path):
+    """
+    Read holiday closures from a JSON list of {"start": ..., "end": ...}
+    ISO 8601 datetimes; naive datetimes are taken as UTC.
+    """
+    if not path:
+        return []
+    with open(path) as f:
+        entries = json.load(f)
+    closures = []
+    for entry in entries:
+        start, end = (datetime.datetime.fromisoformat(entry[key].replace('Z', '+00:00'))
+                      for key in ('start', 'end'))
+        closures.append((_as_utc(start), _as_utc(end)))
+    return sorted(closures)
+
+
+def _as_utc(dt):
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=pytz.UTC)
+    return dt.astimezone(pytz.UTC)
+
+
+class SessionSchedule:
+    """
+    Weekly sessions minus holiday closures. Lets the live fetchers sleep
+    straight through a weekend or holiday instead of polling it.
+    """
+
+    def __init__(self, closures=()):
+        self.closures = sorted(closures)
+
+    def _closure_end(self, now):
+        for start, end in self.closures:
+            if start <= now < end:
+                return end
+        return None
+
+    def is_open(self, now):
+        return is_market_open(now) and self._closure_end(now) is None
+
+    def next_open(self, now):
+        """now when the market is open, otherwise the time it reopens"""
+        now = now.astimezone(pytz.UTC)
+        while True:
+            if not is_market_open(now):
+                now = week_open(now) + WEEK
+                continue
+            closure_end = self._closure_end(now)
+            if closure_end is None:
+                return now
+            now = closure_end
+
+    def seconds_until_open(self, now):
+        return (self.next_open(now) - now).total_seconds()
+
+    def sleep_until_open(self, now, tz=pytz.UTC):
+        """Sleep through a closure in one go; returns the reopening time"""
+        reopen = self.next_open(now)
+        logging.info(f"Market closed at {now.isoformat()}, sleeping until {reopen.astimezone(tz).isoformat()}")
+        time.sleep(max(0.0, (reopen - datetime.datetime.now(pytz.UTC)).total_seconds()))
+        return reopen
+
+
+def add_arguments(parser):
+    """Add the market schedule options shared by the live fetchers"""
+    parser.add_argument('--holidays', default=None,
+                        help='JSON file with holiday closures [{"start": ISO datetime, "end": ISO datetime}] '
+                             'to sleep through like weekends')
+
+
+def from_args(args):
+    return SessionSchedule(load_closures(args.holidays))
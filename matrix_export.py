@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+import pytz
+from numpy.lib.format import open_memmap
+from pymongo import MongoClient
+
+from candle_aggregator import RATES_DTYPE, TIMEFRAME_SECONDS
+import gap_scanner
+from gap_scanner import expected_times
+import market_hours
+
+# Documents read per round trip and scattered into the matrix at once
+READ_BATCH_SIZE = 100000
+
+# Grid rows forward-filled at once
+FILL_BLOCK_ROWS = 1000000
+
+VALUES_FILE = "values.npy"
+TIMES_FILE = "times.npy"
+INDEX_FILE = "index.json"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export stored candles of many symbols as one time x symbol x field '
+                                                 'array aligned on a trading-session grid, written to .npy files '
+                                                 'that can be memory-mapped')
+    parser.add_argument('--symbols', required=True, help='Comma-separated symbols (e.g. EURUSD,GBPUSD,XAUUSD)')
+    parser.add_argument('--timeframe', default='M1', choices=list(TIMEFRAME_SECONDS),
+                        help='Timeframe of the candles_SYMBOL_TF collections (default: M1)')
+    parser.add_argument('--fields', default='close',
+                        help=f'Comma-separated bar fields from {",".join(RATES_DTYPE.names[1:])} (default: close)')
+    parser.add_argument('--start_date', required=True, help='Start date in YYYY-MM-DD format')
+    parser.add_argument('--end_date', required=True, help='End date in YYYY-MM-DD format, exclusive')
+    parser.add_argument('--output', required=True, help='Directory for values.npy, times.npy and index.json')
+    parser.add_argument('--ffill_limit', type=int, default=0,
+                        help='Carry the last bar forward over at most this many missing grid rows; -1 for '
+                             'no limit (default: 0, missing bars stay NaN)')
+    parser.add_argument('--dtype', choices=['float32', 'float64'], default='float32',
+                        help='Value type of the exported array (default: float32)')
+    parser.add_argument('--mongo_uri', default="mongodb://localhost:27017/",
+                        help='MongoDB URI (default: mongodb://localhost:27017/)')
+    parser.add_argument('--db_name', default="mt5_historical_data",
+                        help='Database holding the candles (default: mt5_historical_data)')
+    parser.add_argument('--server_utc_offset', type=float, default=None,
+                        help='Hours the broker\'s server time is ahead of UTC, used to place the '
+                             'weekend closure in bar times (default: inferred from the stored bars)')
+    market_hours.add_arguments(parser)
+    args = parser.parse_args()
+    args.symbols = [s.strip() for s in args.symbols.split(',') if s.strip()]
+    args.fields = [f.strip() for f in args.fields.split(',') if f.strip()]
+    unknown = [f for f in args.fields if f not in RATES_DTYPE.names or f == 'time']
+    if unknown:
+        parser.error(f"unknown fields: {', '.join(unknown)}")
+    return args
+
+
+def _date(value):
+    return int(pytz.UTC.localize(datetime.datetime.strptime(value, "%Y-%m-%d")).timestamp())
+
+
+def stored_batches(collection, symbol, fields, start, end, batch_size=READ_BATCH_SIZE):
+    """Yield (times, values) arrays of the stored bars in [start, end), batch_size bars at a time"""
+    projection = dict.fromkeys(['time'] + fields, 1)
+    projection['_id'] = 0
+    cursor = collection.find({"symbol": symbol, "time": {"$gte": start, "$lt": end}}, projection)
+    cursor = cursor.batch_size(batch_size)
+    docs = []
+    for doc in cursor:
+        docs.append(doc)
+        if len(docs) == batch_size:
+            yield _columns(docs, fields)
+            docs = []
+    if docs:
+        yield _columns(docs, fields)
+
+
+def _columns(docs, fields):
+    times = np.fromiter((doc['time'] for doc in docs), dtype=np.int64, count=len(docs))
+    values = np.array([[doc.get(field, np.nan) for field in fields] for doc in docs], dtype=np.float64)
+    return times, values
+
+
+def infer_utc_offset(db, symbols, timeframe, start, end):
+    """
+    Server UTC offset the stored bars of symbols put the weekend closure
+    at, inferred like gap_scanner does: from timeframe, or from H1 for
+    coarser ones, over the range and a week either side of it. The most
+    common offset wins; 0 when there is no weekend to infer it from.
+    """
+    if TIMEFRAME_SECONDS[timeframe] > gap_scanner.INFER_MAX_SECONDS:
+        timeframe = 'H1'
+    week = int(market_hours.WEEK.total_seconds())
+    offsets = {}
+    for symbol in symbols:
+        stored = gap_scanner.stored_times(db[f"candles_{symbol}_{timeframe}"], symbol, start - week, end + week)
+        offset = gap_scanner.infer_utc_offset(stored)
+        if offset is not None:
+            offsets[symbol] = offset
+    if not offsets:
+        logging.warning("No weekend in the stored bars to infer the server UTC offset from, assuming 0; "
+                        "set --server_utc_offset")
+        return 0.0
+    values, counts = np.unique(list(offsets.values()), return_counts=True)
+    offset = float(values[np.argmax(counts)])
+    disagree = [symbol for symbol, o in offsets.items() if o != offset]
+    if disagree:
+        logging.warning(f"{', '.join(disagree)}: stored bars suggest a different server UTC offset than "
+                        f"UTC{offset:+g}")
+    logging.info(f"Server time inferred as UTC{offset:+g} from the weekend closures")
+    return offset
+
+
+def scatter(matrix, column, grid, times, values):
+    """Write the rows whose time is on the grid into matrix[:, column]; returns how many were"""
+    if len(grid) == 0:
+        return 0
+    rows = np.searchsorted(grid, times)
+    rows[rows == len(grid)] = 0
+    on_grid = grid[rows] == times
+    matrix[rows[on_grid], column] = values[on_grid]
+    return int(np.count_nonzero(on_grid))
+
+
+def forward_fill(matrix, column, limit, block_rows=FILL_BLOCK_ROWS):
+    """
+    Fill NaNs of matrix[:, column] from the last value above them, across
+    at most limit rows (no limit when negative), a block of rows at a time.
+    Returns the number of rows filled.
+    """
+    if limit == 0:
+        return 0
+    width = matrix.shape[2]
+    # last value seen and its row, carried from block to block
+    last = np.full(width, np.nan)
+    last_row = np.full(width, -1, dtype=np.int64)
+    filled = 0
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.asarray(matrix[start:start + block_rows, column], dtype=np.float64)
+        rows = np.arange(start, start + len(block), dtype=np.int64)[:, None]
+        valid = ~np.isnan(block)
+        source = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+        source = np.maximum(source, last_row)
+        from_block = source >= start
+        values = np.where(from_block, block[np.clip(source - start, 0, None), np.arange(width)], last)
+        fill = ~valid & (source >= 0)
+        if limit > 0:
+            fill &= rows - source <= limit
+        if fill.any():
+            block[fill] = values[fill]
+            matrix[start:start + len(block), column] = block
+            filled += int(np.count_nonzero(fill.any(axis=1)))
+        last = values[-1]
+        last_row = source[-1]
+    return filled
+
+
+def export(db, symbols, timeframe, fields, start, end, output, ffill_limit=0, dtype='float32', utc_offset=None,
+           closures=()):
+    """
+    Write values.npy (grid rows x symbols x fields, NaN where no bar),
+    times.npy (bar open times of the grid rows) and index.json to output.
+    Without utc_offset it is inferred from the stored bars. Returns the
+    index.
+    """
+    if utc_offset is None:
+        utc_offset = infer_utc_offset(db, symbols, timeframe, start, end)
+    grid = expected_times(timeframe, start, end, utc_offset, closures)
+    if len(grid) == 0:
+        logging.warning("No trading-session bars in the requested range, exporting an empty matrix")
+    os.makedirs(output, exist_ok=True)
+    np.save(os.path.join(output, TIMES_FILE), grid)
+    matrix = open_memmap(os.path.join(output, VALUES_FILE), mode='w+', dtype=dtype,
+                         shape=(len(grid), len(symbols), len(fields)))
+    matrix[:] = np.nan
+    stats = {}
+    for column, symbol in enumerate(symbols):
+        started = time.monotonic()
+        collection = db[f"candles_{symbol}_{timeframe}"]
+        stored = on_grid = 0
+        for times, values in stored_batches(collection, symbol, fields, start, end):
+            stored += len(times)
+            on_grid += scatter(matrix, column, grid, times, values)
+        filled = forward_fill(matrix, column, ffill_limit)
+        missing = len(grid) - on_grid - filled
+        stats[symbol] = {"stored": stored, "on_grid": on_grid, "filled": filled, "missing": missing}
+        logging.info(f"{symbol}: {on_grid}/{len(grid)} grid rows from {stored} stored bars, {filled} filled, "
+                     f"{missing} missing ({time.monotonic() - started:.2f}s)")
+        if stored > on_grid:
+            logging.warning(f"{symbol}: {stored - on_grid} bars outside the session grid, check --server_utc_offset")
+    matrix.flush()
+    del matrix
+    index = {
+        "values": VALUES_FILE,
+        "times": TIMES_FILE,
+        "axes": ["time", "symbol", "field"],
+        "shape": [len(grid), len(symbols), len(fields)],
+        "dtype": dtype,
+        "timeframe": timeframe,
+        "symbols": symbols,
+        "fields": fields,
+        "start": datetime.datetime.fromtimestamp(start, tz=pytz.UTC).isoformat(),
+        "end": datetime.datetime.fromtimestamp(end, tz=pytz.UTC).isoformat(),
+        "server_utc_offset": utc_offset,
+        "ffill_limit": ffill_limit,
+        "stats": stats
+    }
+    with open(os.path.join(output, INDEX_FILE), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def load(output, mmap_mode='r'):
+    """Return (values, times, index) of an export; values is memory-mapped, not read"""
+    with open(os.path.join(output, INDEX_FILE)) as f:
+        index = json.load(f)
+    values = np.load(os.path.join(output, index["values"]), mmap_mode=mmap_mode)
+    times = np.load(os.path.join(output, index["times"]))
+    return values, times, index
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    args = parse_args()
+    try:
+        start = _date(args.start_date)
+        end = _date(args.end_date)
+    except ValueError as e:
+        logging.critical(f"Invalid date format. Use YYYY-MM-DD: {e}")
+        sys.exit(1)
+    if start >= end:
+        logging.critical("Start date must be before end date")
+        sys.exit(1)
+
+    client = MongoClient(args.mongo_uri)
+    try:
+        index = export(client[args.db_name], args.symbols, args.timeframe, args.fields, start, end, args.output,
+                       args.ffill_limit, args.dtype, args.server_utc_offset, market_hours.load_closures(args.holidays))
+    finally:
+        client.close()
+    size = np.prod(index["shape"]) * np.dtype(index["dtype"]).itemsize
+    logging.info(f"Wrote {' x '.join(map(str, index['shape']))} {index['dtype']} array "
+                 f"({size / 2**20:.1f} MiB) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'mt5_stage_seconds': ('histogram', 'Time spent per ingest stage (mt5_copy, convert, mongo_write, '
+                          'and mongo_flush in the write-behind thread)', LATENCY_BUCKETS),
+    'mt5_cycle_seconds': ('histogram', 'Duration of one poll cycle over all symbols', LATENCY_BUCKETS),
+    'mt5_tick_lag_seconds': ('histogram', 'Time from the newest tick of a batch to its hand-off for storage',
+                             LAG_BUCKETS),
+    'mt5_write_behind_delay_seconds': ('histogram', 'Time writes waited in the write-behind queue',
+                                       LAG_BUCKETS),
+    'mt5_ticks_total': ('counter', 'New ticks fetched from MT5', None),
+    'mt5_candles_total': ('counter', 'Closed candles fetched from MT5', None),
+    'mt5_features_total': ('counter', 'Closed bars whose derived features were stored', None),
+    'mt5_writes_total': ('counter', 'Documents inserted or upserted in MongoDB', None),
+    'mt5_duplicates_total': ('counter', 'Writes rejected as duplicates', None),
+    'mt5_window_duplicates_total': ('counter', 'Ticks dropped as duplicates by the in-memory dedupe window', None),
+    'mt5_dropped_total': ('counter', 'Writes discarded by the write-behind overflow policy', None),
+    'mt5_spilled_total': ('counter', 'Writes spilled to disk by the write-behind buffer', None),
+    'mt5_queue_depth': ('gauge', 'Writes pending in the write-behind queue', None),
+    'mt5_journal_pending': ('gauge', 'Journaled ticks not yet stored in MongoDB', None),
+    'mt5_last_tick_lag_seconds': ('gauge', 'Lag of the newest tick handed off for storage', None),
+    'mt5_startup_seconds': ('gauge', 'Time from process start to the first poll', None),
+    'mt5_closed_wakeups_total': ('counter', 'Wakeups while the market was closed', None),
+    'mt5_job_up': ('gauge', 'Whether a supervisor job is running (1) or failed/finished (0)', None),
+    'mt5_job_restarts_total': ('counter', 'Supervisor job restarts after a failure', None),
+}
+
+# None while metrics are disabled; every recording call returns immediately then
+_registry = None
+
+
+class _Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in METRICS}
+        self.callbacks = {}
+
+    def render(self):
+        """Prometheus text exposition format"""
+        for (name, labels), fn in list(self.callbacks.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                logging.debug(f"Metric callback for {name} failed: {e}")
+                continue
+            with self.lock:
+                self.values[name][labels] = float(value)
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, buckets) in METRICS.items():
+                series = self.values[name]
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series.items()):
+                    if kind != 'histogram':
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+                        continue
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, n in zip(buckets, counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def enabled():
+    return _registry is not None
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter"""
+    if _registry is None:
+        return
+    key = _key(labels)
+    with _registry.lock:
+        series = _registry.values[name]
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    if _registry is None:
+        return
+    with _registry.lock:
+        _registry.values[name][_key(labels)] = float(value)
+
+
+def gauge_callback(name, fn, **labels):
+    """Set a gauge from fn() every time the endpoint is scraped"""
+    if _registry is None:
+        return
+    _registry.callbacks[(name, _key(labels))] = fn
+
+
+def observe(name, value, **labels):
+    """Record value in a histogram"""
+    if _registry is None:
+        return
+    buckets = METRICS[name][2]
+    key = _key(labels)
+    with _registry.lock:
+        series = _registry.values[name]
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = [[0] * len(buckets), 0.0, 0]
+        index = bisect.bisect_left(buckets, value)
+        if index < len(buckets):
+            hist[0][index] += 1
+        hist[1] += value
+        hist[2] += 1
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name, **labels):
+    """Context manager recording its duration in a histogram"""
+    if _registry is None:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+def stage(stage_name, **labels):
+    """Time one ingest stage in mt5_stage_seconds"""
+    if _registry is None:
+        return _NULL_TIMER
+    return _Timer('mt5_stage_seconds', dict(labels, stage=stage_name))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = _registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port, host='127.0.0.1'):
+    """Enable recording and serve /metrics from a daemon thread"""
+    global _registry
+    if _registry is None:
+        _registry = _Registry()
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def add_arguments(parser):
+    """Add the metrics endpoint options shared by the live fetchers"""
+    parser.add_argument('--metrics_port', type=int, default=None,
+                        help='Serve Prometheus metrics on this port (default: disabled)')
+    parser.add_argument('--metrics_host', default='127.0.0.1',
+                        help='Address the metrics endpoint binds to (default: 127.0.0.1)')
+
+
+def from_args(args):
+    """Start the metrics endpoint when --metrics_port is set; returns the server or None"""
+    if args.metrics_port is None:
+        return None
+    return start(args.metrics_port, args.metrics_host)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import logging
+from pymongo import InsertOne, UpdateOne, errors
+
+# Default number of operations sent to MongoDB in a single bulk write
+DEFAULT_BATCH_SIZE = 1000
+
+# Server error codes reported for duplicate key violations
+DUPLICATE_KEY_CODES = {11000, 11001, 12582}
+
+
+def iter_batches(items, batch_size):
+    """Yield consecutive slices of at most batch_size items"""
+    if batch_size is None or batch_size <= 0:
+        batch_size = len(items) or 1
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def write_unordered(collection, requests, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Send pymongo write requests as unordered bulk writes, split into batches.
+
+    Plain dicts are treated as InsertOne requests. Duplicate key errors are
+    counted instead of raised; any other write error is re-raised.
+    Returns (applied, duplicates) where applied counts inserted documents
+    plus upserted/modified ones.
+    """
+    requests = [InsertOne(r) if isinstance(r, dict) else r for r in requests]
+    applied = 0
+    duplicates = 0
+    for batch in iter_batches(requests, batch_size):
+        try:
+            result = collection.bulk_write(batch, ordered=False)
+            details = result.bulk_api_result
+        except errors.BulkWriteError as e:
+            details = e.details
+            write_errors = details.get('writeErrors', [])
+            other = [w for w in write_errors if w.get('code') not in DUPLICATE_KEY_CODES]
+            if other or details.get('writeConcernErrors'):
+                raise
+            duplicates += len(write_errors)
+        applied += (details.get('nInserted', 0) + details.get('nUpserted', 0)
+                    + details.get('nModified', 0))
+    return applied, duplicates
+
+
+def insert_unordered(collection, docs, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insert documents with unordered insert_many calls, split into batches.
+
+    Returns (inserted, duplicates); duplicate key errors are counted from the
+    bulk write error details, matching one insert_one per document that
+    skips DuplicateKeyError.
+    """
+    inserted = 0
+    duplicates = 0
+    for batch in iter_batches(docs, batch_size):
+        try:
+            result = collection.insert_many(batch, ordered=False)
+            inserted += len(result.inserted_ids)
+        except errors.BulkWriteError as e:
+            details = e.details
+            write_errors = details.get('writeErrors', [])
+            other = [w for w in write_errors if w.get('code') not in DUPLICATE_KEY_CODES]
+            if other or details.get('writeConcernErrors'):
+                raise
+            inserted += details.get('nInserted', 0)
+            duplicates += len(write_errors)
+            logging.debug(f"Skipped {len(write_errors)} duplicate documents in {collection.name}")
+    return inserted, duplicates
+
+
+def upsert_requests(docs, key_fields):
+    """UpdateOne upserts that replace the fields of each document matched on key_fields"""
+    return [
+        UpdateOne({field: doc[field] for field in key_fields}, {"$set": doc}, upsert=True)
+        for doc in docs
+    ]
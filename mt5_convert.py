@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import itertools
+import numpy as np
+
+
+def _pandas():
+    """Import pandas on first use; it is only needed for timezone conversion"""
+    import pandas
+    return pandas
+
+
+def _format_offset(seconds):
+    """Format a UTC offset in seconds the way datetime.isoformat() does"""
+    sign = '-' if seconds < 0 else '+'
+    hours, rem = divmod(abs(int(seconds)), 3600)
+    minutes, secs = divmod(rem, 60)
+    out = f"{sign}{hours:02d}:{minutes:02d}"
+    if secs:
+        out += f":{secs:02d}"
+    return out
+
+
+def utc_isoformat(times):
+    """
+    Vectorized equivalent of datetime.fromtimestamp(ts, tz=UTC).isoformat()
+    for an array of whole seconds since epoch.
+    """
+    secs = np.asarray(times, dtype='int64')
+    base = np.datetime_as_string(secs.astype('datetime64[s]'), unit='s')
+    return np.char.add(base, '+00:00')
+
+
+def local_isoformat(times, tz):
+    """
+    Vectorized equivalent of
+    datetime.fromtimestamp(ts, tz=UTC).astimezone(tz).isoformat()
+    for an array of whole seconds since epoch.
+    """
+    secs = np.asarray(times, dtype='int64')
+    if len(secs) == 0:
+        return np.array([], dtype=str)
+    wall = (_pandas().to_datetime(secs, unit='s', utc=True)
+            .tz_convert(tz)
+            .tz_localize(None)
+            .values.astype('datetime64[s]'))
+    offsets = wall.astype('int64') - secs
+    # only a handful of distinct offsets (DST changes), format each once
+    unique_offsets, inverse = np.unique(offsets, return_inverse=True)
+    suffixes = np.array([_format_offset(o) for o in unique_offsets])[inverse.ravel()]
+    return np.char.add(np.datetime_as_string(wall, unit='s'), suffixes)
+
+
+def to_documents(records, fields):
+    """
+    Turn an MT5 structured array into a list of dicts in one pass.
+
+    Every dtype field is converted to native Python types (same as
+    r[name].item()) and followed by the entries of fields, in order.
+    A field value that is a numpy array or list is used as a column,
+    anything else is repeated on every document.
+    """
+    keys = list(records.dtype.names)
+    columns = [records[name].tolist() for name in keys]
+    for key, value in fields.items():
+        keys.append(key)
+        if isinstance(value, np.ndarray):
+            columns.append(value.tolist())
+        elif isinstance(value, list):
+            columns.append(value)
+        else:
+            columns.append(itertools.repeat(value))
+    return [dict(zip(keys, row)) for row in zip(*columns)]
+
+
+def tick_documents(ticks, symbol, local_tz, ids=None):
+    """Documents for ticks_{symbol} collections, with the given _id values if any"""
+    times = ticks['time']
+    fields = {
+        "symbol": symbol,
+        "timestamp": times,
+        "datetime_utc": utc_isoformat(times),
+        "datetime_local": local_isoformat(times, local_tz)
+    }
+    if ids is not None:
+        fields["_id"] = ids
+    return to_documents(ticks, fields)
+
+
+def candle_documents(rates, symbol, timeframe, local_tz=None):
+    """Documents for candles_{symbol}_{timeframe} collections"""
+    times = rates['time']
+    fields = {
+        "symbol": symbol,
+        "timeframe": timeframe,
+        "timestamp": times,
+        "datetime_utc": utc_isoformat(times)
+    }
+    if local_tz is not None:
+        fields["datetime_local"] = local_isoformat(times, local_tz)
+    return to_documents(rates, fields)
+
+
+def candle_csv_rows(rates, symbol):
+    """Rows for csv.DictWriter in historical CSV exports"""
+    times = rates['time']
+    return to_documents(rates, {
+        "symbol": symbol,
+        "datetime_utc": utc_isoformat(times)
+    })
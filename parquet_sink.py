@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+import numpy as np
+
+COMPRESSIONS = ['zstd', 'snappy', 'gzip', 'lz4', 'brotli', 'none']
+
+
+def _pyarrow():
+    """Import pyarrow on first use; it is only needed for Parquet output"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet output (pip install pyarrow)") from e
+    return pyarrow, pyarrow.parquet
+
+
+def partition_dir(root, symbol, timeframe, month):
+    """Hive-style partition directory, e.g. root/symbol=EURUSD/timeframe=M1/month=2024-01"""
+    return Path(root) / f"symbol={symbol}" / f"timeframe={timeframe}" / f"month={month}"
+
+
+def candles_to_table(candles):
+    """Arrow table with one column per dtype field plus a UTC timestamp column"""
+    pa, _ = _pyarrow()
+    columns = {name: pa.array(candles[name]) for name in candles.dtype.names}
+    columns['datetime_utc'] = pa.array(candles['time'].astype('datetime64[s]'), type=pa.timestamp('s', tz='UTC'))
+    return pa.table(columns)
+
+
+def _part_range(path):
+    """(first, last) bar time of a part file, from its name"""
+    _, first, last = path.stem.split('-')
+    return int(first), int(last)
+
+
+def _read_records(path, dtype):
+    _, pq = _pyarrow()
+    table = pq.read_table(path, columns=list(dtype.names))
+    records = np.zeros(table.num_rows, dtype=dtype)
+    for name in dtype.names:
+        records[name] = table.column(name).to_numpy()
+    return records
+
+
+def merge_records(existing, new, timeframe):
+    """
+    new plus the rows of existing it does not repeat, in time order. Bars
+    are keyed on time and the new bar wins; ticks ("ticks" timeframe) only
+    drop exact duplicates, since several ticks can share a time_msc.
+    """
+    if timeframe == 'ticks':
+        merged = np.concatenate([new, existing])
+        _, keep = np.unique(merged, return_index=True)
+        merged = merged[np.sort(keep)]
+        return merged[np.argsort(merged['time_msc'], kind='stable')]
+    merged = np.concatenate([new, existing])
+    _, keep = np.unique(merged['time'], return_index=True)
+    return merged[keep]
+
+
+def write_candles_parquet(root, symbol, timeframe, candles, compression='zstd'):
+    """
+    Write a chunk of candles (or ticks, with timeframe "ticks") as Parquet
+    files, one file per month partition.
+
+    Each file is named after the first and last bar time it holds. A chunk
+    that does not overlap the files of its partition becomes a new file;
+    one that does is merged with the overlapping files (see merge_records)
+    and replaces them, so re-fetched ranges never leave duplicate rows.
+    Returns the paths written.
+    """
+    _, pq = _pyarrow()
+    if len(candles) == 0:
+        return []
+    if np.any(np.diff(candles['time']) < 0):
+        candles = np.sort(candles, order='time')
+    months = candles['time'].astype('datetime64[s]').astype('datetime64[M]')
+    _, starts = np.unique(months, return_index=True)
+    paths = []
+    for group in np.split(candles, starts[1:]):
+        month = str(group['time'][:1].astype('datetime64[s]').astype('datetime64[M]')[0])
+        directory = partition_dir(root, symbol, timeframe, month)
+        directory.mkdir(parents=True, exist_ok=True)
+        first, last = int(group['time'][0]), int(group['time'][-1])
+        overlapping = []
+        for existing in sorted(directory.glob("part-*.parquet")):
+            existing_first, existing_last = _part_range(existing)
+            if existing_first <= last and existing_last >= first:
+                overlapping.append(existing)
+                group = merge_records(_read_records(existing, group.dtype), group, timeframe)
+        path = directory / f"part-{int(group['time'][0])}-{int(group['time'][-1])}.parquet"
+        # the merged file is in place before the ones it replaces go, so a crash never loses rows
+        staging = path.with_suffix('.tmp')
+        pq.write_table(candles_to_table(group), staging,
+                       compression=None if compression == 'none' else compression)
+        staging.replace(path)
+        for existing in overlapping:
+            if existing != path:
+                existing.unlink()
+        paths.append(path)
+    return paths
+
+
+def read_candles_parquet(root, symbol, timeframe, columns=None, start=None, end=None):
+    """
+    Load candles of one symbol/timeframe as an Arrow table.
+
+    Only the partitions overlapping [start, end] (datetimes) are opened and
+    only the requested columns are read; files are memory-mapped.
+    """
+    pa, pq = _pyarrow()
+    base = Path(root) / f"symbol={symbol}" / f"timeframe={timeframe}"
+    first_month = np.datetime64(start.replace(tzinfo=None), 'M') if start is not None else None
+    last_month = np.datetime64(end.replace(tzinfo=None), 'M') if end is not None else None
+    tables = []
+    for directory in sorted(base.glob("month=*")):
+        month = np.datetime64(directory.name.split('=', 1)[1], 'M')
+        if first_month is not None and month < first_month:
+            continue
+        if last_month is not None and month > last_month:
+            continue
+        for path in sorted(directory.glob("*.parquet")):
+            tables.append(pq.read_table(path, columns=columns, memory_map=True))
+    if not tables:
+        return None
+    table = pa.concat_tables(tables)
+    if (start is not None or end is not None) and 'time' in table.column_names:
+        times = table.column('time').to_numpy()
+        mask = np.ones(len(times), dtype=bool)
+        if start is not None:
+            mask &= times >= int(start.timestamp())
+        if end is not None:
+            mask &= times <= int(end.timestamp())
+        table = table.filter(pa.array(mask))
+    return table
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import logging
+import threading
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+from candle_aggregator import RATES_DTYPE
+from ring_buffer import RingBuffer
+from tick_buckets import TICK_DTYPE
+
+DEFAULT_RING_SIZE = 10000
+
+# Default number of records returned when neither n nor since is given
+DEFAULT_LIMIT = 100
+
+
+class RingStore:
+    """
+    The in-memory rings of a live fetcher: one per symbol for ticks and one
+    per (symbol, timeframe) for closed candles, created on first write.
+    """
+
+    def __init__(self, ring_size=DEFAULT_RING_SIZE):
+        self.ring_size = ring_size
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def _ring(self, key, dtype):
+        ring = self._rings.get(key)
+        if ring is None:
+            with self._lock:
+                ring = self._rings.setdefault(key, RingBuffer(self.ring_size, dtype))
+        return ring
+
+    def get(self, key):
+        return self._rings.get(key)
+
+    def keys(self):
+        return list(self._rings)
+
+    def add_ticks(self, symbol, ticks):
+        """Append new ticks; has the on_ticks(symbol, new_ticks) signature of tick_fetcher"""
+        self._ring(('ticks', symbol), TICK_DTYPE).extend(ticks)
+
+    def add_candles(self, symbol, timeframe, bars):
+        """Append closed bars, skipping any the ring already ends with"""
+        ring = self._ring(('candles', symbol, timeframe), RATES_DTYPE)
+        if len(ring):
+            bars = bars[bars['time'] > ring.latest(1)['time'][0]]
+        ring.extend(bars)
+
+
+def _columns(records):
+    return {name: records[name].tolist() for name in records.dtype.names}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    GET /                         rings and their sizes
+    GET /ticks/SYMBOL             ticks, since= compares time_msc
+    GET /candles/SYMBOL/TF        closed candles, since= compares time
+    Slices take n= (newest n) or since=, and format=json (columns) or npy.
+    """
+
+    store = None
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        parts = tuple(p for p in url.path.split('/') if p)
+        if not parts:
+            rings = [{"key": list(key), "count": len(self.store.get(key))} for key in self.store.keys()]
+            self._send(json.dumps({"rings": rings}).encode('utf-8'), 'application/json')
+            return
+        ring = self.store.get(parts) if parts[0] in ('ticks', 'candles') else None
+        if ring is None:
+            self.send_error(404)
+            return
+        field = 'time_msc' if parts[0] == 'ticks' else 'time'
+        try:
+            n = int(params['n']) if 'n' in params else None
+            since = int(params['since']) if 'since' in params else None
+        except ValueError:
+            self.send_error(400, 'n and since must be integers')
+            return
+        fmt = params.get('format', 'json')
+        if fmt not in ('json', 'npy'):
+            self.send_error(400, 'format must be json or npy')
+            return
+        # the slices are views into the ring, serialize them before the next write
+        with ring.lock:
+            if since is not None:
+                records = ring.since(since, field)
+                if n is not None:
+                    records = records[:n]
+            else:
+                records = ring.latest(DEFAULT_LIMIT if n is None else n)
+            if fmt == 'npy':
+                out = io.BytesIO()
+                np.lib.format.write_array(out, records, allow_pickle=False)
+                body = out.getvalue()
+            else:
+                body = json.dumps({"key": list(parts), "count": len(records),
+                                   "columns": _columns(records)}).encode('utf-8')
+        self._send(body, 'application/octet-stream' if fmt == 'npy' else 'application/json')
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(store, port, host='127.0.0.1'):
+    """Serve the rings of store from a daemon thread"""
+    handler = type('Handler', (_Handler,), {'store': store})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='query', daemon=True).start()
+    logging.info(f"Serving ring buffers ({store.ring_size} records each) on http://{host}:{server.server_address[1]}/")
+    return server
+
+
+def query(path, port, host='127.0.0.1', **params):
+    """
+    Read a slice from a running fetcher as a numpy structured array,
+    e.g. query('/ticks/EURUSD', 8001, n=500) or
+    query('/candles/EURUSD/M1', 8001, since=1717000000).
+    """
+    params['format'] = 'npy'
+    url = f"http://{host}:{port}{path}?{urllib.parse.urlencode(params)}"
+    with urllib.request.urlopen(url) as response:
+        return np.load(io.BytesIO(response.read()), allow_pickle=False)
+
+
+def add_arguments(parser):
+    """Add the ring buffer query options shared by the live fetchers"""
+    parser.add_argument('--query_port', type=int, default=None,
+                        help='Keep the latest ticks/candles in memory and serve them on this port '
+                             '(default: disabled)')
+    parser.add_argument('--query_host', default='127.0.0.1',
+                        help='Address the query endpoint binds to (default: 127.0.0.1)')
+    parser.add_argument('--ring_size', type=int, default=DEFAULT_RING_SIZE,
+                        help=f'Records kept per symbol and timeframe with --query_port (default: {DEFAULT_RING_SIZE})')
+
+
+def from_args(args):
+    """Start the query endpoint when --query_port is set; returns the RingStore or None"""
+    if args.query_port is None:
+        return None
+    store = RingStore(args.ring_size)
+    start(store, args.query_port, args.query_host)
+    return store
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter that can be shared between processes.
+
+    The state lives in shared memory, so one bucket passed to several
+    multiprocessing workers paces their combined request rate. capacity
+    is the largest burst allowed after an idle period.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._lock = multiprocessing.Lock()
+        self._tokens = multiprocessing.RawValue('d', self.capacity)
+        self._updated = multiprocessing.RawValue('d', time.monotonic())
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available and take them"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = max(0.0, now - self._updated.value)
+                self._tokens.value = min(self.capacity, self._tokens.value + elapsed * self.rate)
+                self._updated.value = now
+                if self._tokens.value >= tokens:
+                    self._tokens.value -= tokens
+                    return
+                wait = (tokens - self._tokens.value) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import threading
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-size ring of structured records, oldest overwritten first.
+
+    Every record is written twice, at i and i + capacity, so the newest n
+    records are always one contiguous slice of the backing array and
+    latest()/since() return views without copying. A view stays valid
+    only until the next extend(); readers in other threads should hold
+    lock while they use it.
+    """
+
+    def __init__(self, capacity, dtype):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.lock = threading.Lock()
+        self._data = np.zeros(2 * capacity, dtype=self.dtype)
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def extend(self, records):
+        """Append records (sorted by time, oldest first)"""
+        n = len(records)
+        if n == 0:
+            return
+        if n > self.capacity:
+            records = records[-self.capacity:]
+            n = self.capacity
+        if records.dtype != self.dtype:
+            records = records.astype(self.dtype)
+        with self.lock:
+            positions = (self._head + np.arange(n)) % self.capacity
+            self._data[positions] = records
+            self._data[positions + self.capacity] = records
+            self._head = (self._head + n) % self.capacity
+            self._count = min(self._count + n, self.capacity)
+
+    def latest(self, n=None):
+        """View of the newest n records (all when n is None), oldest first"""
+        count = self._count if n is None else max(0, min(n, self._count))
+        end = self._head + self.capacity
+        return self._data[end - count:end]
+
+    def since(self, value, field='time'):
+        """View of the records with field > value"""
+        records = self.latest()
+        return records[np.searchsorted(records[field], value, side='right'):]
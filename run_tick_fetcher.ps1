@@ -12,9 +12,11 @@ param (
     [Parameter(Mandatory=$true)]
     [string]$Server,
     
-    [Parameter(Mandatory=$true)]
     [string]$Symbol,
     
+    # Comma-separated symbols polled from one MT5 session (e.g. "EURUSD,XAUUSD"); overrides -Symbol
+    [string]$Symbols,
+    
     [string]$MongoURI = "mongodb://localhost:27017/",
     
     [int]$FetchInterval = 1,
@@ -22,8 +24,18 @@ param (
     [int]$HistoryBatch = 500
 )
 
+if (-not $Symbol -and -not $Symbols) {
+    Write-Host "Either -Symbol or -Symbols is required."
+    exit 1
+}
+if ($Symbols) {
+    $symbolArg = "--symbols=`"$Symbols`""
+} else {
+    $symbolArg = "--symbol=`"$Symbol`""
+}
+
 # Construct the command
-$pythonCommand = "python tick_fetcher.py --mt5_path=`"$MT5Path`" --account=$Account --password=`"$Password`" --server=`"$Server`" --symbol=`"$Symbol`" --mongo_uri=`"$MongoURI`" --fetch_interval=$FetchInterval --history_batch=$HistoryBatch"
+$pythonCommand = "python tick_fetcher.py --mt5_path=`"$MT5Path`" --account=$Account --password=`"$Password`" --server=`"$Server`" $symbolArg --mongo_uri=`"$MongoURI`" --fetch_interval=$FetchInterval --history_batch=$HistoryBatch"
 
 # Log the command (with password masked)
 $logCommand = $pythonCommand -replace "--password=`"[^`"]+`"", "--password=`"********`""
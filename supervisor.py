@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+
+import time
+# taken before the imports below so the startup time can be reported
+STARTED = time.monotonic()
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import json
+import logging
+import os
+import sys
+import pytz
+import MetaTrader5 as mt5
+from pymongo import MongoClient
+
+import backfill_checkpoints
+import candle_fetcher
+from candle_aggregator import TIMEFRAME_SECONDS, candle_collection
+import fetch_planner
+import market_hours
+import metrics
+from mongo_bulk import DEFAULT_BATCH_SIZE, insert_unordered
+from mt5_convert import candle_documents
+import tick_buckets
+import tick_dedupe
+import tick_fetcher
+import tick_journal
+import write_behind
+
+JOB_TYPES = ('ticks', 'candles', 'backfill')
+
+# Restart delay bounds (seconds) for a failing job
+MIN_RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 300.0
+
+# A job that ran this long before failing is restarted without backoff
+STABLE_SECONDS = 600.0
+
+DEFAULT_HEALTH_INTERVAL = 60.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run live tick, live candle and scheduled backfill jobs from one '
+                                                 'process sharing a single MT5 session and MongoDB client')
+    parser.add_argument('--config', required=True,
+                        help='JSON job file: {"mt5": {"path", "account", "password", "server"}, '
+                             '"mongo_uri": ..., "jobs": [...]} (see README)')
+    parser.add_argument('--mongo_uri', default=None,
+                        help='MongoDB URI, overrides the one in the job file '
+                             '(default: the job file\'s, else mongodb://localhost:27017/)')
+    parser.add_argument('--health_interval', type=float, default=DEFAULT_HEALTH_INTERVAL,
+                        help=f'Seconds between job health log lines (default: {DEFAULT_HEALTH_INTERVAL:g})')
+    write_behind.add_arguments(parser)
+    market_hours.add_arguments(parser)
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
+
+def _job_name(spec):
+    parts = [spec['type']] + spec.get('symbols', [spec.get('symbol')])
+    if spec.get('timeframe'):
+        parts.append(spec['timeframe'])
+    return '-'.join(str(p) for p in parts)
+
+
+def load_config(path):
+    """Read and check the job file; raises ValueError on a bad job"""
+    with open(path) as f:
+        config = json.load(f)
+    jobs = config.get('jobs') or []
+    if not jobs:
+        raise ValueError(f"{path} defines no jobs")
+    names = set()
+    for spec in jobs:
+        kind = spec.get('type')
+        if kind not in JOB_TYPES:
+            raise ValueError(f"job type must be one of {', '.join(JOB_TYPES)}, got {kind!r}")
+        if kind == 'ticks':
+            if isinstance(spec.get('symbols'), str):
+                spec['symbols'] = [s.strip() for s in spec['symbols'].split(',') if s.strip()]
+            elif 'symbols' not in spec and spec.get('symbol'):
+                spec['symbols'] = [spec['symbol']]
+            if not spec.get('symbols'):
+                raise ValueError("ticks jobs need symbols")
+            if spec.get('storage', 'documents') not in tick_buckets.STORAGE_MODES:
+                raise ValueError(f"storage must be one of {', '.join(tick_buckets.STORAGE_MODES)}")
+            if spec.get('dedupe', 'index') not in tick_dedupe.DEDUPE_MODES:
+                raise ValueError(f"dedupe must be one of {', '.join(tick_dedupe.DEDUPE_MODES)}")
+        else:
+            if not spec.get('symbol'):
+                raise ValueError(f"{kind} jobs need a symbol")
+            if spec.get('timeframe') not in candle_fetcher.TIMEFRAME_MAP:
+                raise ValueError(f"{kind} jobs need a timeframe from {', '.join(candle_fetcher.TIMEFRAME_MAP)}")
+        spec.setdefault('name', _job_name(spec))
+        if spec['name'] in names:
+            raise ValueError(f"duplicate job name {spec['name']!r}")
+        names.add(spec['name'])
+    return config
+
+
+def init_params(terminal):
+    """mt5.initialize() keyword arguments for the "mt5" section of the job file"""
+    params = {}
+    if terminal.get('path'):
+        params['path'] = terminal['path']
+    if terminal.get('account'):
+        params['login'] = int(terminal['account'])
+    if terminal.get('password'):
+        params['password'] = terminal['password']
+    if terminal.get('server'):
+        params['server'] = terminal['server']
+    return params
+
+
+class MT5Access:
+    """
+    Runs every MetaTrader5 call of the process on one thread. The package
+    is bound to a single terminal per process and is not thread safe, so
+    jobs await their MT5 work here and take turns call by call.
+    """
+
+    def __init__(self):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='mt5')
+
+    async def call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    def run(self, fn, *args, **kwargs):
+        """Blocking call from outside the event loop"""
+        return self._executor.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self):
+        self.run(mt5.shutdown)
+        self._executor.shutdown()
+
+
+class JobHealth:
+    """What the supervisor knows about one job, for the health log and metrics"""
+
+    def __init__(self, name):
+        self.name = name
+        self.status = 'starting'
+        self.restarts = 0
+        self.failures = 0
+        self.items = 0
+        self.last_success = None
+        self.last_error = None
+
+    def ok(self, items=0):
+        self.items += items
+        self.failures = 0
+        self.last_success = time.time()
+
+    def describe(self):
+        parts = [f"{self.name}: {self.status}", f"{self.items} items"]
+        if self.last_success is not None:
+            parts.append(f"last ok {time.time() - self.last_success:.0f}s ago")
+        if self.restarts:
+            parts.append(f"{self.restarts} restarts")
+        if self.last_error:
+            parts.append(f"last error: {self.last_error}")
+        return ', '.join(parts)
+
+
+class Job:
+    """
+    One configured job. run() does the work until it is cancelled (or, for
+    one-off jobs, done) and raises on failure; state kept on the job, like
+    fetch cursors and collections, survives restarts.
+    """
+
+    def __init__(self, spec, supervisor):
+        self.spec = spec
+        self.name = spec['name']
+        self.supervisor = supervisor
+        self.mt5 = supervisor.mt5
+        self.health = JobHealth(self.name)
+
+    async def run(self):
+        raise NotImplementedError
+
+    def close(self, timeout=None):
+        """Release what the job keeps open across restarts, on shutdown"""
+
+    async def wait_for_market(self):
+        """Sleep through a weekend or holiday closure; returns whether it slept"""
+        schedule = self.supervisor.schedule
+        now = datetime.datetime.now(pytz.UTC)
+        if schedule.is_open(now):
+            return False
+        reopen = schedule.next_open(now)
+        logging.info(f"{self.name}: market closed, sleeping until {reopen.isoformat()}")
+        self.health.status = 'closed'
+        metrics.inc('mt5_closed_wakeups_total')
+        await asyncio.sleep(max(0.0, (reopen - datetime.datetime.now(pytz.UTC)).total_seconds()))
+        self.health.status = 'running'
+        return True
+
+
+class TickJob(Job):
+    """
+    Live ticks of one or more symbols, as tick_fetcher.py stores them.
+    Only the MT5 copy runs on the MT5 thread; dedupe, conversion and the
+    MongoDB write (or journal append) run on a worker thread.
+    """
+
+    def __init__(self, spec, supervisor):
+        super().__init__(spec, supervisor)
+        self.symbols = spec['symbols']
+        self.storage = spec.get('storage', 'documents')
+        self.write_batch_size = spec.get('write_batch_size', DEFAULT_BATCH_SIZE)
+        self.dedupe = None
+        if spec.get('dedupe') == 'window':
+            self.dedupe = tick_dedupe.TickDedupe(
+                int(spec.get('dedupe_window', tick_dedupe.DEFAULT_WINDOW_SECONDS) * 1000))
+        self.collections = None
+        self.journal = None
+        self.clock = tick_fetcher.ServerClock(spec.get('server_utc_offset'))
+        self.cursors = {}
+
+    async def setup(self):
+        if self.collections is not None:
+            return
+        for symbol in self.symbols:
+            if not await self.mt5.call(mt5.symbol_select, symbol, True):
+                logging.warning(f"{symbol}: symbol_select failed: {await self.mt5.call(mt5.last_error)}")
+        client = self.supervisor.client
+
+        def create():
+            collections = {symbol: tick_fetcher.tick_collection(client, self.supervisor.live_db, symbol, self.storage,
+                                                                self.spec.get('dedupe', 'index'))
+                           for symbol in self.symbols}
+            if self.spec.get('journal_dir'):
+                # dedupe runs on the journal writer thread, once per journaled batch
+                self.journal = tick_journal.open_writer(
+                    self.spec['journal_dir'], self.symbols,
+                    *tick_fetcher.journal_callbacks(collections, self.storage, self.write_batch_size, self.dedupe),
+                    self.spec.get('journal_segment_records', tick_journal.DEFAULT_SEGMENT_RECORDS))
+                logging.info(f"{self.name}: journaling ticks in {self.spec['journal_dir']}")
+            return collections
+
+        self.collections = await asyncio.to_thread(create)
+
+    async def run(self):
+        await self.setup()
+        interval = self.spec.get('fetch_interval', 1)
+        history_batch = self.spec.get('history_batch', 500)
+        dedupe = None if self.journal is not None else self.dedupe
+        while True:
+            if await self.wait_for_market():
+                self.clock.reset()
+            cycle_start = time.monotonic()
+            new_ticks = 0
+            # one MT5 call per symbol, so other jobs get their turn in between
+            for symbol in self.symbols:
+                ticks = await self.mt5.call(tick_fetcher.fetch_new_ticks, symbol, history_batch, self.cursors)
+                self.clock.polled(symbol, ticks)
+                if ticks is None:
+                    continue
+                new_ticks += await asyncio.to_thread(
+                    tick_fetcher.store_new_ticks, self.collections[symbol], symbol, ticks, self.write_batch_size,
+                    self.supervisor.buffer, self.storage, None, dedupe, self.journal, self.clock)
+            self.health.ok(new_ticks)
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - cycle_start)))
+
+    def close(self, timeout=None):
+        if self.journal is not None:
+            self.journal.close(timeout)
+
+
+class CandleJob(Job):
+    """
+    Live closed bars of one symbol and timeframe, as candle_fetcher.py
+    stores them; the MongoDB writes run off the MT5 thread.
+    """
+
+    def __init__(self, spec, supervisor):
+        super().__init__(spec, supervisor)
+        self.symbol = spec['symbol']
+        self.timeframe_str = spec['timeframe']
+        self.timeframe = candle_fetcher.TIMEFRAME_MAP[self.timeframe_str]
+        self.collection = None
+        self.live_collection = None
+        self.cursors = {}
+
+    async def setup(self):
+        if self.collection is not None:
+            return
+        db = self.supervisor.client[self.supervisor.live_db]
+        collection = await asyncio.to_thread(candle_collection, db, self.symbol, self.timeframe_str)
+        last_time = await asyncio.to_thread(candle_fetcher.last_stored_bar, collection, self.symbol, self.timeframe)
+        if last_time is not None:
+            self.cursors[self.symbol] = last_time
+            logging.info(f"{self.name}: last stored bar @ "
+                         f"{datetime.datetime.fromtimestamp(last_time, tz=pytz.UTC).isoformat()}")
+        if self.spec.get('live_bar'):
+            self.live_collection = db[f"{collection.name}_live"]
+        self.collection = collection
+
+    async def run(self):
+        await self.setup()
+        interval = self.spec.get('fetch_interval', 60)
+        candles_per_fetch = self.spec.get('candles_per_fetch', 1)
+        while True:
+            await self.wait_for_market()
+            bars = await self.mt5.call(candle_fetcher.fetch_new_bars, self.symbol, self.timeframe,
+                                       candles_per_fetch, self.cursors)
+            stored = 0
+            if bars is not None:
+                closed, forming = bars
+                stored = await asyncio.to_thread(
+                    candle_fetcher.store_bars, self.collection, self.symbol, self.timeframe, closed, forming,
+                    self.cursors, self.supervisor.buffer, self.live_collection)
+            self.health.ok(stored)
+            await asyncio.sleep(interval)
+
+
+class BackfillJob(Job):
+    """
+    Historical bars of one symbol and timeframe into mt5_historical_data,
+    fetched window by window like historical_data_fetcher.py. The range is
+    start_date..end_date, or the last `days` days up to the newest closed
+    bar; with every_hours the job runs again on that schedule and only
+    fetches what the backfill checkpoints do not cover yet.
+    """
+
+    def __init__(self, spec, supervisor):
+        super().__init__(spec, supervisor)
+        self.symbol = spec['symbol']
+        self.timeframe_str = spec['timeframe']
+        self.timeframe = candle_fetcher.TIMEFRAME_MAP[self.timeframe_str]
+        self.collection = None
+
+    def date_range(self):
+        if self.spec.get('start_date'):
+            start = pytz.UTC.localize(datetime.datetime.strptime(self.spec['start_date'], "%Y-%m-%d"))
+            end = datetime.datetime.now(pytz.UTC)
+            if self.spec.get('end_date'):
+                end = pytz.UTC.localize(datetime.datetime.strptime(self.spec['end_date'], "%Y-%m-%d")
+                                        + datetime.timedelta(days=1))
+            return start, min(end, datetime.datetime.now(pytz.UTC))
+        end = datetime.datetime.now(pytz.UTC)
+        return end - datetime.timedelta(days=self.spec.get('days', 7)), end
+
+    async def setup(self):
+        if self.collection is not None:
+            return
+        db = self.supervisor.client[self.supervisor.history_db]
+
+        def create():
+            col = db[f"candles_{self.symbol}_{self.timeframe_str}"]
+            col.create_index([("symbol", 1), ("time", 1)], unique=True)
+            backfill_checkpoints.ensure_indexes(db)
+            return col
+
+        self.collection = await asyncio.to_thread(create)
+
+    async def backfill(self):
+        """Fetch the parts of the range not covered yet; returns (bars, inserted, failed windows)"""
+        db = self.supervisor.client[self.supervisor.history_db]
+        seconds = TIMEFRAME_SECONDS[self.timeframe_str]
+        start, end = self.date_range()
+        # only bars that have closed
+        end_ts = int(end.timestamp())
+        end = datetime.datetime.fromtimestamp(end_ts - end_ts % seconds, tz=pytz.UTC)
+        covered = await asyncio.to_thread(backfill_checkpoints.load_coverage, db, self.symbol, self.timeframe_str)
+        missing = backfill_checkpoints.subtract_ranges(start, end, covered)
+        max_bars = await self.mt5.call(fetch_planner.terminal_max_bars)
+        page_bars = self.spec.get('page_bars', fetch_planner.DEFAULT_PAGE_BARS)
+        planner = fetch_planner.FetchPlanner(self.timeframe_str, page_bars, max_bars,
+                                             utc_offset=self.spec.get('server_utc_offset', 0))
+        pause = 1.0 / self.spec.get('requests_per_second', 10.0)
+        bars = inserted = failed = 0
+        for range_start, range_end in missing:
+            for window_start, window_end, _ in planner.windows(range_start, range_end):
+                rates = await self.mt5.call(fetch_planner.fetch_window, self.symbol, self.timeframe, planner,
+                                            window_start, window_end)
+                if rates is None:
+                    failed += 1
+                    continue
+                if len(rates):
+                    docs = candle_documents(rates, self.symbol, int(self.timeframe))
+                    n, _ = await asyncio.to_thread(insert_unordered, self.collection, docs, DEFAULT_BATCH_SIZE)
+                    inserted += n
+                    metrics.inc('mt5_writes_total', n, collection=self.collection.name)
+                await asyncio.to_thread(backfill_checkpoints.record_range, db, self.symbol, self.timeframe_str,
+                                        window_start, window_end, len(rates))
+                bars += len(rates)
+                self.health.ok(len(rates))
+                # pace the MT5 calls without holding the MT5 thread
+                await asyncio.sleep(pause)
+        return bars, inserted, failed
+
+    async def run(self):
+        await self.setup()
+        every = self.spec.get('every_hours')
+        while True:
+            self.health.status = 'running'
+            bars, inserted, failed = await self.backfill()
+            logging.info(f"{self.name}: fetched {bars} bars, inserted {inserted}")
+            if failed:
+                raise RuntimeError(f"{failed} windows failed")
+            if not every:
+                return
+            self.health.status = 'waiting'
+            await asyncio.sleep(every * 3600)
+
+
+JOB_CLASSES = {'ticks': TickJob, 'candles': CandleJob, 'backfill': BackfillJob}
+
+
+class Supervisor:
+    """
+    Runs the configured jobs as asyncio tasks over one MT5Access and one
+    MongoClient, restarting a job that raises after a backoff that doubles
+    per consecutive failure.
+    """
+
+    live_db = "mt5_data"
+    history_db = "mt5_historical_data"
+
+    def __init__(self, config, mt5_access, client, buffer=None, schedule=None):
+        self.mt5 = mt5_access
+        self.client = client
+        self.buffer = buffer
+        self.schedule = schedule or market_hours.SessionSchedule()
+        self.jobs = [JOB_CLASSES[spec['type']](spec, self) for spec in config['jobs']]
+
+    async def run_job(self, job):
+        health = job.health
+        delay = MIN_RESTART_DELAY
+        while True:
+            started = time.monotonic()
+            health.status = 'running'
+            metrics.set_gauge('mt5_job_up', 1, job=job.name)
+            try:
+                await job.run()
+                health.status = 'done'
+                metrics.set_gauge('mt5_job_up', 0, job=job.name)
+                logging.info(f"{job.name}: done")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                health.failures += 1
+                health.last_error = f"{type(e).__name__}: {e}"
+                if time.monotonic() - started >= STABLE_SECONDS:
+                    delay = MIN_RESTART_DELAY
+                logging.exception(f"{job.name}: failed ({health.failures} in a row), restarting in {delay:.0f}s")
+            health.status = 'backoff'
+            metrics.set_gauge('mt5_job_up', 0, job=job.name)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+            health.restarts += 1
+            metrics.inc('mt5_job_restarts_total', job=job.name)
+
+    async def report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            for job in self.jobs:
+                logging.info(f"Health {job.health.describe()}")
+
+    async def run(self, health_interval=DEFAULT_HEALTH_INTERVAL):
+        tasks = [asyncio.create_task(self.run_job(job), name=job.name) for job in self.jobs]
+        reporter = asyncio.create_task(self.report(health_interval), name='health')
+        try:
+            await asyncio.gather(*tasks)
+            logging.info("All jobs done")
+        finally:
+            reporter.cancel()
+            for task in tasks:
+                task.cancel()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    args = parse_args()
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        logging.critical(f"Invalid job file {args.config}: {e}")
+        sys.exit(1)
+
+    terminal = init_params(config.get('mt5', {}))
+    if terminal.get('path') and not os.path.exists(os.path.normpath(terminal['path'])):
+        logging.critical(f"MT5 executable not found at: {terminal['path']}")
+        sys.exit(1)
+
+    # the one MT5 session of the process, opened on the thread that makes every MT5 call
+    mt5_access = MT5Access()
+    if not mt5_access.run(mt5.initialize, **terminal):
+        logging.critical(f"MT5 initialize() failed: {mt5_access.run(mt5.last_error)}")
+        mt5_access.shutdown()
+        sys.exit(1)
+    logging.info(f"MT5 Package Version: {mt5.__version__}")
+    logging.info(f"Terminal Info: {mt5_access.run(mt5.terminal_info)}")
+    logging.info(f"MT5 Version: {mt5_access.run(mt5.version)}")
+
+    mongo_uri = args.mongo_uri or config.get('mongo_uri') or "mongodb://localhost:27017/"
+    client = MongoClient(mongo_uri)
+    logging.info(f"Connected to MongoDB: {mongo_uri}")
+
+    buffer = write_behind.from_args(args, client=client)
+    metrics.from_args(args)
+    if buffer is not None:
+        metrics.gauge_callback('mt5_queue_depth', buffer.__len__)
+    supervisor = Supervisor(config, mt5_access, client, buffer, market_hours.from_args(args))
+    startup = time.monotonic() - STARTED
+    metrics.set_gauge('mt5_startup_seconds', startup)
+    logging.info(f"Started supervisor with {len(supervisor.jobs)} jobs "
+                 f"({', '.join(job.name for job in supervisor.jobs)}) in {startup:.2f}s")
+
+    try:
+        asyncio.run(supervisor.run(args.health_interval))
+    except KeyboardInterrupt:
+        logging.info("Shutting down (KeyboardInterrupt)")
+    finally:
+        for job in supervisor.jobs:
+            logging.info(f"Health {job.health.describe()}")
+        mt5_access.shutdown()
+        for job in supervisor.jobs:
+            job.close(args.flush_timeout)
+        if buffer is not None:
+            buffer.close(args.flush_timeout)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
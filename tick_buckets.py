@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import datetime
+import numpy as np
+import pytz
+from pymongo import UpdateOne
+
+from mt5_convert import to_documents
+
+# Tick storage layouts
+STORAGE_MODES = ['documents', 'buckets', 'timeseries']
+
+# Columns kept per tick in buckets and time-series documents
+TICK_FIELDS = ['time_msc', 'bid', 'ask', 'last', 'volume', 'flags', 'volume_real']
+
+# Same layout as the arrays returned by mt5.copy_ticks_range
+TICK_DTYPE = np.dtype([
+    ('time', '<i8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('volume', '<u8'),
+    ('time_msc', '<i8'), ('flags', '<u4'), ('volume_real', '<f8')
+])
+
+BUCKET_SECONDS = 60
+
+
+def collection_name(symbol, storage):
+    """Collection holding the ticks of symbol in the given storage mode"""
+    if storage == 'buckets':
+        return f"ticks_{symbol}_buckets"
+    if storage == 'timeseries':
+        return f"ticks_{symbol}_ts"
+    return f"ticks_{symbol}"
+
+
+def bucket_collection(db, symbol):
+    """
+    Per-minute bucket collection. A bucket's _id is its start in seconds
+    since epoch, so the mandatory _id index is the only index needed.
+    """
+    return db[collection_name(symbol, 'buckets')]
+
+
+def timeseries_collection(db, symbol):
+    """MongoDB time-series collection with the symbol as metadata"""
+    name = collection_name(symbol, 'timeseries')
+    if name not in db.list_collection_names(filter={"name": name}):
+        db.create_collection(name, timeseries={
+            "timeField": "datetime",
+            "metaField": "symbol",
+            "granularity": "seconds"
+        })
+    return db[name]
+
+
+def bucket_requests(ticks, symbol):
+    """
+    Upserts merging ticks (sorted by time_msc) into their minute buckets.
+
+    Each bucket stores one array per TICK_FIELDS column plus the tick count
+    and the first/last time_msc it holds. The update is a pipeline that
+    adds the incoming ticks the bucket does not hold yet, compared on all
+    TICK_FIELDS, and keeps the arrays sorted by time_msc. Resending a write
+    (write-behind retries, spill and journal replay, re-fetched history)
+    leaves the bucket unchanged, while later ticks in the millisecond of
+    the last stored tick and backfilled ticks inside the stored range are
+    merged in.
+    """
+    if len(ticks) == 0:
+        return []
+    if np.any(np.diff(ticks['time_msc']) < 0):
+        ticks = np.sort(ticks, order='time_msc', kind='stable')
+    buckets = ticks['time_msc'] // (BUCKET_SECONDS * 1000)
+    _, starts = np.unique(buckets, return_index=True)
+    requests = []
+    for group in np.split(ticks, starts[1:]):
+        start = int(group['time_msc'][0] // (BUCKET_SECONDS * 1000)) * BUCKET_SECONDS
+        requests.append(UpdateOne({"_id": start}, _merge_pipeline(group, symbol, start), upsert=True))
+    return requests
+
+
+def _merge_pipeline(group, symbol, start):
+    # rows are {"t": tick, "n": 0 stored / 1 incoming, "s": position}, so the
+    # sort keeps stored ticks first and arrival order within a millisecond
+    columns = [group[field].tolist() for field in TICK_FIELDS]
+    incoming = [{"t": dict(zip(TICK_FIELDS, row)), "n": 1, "s": i} for i, row in enumerate(zip(*columns))]
+    last = int(group['time_msc'][-1])
+    # a new bucket takes every tick as outside its (empty) stored range
+    stored_first = {"$ifNull": ["$first_msc", last + 1]}
+    stored_last = {"$ifNull": ["$last_msc", last]}
+    return [
+        {"$set": {
+            "_in": {"$literal": incoming},
+            "_stored": {"$map": {
+                "input": {"$range": [0, {"$size": {"$ifNull": ["$time_msc", []]}}]},
+                "as": "i",
+                "in": {"t": {field: {"$arrayElemAt": [f"${field}", "$$i"]} for field in TICK_FIELDS},
+                       "n": 0, "s": "$$i"}
+            }}
+        }},
+        {"$set": {"_new": {"$filter": {"input": "$_in", "cond": {"$or": [
+            {"$lt": ["$$this.t.time_msc", stored_first]},
+            {"$gt": ["$$this.t.time_msc", stored_last]},
+            {"$not": [{"$in": ["$$this.t", "$_stored.t"]}]}
+        ]}}}}},
+        {"$set": {"_all": {"$cond": [
+            {"$eq": [{"$size": "$_new"}, 0]},
+            "$_stored",
+            {"$sortArray": {"input": {"$concatArrays": ["$_stored", "$_new"]},
+                            "sortBy": {"t.time_msc": 1, "n": 1, "s": 1}}}
+        ]}}},
+        {"$set": dict({field: {"$map": {"input": "$_all", "in": f"$$this.t.{field}"}} for field in TICK_FIELDS}, **{
+            "symbol": {"$ifNull": ["$symbol", symbol]},
+            "start": {"$ifNull": ["$start", {"$literal": datetime.datetime.fromtimestamp(start, tz=pytz.UTC)}]},
+            "count": {"$size": "$_all"},
+            "first_msc": {"$first": "$_all.t.time_msc"},
+            "last_msc": {"$last": "$_all.t.time_msc"}
+        })},
+        {"$unset": ["_in", "_stored", "_new", "_all"]}
+    ]
+
+
+def timeseries_documents(ticks, symbol):
+    """Slim per-tick documents for a time-series collection"""
+    return to_documents(ticks[TICK_FIELDS], {
+        "symbol": symbol,
+        "datetime": ticks['time_msc'].astype('datetime64[ms]').astype(object)
+    })
+
+
+def expand_buckets(buckets):
+    """Expand bucket documents back to one structured array of ticks"""
+    buckets = list(buckets)
+    total = sum(b['count'] for b in buckets)
+    ticks = np.zeros(total, dtype=TICK_DTYPE)
+    pos = 0
+    for b in buckets:
+        n = b['count']
+        for field in TICK_FIELDS:
+            ticks[field][pos:pos + n] = b[field]
+        pos += n
+    ticks['time'] = ticks['time_msc'] // 1000
+    return ticks
+
+
+def read_bucketed_ticks(collection, start, end):
+    """Ticks with start <= time < end (aware datetimes) from a bucket collection"""
+    start_msc = int(start.timestamp() * 1000)
+    end_msc = int(end.timestamp() * 1000)
+    first_bucket = start_msc // (BUCKET_SECONDS * 1000) * BUCKET_SECONDS
+    cursor = collection.find(
+        {"_id": {"$gte": first_bucket, "$lt": end_msc // 1000 + 1}},
+        {"symbol": 0, "start": 0}
+    ).sort("_id", 1)
+    ticks = expand_buckets(cursor)
+    mask = (ticks['time_msc'] >= start_msc) & (ticks['time_msc'] < end_msc)
+    return ticks[mask]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+import numpy as np
+
+import metrics
+
+DEDUPE_MODES = ['index', 'window']
+
+# Tick fields that, with time_msc, tell two ticks apart
+HASH_FIELDS = ['bid', 'ask', 'last', 'volume', 'flags', 'volume_real']
+
+# Low bits of a compact _id taken from the tick hash; time_msc fills the
+# remaining 42 bits, which lasts until 2109
+HASH_BITS = 21
+
+DEFAULT_WINDOW_SECONDS = 60
+
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+
+
+def tick_hashes(ticks):
+    """64-bit hash of each tick's prices, volumes and flags"""
+    h = np.full(len(ticks), _FNV_OFFSET, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for field in HASH_FIELDS:
+            values = ticks[field]
+            if values.dtype.kind == 'f':
+                values = values.astype('<f8').view(np.uint64)
+            h = (h ^ values.astype(np.uint64)) * _FNV_PRIME
+        # finalizer so the top bits depend on every field
+        h ^= h >> np.uint64(33)
+        h *= np.uint64(0xff51afd7ed558ccd)
+        h ^= h >> np.uint64(33)
+    return h
+
+
+def compact_ids(time_msc, hashes):
+    """int64 _id values: time_msc in the high bits, the top HASH_BITS of the hash below"""
+    return (time_msc.astype(np.int64) << HASH_BITS) | (hashes >> np.uint64(64 - HASH_BITS)).astype(np.int64)
+
+
+def fallback_id(time_msc, full_hash):
+    """_id for a tick whose compact _id is taken by a different tick"""
+    return f"{int(time_msc)}:{int(full_hash):016x}"
+
+
+class TickDedupe:
+    """
+    In-process duplicate filter over the recent ticks of each symbol.
+
+    A tick is identified by its time_msc and a 64-bit hash of its other
+    fields. Ticks already seen within window_ms of the newest tick are
+    dropped before they reach MongoDB, and the rest get a deterministic
+    _id: compact_ids() for almost all of them, or a fallback_id() string
+    when two different ticks share a compact _id. The _id index still
+    rejects duplicates older than the window, e.g. after a restart.
+    """
+
+    def __init__(self, window_ms=DEFAULT_WINDOW_SECONDS * 1000):
+        self.window_ms = window_ms
+        # per symbol: compact _id -> full hash of the tick that owns it,
+        # (compact _id, full hash) pairs given a fallback _id,
+        # and (time_msc, compact _id) in arrival order for expiry
+        self._owners = collections.defaultdict(dict)
+        self._fallbacks = collections.defaultdict(set)
+        self._order = collections.defaultdict(collections.deque)
+
+    def filter(self, symbol, ticks):
+        """Return (new_ticks, ids) with the ticks not seen yet and their _id values"""
+        if len(ticks) == 0:
+            return ticks, []
+        msc = ticks['time_msc']
+        hashes = tick_hashes(ticks)
+        compact = compact_ids(msc, hashes)
+        owners = self._owners[symbol]
+        fallbacks = self._fallbacks[symbol]
+        order = self._order[symbol]
+        keep = np.zeros(len(ticks), dtype=bool)
+        ids = []
+        for i, (tick_id, full_hash, t) in enumerate(zip(compact.tolist(), hashes.tolist(), msc.tolist())):
+            owner = owners.get(tick_id)
+            if owner is None:
+                owners[tick_id] = full_hash
+                order.append((t, tick_id))
+                ids.append(tick_id)
+            elif owner == full_hash or (tick_id, full_hash) in fallbacks:
+                continue
+            else:
+                fallbacks.add((tick_id, full_hash))
+                ids.append(fallback_id(t, full_hash))
+                logging.debug(f"{symbol}: compact _id collision at time_msc={t}")
+            keep[i] = True
+        self._expire(symbol, int(msc.max()))
+        duplicates = len(ticks) - len(ids)
+        if duplicates:
+            logging.info(f"{symbol}: Dropped {duplicates} duplicate ticks")
+            metrics.inc('mt5_window_duplicates_total', duplicates, symbol=symbol)
+        return ticks[keep], ids
+
+    def _expire(self, symbol, newest_msc):
+        owners = self._owners[symbol]
+        fallbacks = self._fallbacks[symbol]
+        order = self._order[symbol]
+        cutoff = newest_msc - self.window_ms
+        while order and order[0][0] < cutoff:
+            _, tick_id = order.popleft()
+            owners.pop(tick_id, None)
+        if fallbacks:
+            cutoff_id = cutoff << HASH_BITS
+            fallbacks.difference_update([key for key in fallbacks if key[0] < cutoff_id])
+
+
+def add_arguments(parser):
+    """Add the tick deduplication options"""
+    parser.add_argument('--dedupe', choices=DEDUPE_MODES, default='index',
+                        help="How duplicate ticks are rejected: 'index' relies on the unique "
+                             "(symbol, time, bid, ask) index, 'window' filters recent ticks in memory "
+                             "and stores them with a compact deterministic _id instead (default: index)")
+    parser.add_argument('--dedupe_window', type=float, default=DEFAULT_WINDOW_SECONDS,
+                        help=f'Seconds of recent ticks remembered with --dedupe window '
+                             f'(default: {DEFAULT_WINDOW_SECONDS})')
+
+
+def from_args(args):
+    """Return a TickDedupe for --dedupe window, otherwise None"""
+    if args.dedupe != 'window':
+        return None
+    return TickDedupe(int(args.dedupe_window * 1000))
@@ -2,44 +2,132 @@
 #!/usr/bin/env python3
 
 import time
+# taken before the imports below so the startup time can be reported
+STARTED = time.monotonic()
 import datetime
 import pytz
 import MetaTrader5 as mt5
-import pandas_market_calendars as mcal
-from pymongo import MongoClient, errors
+import numpy as np
+from pymongo import MongoClient
 import logging
 import argparse
 import os
 import sys
 
+from candle_aggregator import CANDLE_KEY, CandleAggregator, candle_collection, reconcile_with_mt5
+from mongo_bulk import DEFAULT_BATCH_SIZE, insert_unordered, upsert_requests, write_unordered
+from mt5_convert import candle_documents, tick_documents
+import features
+import market_hours
+import metrics
+import query_server
+import tick_buckets
+import tick_dedupe
+import tick_journal
+import write_behind
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Fetch and store ticks from MT5')
     parser.add_argument('--mt5_path', required=True, help='Path to MT5 executable')
     parser.add_argument('--account', required=True, type=int, help='MT5 account number')
     parser.add_argument('--password', required=True, help='MT5 password')
     parser.add_argument('--server', required=True, help='MT5 server')
-    parser.add_argument('--symbol', required=True, help='Symbol to fetch (e.g. EURUSD)')
+    symbols = parser.add_mutually_exclusive_group(required=True)
+    symbols.add_argument('--symbol', help='Symbol to fetch (e.g. EURUSD)')
+    symbols.add_argument('--symbols', help='Comma-separated symbols polled from one MT5 session (e.g. EURUSD,XAUUSD)')
     parser.add_argument('--mongo_uri', default="mongodb://localhost:27017/", 
                         help='MongoDB URI (default: mongodb://localhost:27017/)')
-    parser.add_argument('--fetch_interval', type=int, default=1,
+    parser.add_argument('--fetch_interval', type=float, default=1,
                         help='Seconds between fetches (default: 1)')
+    parser.add_argument('--adaptive_interval', action='store_true',
+                        help='Adapt the poll interval to the tick arrival rate')
+    parser.add_argument('--min_interval', type=float, default=0.1,
+                        help='Shortest poll interval in seconds with --adaptive_interval (default: 0.1)')
+    parser.add_argument('--max_interval', type=float, default=5.0,
+                        help='Longest poll interval in seconds with --adaptive_interval (default: 5)')
     parser.add_argument('--history_batch', type=int, default=500,
                         help='Number of ticks per batch when fetching history (default: 500)')
-    return parser.parse_args()
+    parser.add_argument('--write_batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Maximum ticks per MongoDB bulk write (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--storage', choices=tick_buckets.STORAGE_MODES, default='documents',
+                        help='Tick storage layout: one document per tick, per-minute bucket documents, '
+                             'or a MongoDB time-series collection (default: documents)')
+    parser.add_argument('--aggregate_candles', default=None,
+                        help='Comma-separated timeframes (e.g. M1,M5,H1 or all) to build from the tick '
+                             'stream and store in candles_SYMBOL_TF')
+    parser.add_argument('--reconcile_candles', action='store_true',
+                        help="Compare every aggregated candle with MT5's own bar and log differences")
+    parser.add_argument('--feature_timeframes', default='M1',
+                        help='Comma-separated timeframes (or all) of the bars --features are kept for (default: M1)')
+    parser.add_argument('--server_utc_offset', type=float, default=None,
+                        help='Hours the broker\'s server time is ahead of UTC, subtracted from tick times for the '
+                             'tick lag metrics (default: read from fresh ticks while metrics are enabled)')
+    features.add_arguments(parser)
+    tick_dedupe.add_arguments(parser)
+    tick_journal.add_arguments(parser)
+    write_behind.add_arguments(parser)
+    market_hours.add_arguments(parser)
+    metrics.add_arguments(parser)
+    query_server.add_arguments(parser)
+    args = parser.parse_args()
+    if args.symbols:
+        args.symbols = [s.strip() for s in args.symbols.split(',') if s.strip()]
+    else:
+        args.symbols = [args.symbol]
+    if args.aggregate_candles:
+        if args.aggregate_candles == 'all':
+            args.aggregate_candles = list(TIMEFRAME_MAP)
+        else:
+            args.aggregate_candles = [tf.strip() for tf in args.aggregate_candles.split(',') if tf.strip()]
+            unknown = [tf for tf in args.aggregate_candles if tf not in TIMEFRAME_MAP]
+            if unknown:
+                parser.error(f"unknown timeframes for --aggregate_candles: {', '.join(unknown)}")
+    if args.feature_timeframes == 'all':
+        args.feature_timeframes = list(TIMEFRAME_MAP)
+    else:
+        args.feature_timeframes = [tf.strip() for tf in args.feature_timeframes.split(',') if tf.strip()]
+        unknown = [tf for tf in args.feature_timeframes if tf not in TIMEFRAME_MAP]
+        if unknown:
+            parser.error(f"unknown timeframes for --feature_timeframes: {', '.join(unknown)}")
+    return args
+
+# Timeframe mapping
+TIMEFRAME_MAP = {
+    'M1': mt5.TIMEFRAME_M1,
+    'M5': mt5.TIMEFRAME_M5,
+    'M15': mt5.TIMEFRAME_M15,
+    'M30': mt5.TIMEFRAME_M30,
+    'H1': mt5.TIMEFRAME_H1,
+    'H4': mt5.TIMEFRAME_H4,
+    'D1': mt5.TIMEFRAME_D1
+}
 
 # Timezones
 LOCAL_TZ = pytz.timezone('Asia/Nicosia')  # local timezone
 MARKET_TZ = pytz.timezone('US/Eastern')    # market timezone
 
-# Market calendar (NYSE)
-MARKET_CAL = mcal.get_calendar('NYSE')
+# Name MongoDB gives the unique (symbol, time, bid, ask) index of ticks_SYMBOL
+TICK_INDEX_NAME = "symbol_1_time_1_bid_1_ask_1"
 
-# track last inserted tick timestamp (seconds since epoch)
-LAST_TICK_TS = None
+# Largest server UTC offset (hours) believed when it is read from tick times
+MAX_UTC_OFFSET = 14
 
-def connect_mongo(mongo_uri, db_name, collection_name):
-    client = MongoClient(mongo_uri)
-    col = client[db_name][collection_name]
+# New ticks count as fresh enough to read the server UTC offset from when the
+# previous poll of their symbol was at most this many seconds earlier
+FRESH_TICK_SECONDS = 5
+
+def tick_collection(client, db_name, symbol, storage='documents', dedupe='index'):
+    if storage == 'buckets':
+        return tick_buckets.bucket_collection(client[db_name], symbol)
+    if storage == 'timeseries':
+        return tick_buckets.timeseries_collection(client[db_name], symbol)
+    col = client[db_name][f"ticks_{symbol}"]
+    if dedupe == 'window':
+        # ticks carry a deterministic _id, the mandatory _id index rejects duplicates
+        if TICK_INDEX_NAME in col.index_information():
+            logging.warning(f"{col.name} still has the unique index {TICK_INDEX_NAME}, which is not needed "
+                            f"with --dedupe window; drop it with db.{col.name}.dropIndex('{TICK_INDEX_NAME}')")
+        return col
     # unique index to prevent duplicate tick inserts
     col.create_index([
         ("symbol", 1),
@@ -47,85 +135,317 @@ def connect_mongo(mongo_uri, db_name, collection_name):
         ("bid", 1),
         ("ask", 1)
     ], unique=True)
-    return col, client
+    return col
 
 
-def is_market_open(now_local=None):
+def connect_mongo(mongo_uri, db_name, symbols, storage='documents', dedupe='index'):
+    """Connect once and return ({symbol: collection}, client)"""
+    client = MongoClient(mongo_uri)
+    collections = {symbol: tick_collection(client, db_name, symbol, storage, dedupe) for symbol in symbols}
+    return collections, client
+
+
+class AdaptivePollInterval:
     """
-    Check Forex market hours: opens Sunday 22:00 UTC, closes Friday 22:00 UTC.
+    Poll interval that follows the tick arrival rate.
+
+    Keeps an exponentially weighted tick rate and aims for target_ticks new
+    ticks per poll, clamped to [min_interval, max_interval]. Polls that
+    return nothing decay the rate, so the interval backs off geometrically
+    in quiet hours and snaps back once ticks arrive again.
     """
-    if now_local is None:
-        now_local = datetime.datetime.now(LOCAL_TZ)
-    # convert to UTC
-    dt_utc = now_local.astimezone(pytz.UTC)
-    wd = dt_utc.weekday()  # Mon=0 ... Sun=6
-    hhmm = dt_utc.hour + dt_utc.minute/60.0
 
-    # Saturday (5): closed all day
-    if wd == 5:
-        return False
-    # Sunday (6): open only at or after 22:00 UTC
-    if wd == 6:
-        return hhmm >= 22.0
-    # Friday (4): open until 22:00 UTC
-    if wd == 4:
-        return hhmm < 22.0
-    # Mon–Thu (0–3): open 24h
-    return True
+    def __init__(self, min_interval, max_interval, initial_interval, target_ticks=1.0, smoothing=0.3):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_ticks = target_ticks
+        self.smoothing = smoothing
+        self.interval = min(max_interval, max(min_interval, initial_interval))
+        self.rate = target_ticks / self.interval
+        self._last_poll = None
+
+    def update(self, new_ticks):
+        """Record the ticks returned by the last poll and return the next interval"""
+        now = time.monotonic()
+        if self._last_poll is not None:
+            observed = new_ticks / max(now - self._last_poll, 1e-3)
+            self.rate = self.smoothing * observed + (1 - self.smoothing) * self.rate
+        self._last_poll = now
+        interval = self.target_ticks / self.rate if self.rate > 0 else self.max_interval
+        self.interval = min(self.max_interval, max(self.min_interval, interval))
+        return self.interval
+
+
+class ServerClock:
+    """
+    Offset of the broker's server time from UTC in hours, for the tick lag
+    metrics.
+
+    Fixed when utc_offset is given. Otherwise it is read from new ticks
+    that arrived within FRESH_TICK_SECONDS of the previous poll of their
+    symbol, so they are at most that old, rounded to the hour. Only done
+    while metrics are enabled, from ticks the poll fetched anyway. reset()
+    forgets it over a market closure, which may span a DST switch; until
+    fresh ticks arrive again no lag is recorded.
+    """
+
+    def __init__(self, utc_offset=None):
+        self.fixed = utc_offset is not None
+        self.utc_offset = utc_offset
+        self._polls = {}
+
+    def reset(self):
+        self._polls.clear()
+        if not self.fixed:
+            self.utc_offset = None
 
+    def polled(self, symbol, new_ticks):
+        """Record a poll of symbol and the new ticks it returned (None when there were none)"""
+        if self.fixed or not metrics.enabled():
+            return
+        now = time.time()
+        previous = self._polls.get(symbol)
+        self._polls[symbol] = now
+        if new_ticks is None or previous is None or now - previous > FRESH_TICK_SECONDS:
+            return
+        hours = round((int(new_ticks['time_msc'].max()) / 1000 - now) / 3600)
+        if abs(hours) > MAX_UTC_OFFSET:
+            logging.warning(f"{symbol}: new ticks are {hours} hours off the local clock, "
+                            f"set --server_utc_offset")
+            return
+        if hours != self.utc_offset:
+            logging.info(f"Server UTC offset: {hours:+d} hours")
+            self.utc_offset = hours
 
-def fetch_and_store(collection, symbol, history_batch):
-    global LAST_TICK_TS
+    def lag(self, last_msc):
+        """Seconds from the tick at server time last_msc to now, or None while the offset is unknown"""
+        if self.utc_offset is None:
+            return None
+        return time.time() - (last_msc / 1000 - self.utc_offset * 3600)
+
+
+def new_ticks_since(ticks, cursor):
+    """
+    Split off the ticks newer than cursor and return (new_ticks, cursor).
+
+    cursor is (time_msc, seen): the millisecond of the last stored tick and
+    how many ticks of that millisecond were already stored. MT5 returns the
+    ticks of one millisecond in arrival order, so the first seen of them are
+    skipped and any later arrivals within that millisecond are kept.
+    """
+    last_msc, seen = cursor
+    msc = ticks['time_msc']
+    mask = msc > last_msc
+    mask[np.flatnonzero(msc == last_msc)[seen:]] = True
+    new_ticks = ticks[mask]
+    if len(new_ticks) == 0:
+        return new_ticks, cursor
+    top = int(msc.max())
+    return new_ticks, (top, int(np.count_nonzero(msc == top)))
+
+
+def tick_writes(new_ticks, symbol, storage='documents', ids=None):
+    """Documents or write requests storing new_ticks in the given storage layout"""
+    if storage == 'buckets':
+        return tick_buckets.bucket_requests(new_ticks, symbol)
+    if storage == 'timeseries':
+        return tick_buckets.timeseries_documents(new_ticks, symbol)
+    return tick_documents(new_ticks, symbol, LOCAL_TZ, ids)
+
+
+def fetch_and_store(collection, symbol, history_batch, cursors, write_batch_size=DEFAULT_BATCH_SIZE,
+                    buffer=None, storage='documents', on_ticks=None, dedupe=None, journal=None, clock=None):
+    """
+    Store the ticks of symbol that arrived since its cursor.
+
+    cursors maps symbol -> (time_msc, seen) of the last inserted tick (see
+    new_ticks_since) and is updated in place. storage selects the layout
+    (see tick_buckets.STORAGE_MODES). With a write-behind buffer the writes
+    are queued instead of sent here; with a tick_journal.JournalWriter the
+    raw ticks are journaled and stored from its thread. dedupe (a
+    tick_dedupe.TickDedupe) drops recently seen ticks and gives the rest a
+    deterministic _id.
+    on_ticks(symbol, new_ticks) is called with the structured array of new
+    ticks once they are handed off. clock (a ServerClock) turns tick times
+    into the lag metrics.
+    Returns the number of new ticks.
+    """
+    new_ticks = fetch_new_ticks(symbol, history_batch, cursors)
+    if clock is not None:
+        clock.polled(symbol, new_ticks)
+    if new_ticks is None:
+        return 0
+    return store_new_ticks(collection, symbol, new_ticks, write_batch_size, buffer, storage, on_ticks, dedupe,
+                           journal, clock)
+
+
+def fetch_new_ticks(symbol, history_batch, cursors):
+    """
+    The MT5 half of fetch_and_store: the ticks of symbol that arrived since
+    its cursor, or None when there are none (or on the first call, which
+    only sets the cursor). Makes no MongoDB calls.
+    """
     # retrieve latest tick info
-    tick_info = mt5.symbol_info_tick(symbol)
+    with metrics.stage('mt5_copy', symbol=symbol):
+        tick_info = mt5.symbol_info_tick(symbol)
     if tick_info is None:
-        logging.error(f"symbol_info_tick failed: {mt5.last_error()}")
-        return
+        logging.error(f"{symbol}: symbol_info_tick failed: {mt5.last_error()}")
+        return None
     now = tick_info.time
+    cursor = cursors.get(symbol)
 
-    # initial setup: get history around now to set LAST_TICK_TS
-    if LAST_TICK_TS is None:
+    # initial setup: get history around now to set the cursor
+    if cursor is None:
         history = mt5.copy_ticks_from(symbol, now, history_batch, mt5.COPY_TICKS_ALL)
         if history is None or len(history) == 0:
-            logging.warning("No history ticks retrieved on first run")
-            LAST_TICK_TS = now
+            logging.warning(f"{symbol}: No history ticks retrieved on first run")
+            cursors[symbol] = (tick_info.time_msc, 0)
         else:
-            LAST_TICK_TS = max(h['time'].item() for h in history)
-            logging.info(f"Initialized LAST_TICK_TS={LAST_TICK_TS}")
-        return
+            top = int(history['time_msc'].max())
+            cursors[symbol] = (top, int(np.count_nonzero(history['time_msc'] == top)))
+            logging.info(f"{symbol}: Initialized last tick time_msc={top}")
+        return None
 
-    # fetch all ticks since last timestamp
-    ticks = mt5.copy_ticks_range(symbol, LAST_TICK_TS, now, mt5.COPY_TICKS_ALL)
+    # fetch all ticks from the second of the cursor up to the end of the current second
+    with metrics.stage('mt5_copy', symbol=symbol):
+        ticks = mt5.copy_ticks_range(symbol, cursor[0] // 1000, now + 1, mt5.COPY_TICKS_ALL)
     if ticks is None:
-        logging.error(f"mt5.copy_ticks_range failed: {mt5.last_error()}")
-        return
+        logging.error(f"{symbol}: mt5.copy_ticks_range failed: {mt5.last_error()}")
+        return None
 
-    # filter out any duplicates
-    new_ticks = [t for t in ticks if t['time'].item() > LAST_TICK_TS]
-    if not new_ticks:
-        return
+    # filter out ticks already stored
+    with metrics.stage('convert', symbol=symbol):
+        new_ticks, cursors[symbol] = new_ticks_since(ticks, cursor)
+    return new_ticks if len(new_ticks) else None
+
+
+def store_new_ticks(collection, symbol, new_ticks, write_batch_size=DEFAULT_BATCH_SIZE, buffer=None,
+                    storage='documents', on_ticks=None, dedupe=None, journal=None, clock=None):
+    """
+    The MongoDB half of fetch_and_store: dedupe, convert and store (or
+    queue, or journal) new_ticks from fetch_new_ticks, then call on_ticks.
+    Makes no MT5 calls. Returns the number of new ticks.
+    """
+    last_msc = int(new_ticks['time_msc'].max())
+    with metrics.stage('convert', symbol=symbol):
+        ids = None
+        if dedupe is not None:
+            new_ticks, ids = dedupe.filter(symbol, new_ticks)
+        if len(new_ticks) == 0:
+            return 0
+
+        if journal is None:
+            writes = tick_writes(new_ticks, symbol, storage, ids)
+    metrics.inc('mt5_ticks_total', len(new_ticks), symbol=symbol)
+
+    with metrics.stage('mongo_write', symbol=symbol):
+        if journal is not None:
+            journal.append(symbol, new_ticks)
+            logging.info(f"{symbol}: Journaled {len(new_ticks)} ticks ({journal.pending(symbol)} pending); "
+                         f"last tick time_msc={last_msc}")
+        elif buffer is not None:
+            buffer.put(collection, writes)
+            logging.info(f"{symbol}: Queued {len(new_ticks)} ticks ({len(buffer)} pending); "
+                         f"last tick time_msc={last_msc}")
+        elif storage == 'buckets':
+            buckets, _ = write_unordered(collection, writes, write_batch_size)
+            metrics.inc('mt5_writes_total', len(new_ticks), collection=collection.name)
+            logging.info(f"{symbol}: Stored {len(new_ticks)} ticks in {buckets} buckets; "
+                         f"last tick time_msc={last_msc}")
+        else:
+            # one unordered bulk write per batch; duplicates are rejected by the unique index
+            inserted, duplicates = insert_unordered(collection, writes, write_batch_size)
+            metrics.inc('mt5_writes_total', inserted, collection=collection.name)
+            metrics.inc('mt5_duplicates_total', duplicates, collection=collection.name)
+            logging.info(f"{symbol}: Inserted {inserted}/{len(new_ticks)} ticks ({duplicates} duplicates); "
+                         f"last tick time_msc={last_msc}")
+    # MT5 tick times are server time, the clock knows its offset from UTC
+    lag = clock.lag(last_msc) if clock is not None and metrics.enabled() else None
+    if lag is not None:
+        metrics.observe('mt5_tick_lag_seconds', lag, symbol=symbol)
+        metrics.set_gauge('mt5_last_tick_lag_seconds', lag, symbol=symbol)
+
+    if on_ticks is not None:
+        on_ticks(symbol, new_ticks)
+    return len(new_ticks)
+
+
+def journal_callbacks(collections, storage='documents', write_batch_size=DEFAULT_BATCH_SIZE, dedupe=None):
+    """
+    Return the (prepare, write) pair a tick_journal.JournalWriter uses to
+    store journaled ticks. dedupe runs here instead of in fetch_and_store,
+    once per journaled batch.
+    """
+    def prepare(symbol, ticks):
+        ids = None
+        if dedupe is not None:
+            ticks, ids = dedupe.filter(symbol, ticks)
+        return collections[symbol], tick_writes(ticks, symbol, storage, ids)
 
-    inserted = 0
-    for t in new_ticks:
-        doc = {name: t[name].item() for name in ticks.dtype.names}
-        ts = doc['time']
-        dt_utc = datetime.datetime.fromtimestamp(ts, tz=pytz.UTC)
-        dt_local = dt_utc.astimezone(LOCAL_TZ)
-        doc.update({
-            "symbol": symbol,
-            "timestamp": ts,
-            "datetime_utc": dt_utc.isoformat(),
-            "datetime_local": dt_local.isoformat()
-        })
-        try:
-            collection.insert_one(doc)
-            inserted += 1
-        except errors.DuplicateKeyError:
-            continue
-
-    # update LAST_TICK_TS to highest timestamp seen
-    LAST_TICK_TS = max(t['time'].item() for t in new_ticks)
-    logging.info(f"Inserted {inserted}/{len(new_ticks)} ticks; updated LAST_TICK_TS={LAST_TICK_TS}")
+    def write(collection, writes):
+        if storage == 'buckets':
+            applied, duplicates = write_unordered(collection, writes, write_batch_size)
+        else:
+            applied, duplicates = insert_unordered(collection, writes, write_batch_size)
+        metrics.inc('mt5_writes_total', applied, collection=collection.name)
+        metrics.inc('mt5_duplicates_total', duplicates, collection=collection.name)
+        logging.info(f"Stored {applied}/{len(writes)} journaled writes in {collection.name} "
+                     f"({duplicates} duplicates)")
+
+    return prepare, write
+
+
+def candle_aggregation_hook(db, symbols, timeframes, write_batch_size=DEFAULT_BATCH_SIZE, buffer=None,
+                            reconcile=False, rings=None):
+    """
+    Return an on_ticks callback that builds candles for all timeframes from
+    the tick stream and upserts each bar into candles_SYMBOL_TF once it closes.
+    Closed bars are also appended to rings (a query_server.RingStore), when given.
+    """
+    aggregators = {}
+    collections = {}
+    for symbol in symbols:
+        info = mt5.symbol_info(symbol)
+        point = info.point if info is not None else 0.0
+        aggregators[symbol] = CandleAggregator(timeframes, point)
+        for tf in timeframes:
+            collections[(symbol, tf)] = candle_collection(db, symbol, tf)
+
+    def on_ticks(symbol, new_ticks):
+        aggregator = aggregators[symbol]
+        for tf, bars in aggregator.add_ticks(new_ticks).items():
+            docs = candle_documents(bars, symbol, int(TIMEFRAME_MAP[tf]), LOCAL_TZ)
+            requests = upsert_requests(docs, CANDLE_KEY)
+            col = collections[(symbol, tf)]
+            if rings is not None:
+                rings.add_candles(symbol, tf, bars)
+            metrics.inc('mt5_candles_total', len(bars), symbol=symbol, timeframe=tf)
+            if buffer is not None:
+                buffer.put(col, requests)
+            else:
+                stored, _ = write_unordered(col, requests, write_batch_size)
+                metrics.inc('mt5_writes_total', stored, collection=col.name)
+            logging.info(f"{symbol}: Closed {len(bars)} {tf} candles, last @ {docs[-1]['datetime_local']}")
+            if reconcile:
+                for t, field, ours, theirs in reconcile_with_mt5(symbol, TIMEFRAME_MAP[tf], bars,
+                                                                  aggregator.point):
+                    logging.warning(f"{symbol} {tf} candle @ {t}: {field} aggregated={ours} mt5={theirs}")
+
+    return on_ticks
+
+
+def combine_hooks(hooks):
+    """Single on_ticks callback calling each of hooks in turn, or None for none"""
+    if not hooks:
+        return None
+    if len(hooks) == 1:
+        return hooks[0]
+
+    def on_ticks(symbol, new_ticks):
+        for hook in hooks:
+            hook(symbol, new_ticks)
+
+    return on_ticks
 
 
 def main():
@@ -145,7 +465,6 @@ def main():
     
     # Database settings
     db_name = "mt5_data"
-    collection_name = f"ticks_{args.symbol}"
     
     # Initialize MT5 connection with login credentials
     if not mt5.initialize(
@@ -163,24 +482,89 @@ def main():
     logging.info(f"MT5 Version: {mt5.version()}")
     
     logging.info(f"Connected to MT5: account={args.account}, server={args.server}")
-    logging.info(f"Fetching ticks for {args.symbol}")
+    logging.info(f"Fetching ticks for {', '.join(args.symbols)}")
+
+    # make sure every symbol is in Market Watch so its ticks are available
+    for symbol in args.symbols:
+        if not mt5.symbol_select(symbol, True):
+            logging.warning(f"{symbol}: symbol_select failed: {mt5.last_error()}")
 
-    col, client = connect_mongo(args.mongo_uri, db_name, collection_name)
-    logging.info(f"Connected to MongoDB: {args.mongo_uri}, collection={collection_name}")
-    logging.info("Started tick fetcher")
+    collections, client = connect_mongo(args.mongo_uri, db_name, args.symbols, args.storage, args.dedupe)
+    logging.info(f"Connected to MongoDB: {args.mongo_uri}, collections="
+                 f"{', '.join(col.name for col in collections.values())}")
+
+    # per-symbol (time_msc, seen) of the last inserted tick
+    cursors = {}
+    dedupe = tick_dedupe.from_args(args)
+    buffer = write_behind.from_args(args, args.write_batch_size, client)
+    journal = tick_journal.from_args(args, *journal_callbacks(collections, args.storage, args.write_batch_size,
+                                                              dedupe))
+    if journal is not None:
+        logging.info(f"Journaling ticks in {args.journal_dir}")
+        dedupe = None
+    metrics.from_args(args)
+    if buffer is not None:
+        metrics.gauge_callback('mt5_queue_depth', buffer.__len__)
+    clock = ServerClock(args.server_utc_offset)
+    rings = query_server.from_args(args)
+    hooks = []
+    if rings is not None:
+        hooks.append(rings.add_ticks)
+    if args.aggregate_candles:
+        hooks.append(candle_aggregation_hook(client[db_name], args.symbols, args.aggregate_candles,
+                                             args.write_batch_size, buffer, args.reconcile_candles, rings))
+        logging.info(f"Aggregating {', '.join(args.aggregate_candles)} candles from ticks")
+    feature_store = features.from_args(args, client[db_name], args.symbols, args.feature_timeframes, TIMEFRAME_MAP,
+                                       buffer, args.write_batch_size)
+    if feature_store is not None:
+        hooks.append(feature_store.add_ticks)
+        logging.info(f"Maintaining {', '.join(args.feature_timeframes)} features from ticks")
+    on_ticks = combine_hooks(hooks)
+    poll_interval = None
+    if args.adaptive_interval:
+        poll_interval = AdaptivePollInterval(args.min_interval, args.max_interval, args.fetch_interval)
+    schedule = market_hours.from_args(args)
+    closed_wakeups = 0
+    startup = time.monotonic() - STARTED
+    metrics.set_gauge('mt5_startup_seconds', startup)
+    logging.info(f"Started tick fetcher in {startup:.2f}s")
 
     try:
         while True:
+            cycle_start = time.monotonic()
+            interval = args.fetch_interval
             now_local = datetime.datetime.now(LOCAL_TZ)
-            if is_market_open(now_local):
-                fetch_and_store(col, args.symbol, args.history_batch)
-            else:
-                logging.info(f"Market closed at {now_local.isoformat()}, skipping fetch")
-            time.sleep(args.fetch_interval)
+            if not schedule.is_open(now_local):
+                schedule.sleep_until_open(now_local, LOCAL_TZ)
+                clock.reset()
+                closed_wakeups += 1
+                metrics.inc('mt5_closed_wakeups_total')
+                continue
+            if closed_wakeups:
+                logging.info(f"Market open, resuming after {closed_wakeups} closed-market wakeups")
+                closed_wakeups = 0
+            new_ticks = 0
+            for symbol in args.symbols:
+                new_ticks += fetch_and_store(collections[symbol], symbol, args.history_batch, cursors,
+                                             args.write_batch_size, buffer, args.storage, on_ticks, dedupe,
+                                             journal, clock)
+            if poll_interval is not None:
+                interval = poll_interval.update(new_ticks)
+            # keep a fixed cycle period no matter how many symbols were polled
+            elapsed = time.monotonic() - cycle_start
+            metrics.observe('mt5_cycle_seconds', elapsed)
+            if elapsed > args.fetch_interval:
+                logging.warning(f"Poll cycle for {len(args.symbols)} symbols took {elapsed:.2f}s, "
+                                f"longer than fetch_interval={args.fetch_interval}s")
+            time.sleep(max(0.0, interval - elapsed))
     except KeyboardInterrupt:
         logging.info("Shutting down (KeyboardInterrupt)")
     finally:
         mt5.shutdown()
+        if journal is not None:
+            journal.close(args.flush_timeout)
+        if buffer is not None:
+            buffer.close(args.flush_timeout)
         client.close()
 
 
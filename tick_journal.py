@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+import mmap
+import struct
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from pymongo import errors
+
+import metrics
+from tick_buckets import TICK_DTYPE
+
+# magic, record size, records written, records committed
+HEADER = struct.Struct('<8sQQQ')
+HEADER_SIZE = 64
+MAGIC = b'MT5TJRN1'
+
+DEFAULT_SEGMENT_RECORDS = 1000000
+DEFAULT_REPLAY_BATCH = 50000
+
+# Seconds between flushes of the mapped pages to disk
+FLUSH_INTERVAL = 1.0
+
+# Retry delay bounds (seconds) while MongoDB is unreachable
+MIN_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30.0
+
+
+class Segment:
+    """
+    One fixed-size journal file, memory-mapped: a header followed by raw
+    tick records. The written count is updated after the records it
+    covers, so a crash never exposes a half-copied record.
+    """
+
+    def __init__(self, path, capacity=None):
+        self.path = Path(path)
+        if capacity is not None:
+            with open(self.path, 'wb') as f:
+                f.truncate(HEADER_SIZE + capacity * TICK_DTYPE.itemsize)
+                f.write(HEADER.pack(MAGIC, TICK_DTYPE.itemsize, 0, 0))
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, itemsize, _, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or itemsize != TICK_DTYPE.itemsize:
+            self._map.close()
+            self._file.close()
+            raise ValueError(f"{self.path} is not a tick journal segment")
+        self.capacity = (len(self._map) - HEADER_SIZE) // TICK_DTYPE.itemsize
+        self.records = np.frombuffer(self._map, dtype=TICK_DTYPE, count=self.capacity, offset=HEADER_SIZE)
+
+    @property
+    def written(self):
+        return HEADER.unpack_from(self._map, 0)[2]
+
+    @property
+    def committed(self):
+        return HEADER.unpack_from(self._map, 0)[3]
+
+    def _set_counts(self, written, committed):
+        HEADER.pack_into(self._map, 0, MAGIC, TICK_DTYPE.itemsize, written, committed)
+
+    def append(self, ticks):
+        """Copy as many ticks as fit; returns how many were written"""
+        written = self.written
+        n = min(len(ticks), self.capacity - written)
+        self.records[written:written + n] = ticks[:n]
+        self._set_counts(written + n, self.committed)
+        return n
+
+    def commit(self, offset):
+        self._set_counts(self.written, offset)
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        # the record view must go before the map can be closed
+        del self.records
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+class TickJournal:
+    """
+    Append-only journal of the raw tick records of one symbol, in numbered
+    segment files under directory/SYMBOL. Records between a segment's
+    committed and written counts are not yet stored in MongoDB; segments
+    that are full and fully committed are deleted.
+    """
+
+    def __init__(self, directory, symbol, segment_records=DEFAULT_SEGMENT_RECORDS):
+        self.symbol = symbol
+        self.directory = Path(directory) / symbol
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_records = segment_records
+        self._lock = threading.Lock()
+        self._segments = collections.deque(Segment(p) for p in sorted(self.directory.glob('*.seg')))
+        if not self._segments:
+            self._segments.append(self._new_segment(0))
+        backlog = self.pending()
+        if backlog:
+            logging.info(f"{symbol}: {backlog} journaled ticks not yet stored, replaying them")
+
+    def _new_segment(self, seq):
+        return Segment(self.directory / f"{seq:012d}.seg", self.segment_records)
+
+    def pending(self):
+        with self._lock:
+            return sum(seg.written - seg.committed for seg in self._segments)
+
+    def append(self, ticks):
+        """Copy ticks to the journal, starting new segments as they fill up"""
+        with self._lock:
+            while len(ticks):
+                n = self._segments[-1].append(ticks)
+                ticks = ticks[n:]
+                if len(ticks):
+                    seq = int(self._segments[-1].path.stem) + 1
+                    self._segments.append(self._new_segment(seq))
+
+    def read(self, max_records):
+        """
+        Return (records, token): a copy of up to max_records of the oldest
+        uncommitted ticks and the token to pass to commit() once stored.
+        """
+        with self._lock:
+            for seg in self._segments:
+                committed, written = seg.committed, seg.written
+                if committed < written:
+                    end = min(written, committed + max_records)
+                    return seg.records[committed:end].copy(), (seg, end)
+        return np.zeros(0, dtype=TICK_DTYPE), None
+
+    def commit(self, token):
+        """Mark the records returned with token as stored and drop finished segments"""
+        seg, offset = token
+        with self._lock:
+            seg.commit(offset)
+            while (len(self._segments) > 1 and self._segments[0].committed == self._segments[0].written
+                   == self._segments[0].capacity):
+                done = self._segments.popleft()
+                done.close()
+                done.path.unlink()
+
+    def flush(self):
+        with self._lock:
+            for seg in self._segments:
+                seg.flush()
+
+    def close(self):
+        with self._lock:
+            for seg in self._segments:
+                seg.close()
+            self._segments.clear()
+
+
+class JournalWriter:
+    """
+    Background thread that stores journaled ticks in MongoDB.
+
+    prepare(symbol, ticks) turns a batch of ticks into (collection, writes)
+    once, and write(collection, writes) stores them; failed writes are
+    retried with backoff until MongoDB is back, while the fetch loop keeps
+    appending to the journals. A batch is committed only after its write
+    succeeded, so a crash replays it on the next start; other errors are
+    logged and the batch is retried with the same backoff.
+    """
+
+    def __init__(self, journals, prepare, write, replay_batch=DEFAULT_REPLAY_BATCH):
+        self.journals = journals
+        self.prepare = prepare
+        self.write = write
+        self.replay_batch = replay_batch
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+        self._thread.start()
+
+    def append(self, symbol, ticks):
+        """Journal ticks of symbol; they are stored in MongoDB from the writer thread"""
+        if not self._thread.is_alive() and not self._closing:
+            raise RuntimeError('journal writer thread is not running')
+        self.journals[symbol].append(ticks)
+        self._wakeup.set()
+
+    def pending(self, symbol=None):
+        if symbol is not None:
+            return self.journals[symbol].pending()
+        return sum(journal.pending() for journal in self.journals.values())
+
+    def close(self, timeout=None):
+        """Store what is journaled (up to timeout) and stop; the rest is replayed on the next start"""
+        self._closing = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"Journal flush timed out, {self.pending()} ticks left for the next start")
+            return
+        for journal in self.journals.values():
+            journal.close()
+
+    def _store(self, journal, records, token):
+        collection, writes = self.prepare(journal.symbol, records)
+        delay = MIN_RETRY_DELAY
+        while True:
+            try:
+                self.write(collection, writes)
+                break
+            except errors.PyMongoError as e:
+                if self._closing:
+                    raise
+                logging.error(f"{journal.symbol}: MongoDB write failed, {journal.pending()} ticks journaled, "
+                              f"retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+        journal.commit(token)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        delay = MIN_RETRY_DELAY
+        while True:
+            busy = False
+            try:
+                for journal in self.journals.values():
+                    records, token = journal.read(self.replay_batch)
+                    if token is not None:
+                        busy = True
+                        self._store(journal, records, token)
+                delay = MIN_RETRY_DELAY
+                if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    for journal in self.journals.values():
+                        journal.flush()
+                    last_flush = time.monotonic()
+            except errors.PyMongoError as e:
+                logging.error(f"MongoDB unavailable while closing, {self.pending()} ticks left "
+                              f"for the next start: {e}")
+                return
+            except Exception:
+                # the batch stays uncommitted in the journal, so it is retried
+                if self._closing:
+                    logging.exception(f"Storing journaled ticks failed while closing, {self.pending()} ticks "
+                                      f"left for the next start")
+                    return
+                logging.exception(f"Storing journaled ticks failed, {self.pending()} ticks journaled, "
+                                  f"retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            if busy:
+                continue
+            if self._closing:
+                return
+            self._wakeup.wait(FLUSH_INTERVAL)
+            self._wakeup.clear()
+
+
+def add_arguments(parser):
+    """Add the tick journal options"""
+    parser.add_argument('--journal_dir', default=None,
+                        help='Journal new ticks to memory-mapped files in this directory and store them in '
+                             'MongoDB from a background thread, replaying them after outages and restarts '
+                             '(default: disabled)')
+    parser.add_argument('--journal_segment_records', type=int, default=DEFAULT_SEGMENT_RECORDS,
+                        help=f'Ticks per journal segment file (default: {DEFAULT_SEGMENT_RECORDS})')
+
+
+def open_writer(directory, symbols, prepare, write, segment_records=DEFAULT_SEGMENT_RECORDS,
+                replay_batch=DEFAULT_REPLAY_BATCH):
+    """Open the journals of symbols under directory and return a started JournalWriter"""
+    journals = {symbol: TickJournal(directory, symbol, segment_records) for symbol in symbols}
+    writer = JournalWriter(journals, prepare, write, replay_batch)
+    for symbol in symbols:
+        metrics.gauge_callback('mt5_journal_pending', journals[symbol].pending, symbol=symbol)
+    return writer
+
+
+def from_args(args, prepare, write, replay_batch=DEFAULT_REPLAY_BATCH):
+    """Return a started JournalWriter for args.symbols, or None when --journal_dir is not set"""
+    if not args.journal_dir:
+        return None
+    return open_writer(args.journal_dir, args.symbols, prepare, write, args.journal_segment_records, replay_batch)
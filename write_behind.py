@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+import collections
+import logging
+import os
+import pickle
+import threading
+import time
+from pymongo import errors
+
+from mongo_bulk import DEFAULT_BATCH_SIZE, write_unordered
+import metrics
+
+# What to do when the queue is full
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'spill')
+
+DEFAULT_QUEUE_SIZE = 100000
+
+# Retry delay bounds (seconds) while MongoDB is unreachable
+MIN_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30.0
+
+
+def add_arguments(parser):
+    """Add the write-behind options shared by the live fetchers"""
+    parser.add_argument('--write_behind', action='store_true',
+                        help='Queue MongoDB writes and store them from a background thread')
+    parser.add_argument('--queue_size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f'Maximum pending writes in the write-behind queue (default: {DEFAULT_QUEUE_SIZE})')
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default='block',
+                        help='What to do when the write-behind queue is full (default: block)')
+    parser.add_argument('--spill_dir', default='spill',
+                        help='Directory for writes spilled to disk with --overflow spill (default: spill)')
+    parser.add_argument('--flush_timeout', type=float, default=30.0,
+                        help='Seconds to wait for queued writes on shutdown (default: 30)')
+
+
+def from_args(args, batch_size=DEFAULT_BATCH_SIZE, client=None):
+    """
+    Return a started WriteBehindBuffer, or None when --write_behind is not
+    set. client lets it replay spill files left by a previous run.
+    """
+    if not args.write_behind:
+        return None
+    spill_dir = args.spill_dir if args.overflow == 'spill' else None
+    return WriteBehindBuffer(args.queue_size, batch_size, args.overflow, spill_dir, client)
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-process queue drained to MongoDB by a background thread.
+
+    Producers call put() with documents (dicts) or pymongo write requests;
+    the writer thread takes whatever is queued, up to batch_size at a time,
+    and sends it with unordered bulk writes per collection. When the queue
+    holds max_size pending writes the overflow policy applies:
+
+    - block: put() waits until the writer frees space
+    - drop_oldest: the oldest pending writes are discarded
+    - spill: new writes are appended to a file in spill_dir and replayed
+      once the queue has drained. Until every spill file is replayed, later
+      writes are spilled too, so writes reach MongoDB in the order they
+      were put. Spill files left by a previous run are replayed first when
+      a client is given to look their collections up.
+
+    A write that fails with anything other than a connection problem is
+    logged and dropped; the writer thread keeps going.
+    """
+
+    def __init__(self, max_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 policy='block', spill_dir=None, client=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        if policy == 'spill' and not spill_dir:
+            raise ValueError("spill_dir is required for the spill overflow policy")
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.policy = policy
+        self.spill_dir = spill_dir
+        self.written = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.spilled = 0
+        self._items = collections.deque()
+        self._collections = {}
+        self._client = client
+        self._cond = threading.Condition()
+        self._closing = False
+        self._spill_file = None
+        self._spill_seq = 0
+        # spill files waiting to be replayed, oldest first; while any exist new writes are spilled too
+        self._spill_backlog = collections.deque()
+        self._spilling = False
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            stale = sorted((os.path.join(spill_dir, n) for n in os.listdir(spill_dir) if n.startswith('spill-')),
+                           key=lambda path: (os.path.getmtime(path), path))
+            if stale and client is None:
+                logging.warning(f"{len(stale)} spill files from a previous run left in {spill_dir}")
+            elif stale:
+                logging.info(f"Replaying {len(stale)} spill files from a previous run in {spill_dir}")
+                self._spill_backlog.extend(stale)
+                self._spilling = True
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, collection, requests):
+        """Queue writes for collection without waiting on MongoDB"""
+        key = collection.full_name
+        queued_at = time.time()
+        with self._cond:
+            self._collections[key] = collection
+            for request in requests:
+                if self._spilling:
+                    self._spill(key, request, queued_at)
+                    continue
+                while len(self._items) >= self.max_size:
+                    if self.policy == 'block':
+                        self._cond.notify_all()
+                        self._cond.wait()
+                    elif self.policy == 'drop_oldest':
+                        dropped_key = self._items.popleft()[0]
+                        self.dropped += 1
+                        metrics.inc('mt5_dropped_total', collection=self._collections[dropped_key].name)
+                    else:
+                        break
+                if len(self._items) >= self.max_size:
+                    self._spill(key, request, queued_at)
+                else:
+                    self._items.append((key, request, queued_at))
+            self._cond.notify_all()
+        if self.dropped and self.policy == 'drop_oldest':
+            logging.debug(f"Write-behind queue full, {self.dropped} writes dropped so far")
+
+    def close(self, timeout=None):
+        """Flush everything still queued (and spilled) and stop the writer thread"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"Write-behind flush timed out, {len(self._items)} writes not stored")
+        logging.info(f"Write-behind buffer closed: written={self.written}, duplicates={self.duplicates}, "
+                     f"dropped={self.dropped}, spilled={self.spilled}")
+
+    def _spill(self, key, request, queued_at):
+        if self._spill_file is None:
+            path = os.path.join(self.spill_dir, f"spill-{os.getpid()}-{self._spill_seq:06d}.active")
+            self._spill_file = open(path, 'ab')
+        # spill files are local, process-private scratch data
+        pickle.dump((key, request, queued_at), self._spill_file)
+        self._spilling = True
+        self.spilled += 1
+        metrics.inc('mt5_spilled_total', collection=self._collections[key].name)
+
+    def _rotate_spill(self):
+        """Close the active spill file and return its path, ready to be replayed"""
+        if self._spill_file is None:
+            return None
+        self._spill_file.close()
+        path = self._spill_file.name
+        self._spill_file = None
+        self._spill_seq += 1
+        ready = path[:-len('.active')] + '.ready'
+        os.replace(path, ready)
+        return ready
+
+    def _collection(self, key):
+        """Collection of a queued write; ones only known from old spill files are looked up on the client"""
+        collection = self._collections.get(key)
+        if collection is None:
+            db_name, name = key.split('.', 1)
+            collection = self._collections[key] = self._client[db_name][name]
+        return collection
+
+    def _replay_spill(self, path):
+        batch = []
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    batch.append(pickle.load(f))
+                except EOFError:
+                    break
+                except pickle.UnpicklingError as e:
+                    # the last record of a file cut short by a crash
+                    logging.warning(f"Spill file {path} is truncated, replaying the {len(batch)} writes "
+                                    f"before the damage: {e}")
+                    break
+                if len(batch) >= self.batch_size:
+                    self._write(batch)
+                    batch = []
+        if batch:
+            self._write(batch)
+        os.remove(path)
+        logging.info(f"Replayed spilled writes from {path}")
+
+    def _write(self, batch):
+        """Write a batch, retrying while MongoDB is unreachable"""
+        grouped = {}
+        if metrics.enabled():
+            metrics.observe('mt5_write_behind_delay_seconds', time.time() - min(item[2] for item in batch))
+        for key, request, _ in batch:
+            grouped.setdefault(key, []).append(request)
+        delay = MIN_RETRY_DELAY
+        while grouped:
+            key, requests = next(iter(grouped.items()))
+            collection = self._collection(key)
+            try:
+                with metrics.stage('mongo_flush', collection=collection.name):
+                    applied, duplicates = write_unordered(collection, requests, self.batch_size)
+            except errors.BulkWriteError as e:
+                # rejected by the server, retrying would fail the same way
+                logging.error(f"Bulk write to {key} failed, dropping {len(requests)} writes: {e.details}")
+                del grouped[key]
+                continue
+            except errors.PyMongoError as e:
+                logging.error(f"MongoDB write to {key} failed, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            except Exception:
+                # e.g. a document BSON cannot encode; retrying would fail the same way
+                logging.exception(f"Write to {key} failed, dropping {len(requests)} writes")
+                self.dropped += len(requests)
+                metrics.inc('mt5_dropped_total', len(requests), collection=collection.name)
+                del grouped[key]
+                continue
+            self.written += applied
+            self.duplicates += duplicates
+            metrics.inc('mt5_writes_total', applied, collection=collection.name)
+            metrics.inc('mt5_duplicates_total', duplicates, collection=collection.name)
+            logging.info(f"Stored {applied}/{len(requests)} writes in {collection.name} "
+                         f"({duplicates} duplicates, {len(self._items)} queued)")
+            del grouped[key]
+            delay = MIN_RETRY_DELAY
+
+    def _run(self):
+        while True:
+            spill_path = None
+            with self._cond:
+                while not self._items and not self._closing and not self._spilling:
+                    self._cond.wait()
+                if self._items:
+                    n = min(self.batch_size, len(self._items))
+                    batch = [self._items.popleft() for _ in range(n)]
+                    self._cond.notify_all()
+                else:
+                    batch = None
+                    # queue drained: replay what overflowed to disk, oldest file first
+                    if not self._spill_backlog:
+                        ready = self._rotate_spill()
+                        if ready is not None:
+                            self._spill_backlog.append(ready)
+                    if self._spill_backlog:
+                        spill_path = self._spill_backlog.popleft()
+                    else:
+                        # everything spilled is stored, new writes may use the queue again
+                        self._spilling = False
+                        if self._closing:
+                            return
+                        continue
+            try:
+                if batch:
+                    self._write(batch)
+                else:
+                    self._replay_spill(spill_path)
+            except Exception:
+                logging.exception(f"Write-behind writer failed on {'a batch' if batch else spill_path}, "
+                                  f"continuing")